@@ -1,12 +1,39 @@
 
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
-import numpy as np
-from pyecharts.commons.utils import JsCode
-from pyecharts.charts import Bar, Line  # 关键修正点
-from pyecharts import options as opts
-from pyecharts.globals import ThemeType
-import streamlit.components.v1 as components
+
+from anomaly import AnomalyDetector, anomaly_marks
+from charts import RenderCache, build_series_chart, chart_option, frame_fingerprint, render_charts, specs_for
+from db import install_query_timeout, reader, replica_is_current, route_reader
+from diagnosis import DIAGNOSIS_KPIS, LEVEL_KEYS, drill_series, level_sums, rank_worst
+from export import download_link, formats, iter_frame, write_export
+from headline import HeadlineCube, share
+from llm_analysis import ChatClient, LLMAnalyzer, build_summaries
+from kpi_engine import split_counters
+from live_chart import forget_charts, live_chart
+from perf import NULL_RECORDER, PerfRecorder, frame_bytes, logger as perf_logger
+from queries import (
+    CELL_SUMS_QUERY, DATED_QUERIES, DIMENSION_QUERY, DRILL_QUERIES, FINE_COUNTERS_QUERY,
+    QUERY_DICT, RAW_COUNTERS_QUERY,
+)
+from query_layer import SliceCache, normalize_frame, read_chunks, read_frame
+from refresher import RefreshAhead, logger as refresh_logger
+from rollup import Watermark
+from shards import ShardedEngine, refresh_rollups
+from snapshot_store import SnapshotStore
+from timebuckets import LEVEL_ORDER, LEVELS, TimeBucketEngine, choose_level
+
+# 写时复制：会话从进程级缓存取到的切片、列选择都是共享同一份数据的只读视图，
+# 写入时才复制被写的部分（pandas >= 3 已默认开启，再设置会告警；pandas < 1.5 无此选项）
+if int(pd.__version__.split(".")[0]) < 3:
+    try:
+        pd.set_option("mode.copy_on_write", True)
+    except KeyError:
+        pass
 
 # 必须作为第一个Streamlit命令
 st.set_page_config(
@@ -17,16 +44,385 @@ st.set_page_config(
 )
 
 # 缓存数据库连接（单例模式）
+# 连接池大小、超时等在 secrets.toml 的 [connections.my_database.create_engine_kwargs] 中配置
 @st.cache_resource(show_spinner="🔄 初始化数据库连接...")
 def get_db_connection():
-    return st.connection("my_database")
+    conn = st.connection("my_database")
+    install_query_timeout(conn.engine)
+    return conn
+
+# 只读副本（secrets.toml 中配置 [connections.my_database_replica] 时启用）
+@st.cache_resource(show_spinner="🔄 初始化只读副本连接...")
+def get_replica_connection():
+    if "my_database_replica" not in st.secrets.get("connections", {}):
+        return None
+    try:
+        conn = st.connection("my_database_replica")
+    except Exception as e:
+        st.warning(f"只读副本连接失败，分析查询将使用主库: {str(e)}")
+        return None
+    install_query_timeout(conn.engine)
+    return conn
+
+# 多省份分片（secrets.toml 中配置 [shards] 时启用）：每个省份一个连接，
+# 看板查询并行下发到各分片后合并计数器和，汇总表在各分片上各自维护
+@st.cache_resource(show_spinner="🔄 初始化分片连接...")
+def get_sharded_engine():
+    shards = st.secrets.get("shards", {})
+    if not shards:
+        return None
+    engines = {}
+    for name, connection in shards.items():
+        conn = st.connection(connection)
+        install_query_timeout(conn.engine)
+        engines[name] = conn.engine
+    return ShardedEngine(engines)
+
+# 汇总表维护与快照导出使用的引擎：配置分片时为分片引擎，否则为主库
+def primary_engine(conn):
+    sharded = get_sharded_engine()
+    return sharded if sharded is not None else conn.engine
+
+# 副本是否已追上主库的汇总表水位线（短 TTL，副本延迟恢复后自动切回）
+@st.cache_data(show_spinner=False, ttl=60)
+def replica_ready(_conn, _replica, watermark=None):
+    try:
+        return replica_is_current(_replica.engine, _conn.engine)
+    except Exception:
+        return False
+
+# 分析查询的读引擎：优先只读副本，带查询超时（分片部署直接读各分片）
+def get_read_engine(conn, watermark):
+    timeout_ms = st.secrets.get("dashboard", {}).get("query_timeout_ms")
+    sharded = get_sharded_engine()
+    if sharded is not None:
+        return reader(sharded, timeout_ms)
+    replica = get_replica_connection()
+    if replica is None:
+        return reader(conn.engine, timeout_ms)
+    return route_reader(
+        conn.engine, replica.engine, timeout_ms,
+        replica_current=lambda _replica, _primary: replica_ready(conn, replica, watermark),
+    )
+
+# 本地 Parquet 快照（跨重启、跨副本共享）
+@st.cache_resource
+def get_snapshot_store():
+    path = st.secrets.get("snapshot", {}).get("path", "snapshot")
+    return SnapshotStore(path)
+
+# 进程级日期分片缓存（所有会话共享）
+@st.cache_resource
+def get_slice_cache():
+    return SliceCache()
+
+# 快照模式：inline（默认）由看板进程自己刷新汇总表和快照；
+# worker 由 worker.py 定时发布快照，看板只读取已发布的版本
+def snapshot_mode():
+    return st.secrets.get("snapshot", {}).get("mode", "inline")
+
+# 汇总表与快照的刷新（所有会话共享，同一时刻只有一个刷新在执行）
+# 到期前在后台刷新并预热默认筛选的数据，完成后才切换到新水位线，
+# 会话始终直接拿到当前水位线，不必等待刷新
+# 冷启动时已有快照：以快照水位线作为初始值，先从快照读取，折叠、导出与预热在后台进行
+@st.cache_resource
+def get_refresher(_conn, mode="inline"):
+    store = get_snapshot_store()
+    cache = get_slice_cache()
+    engine = primary_engine(_conn)
+
+    if mode == "worker":
+        # 只读：轮询快照 manifest，发现新版本后切换
+        def refresh(previous):
+            watermark = Watermark.parse(store.manifest().get("watermark"))
+            if watermark != previous:
+                cache.sync_watermark(watermark)
+                prewarm(store.dimensions(), engine, store, cache)
+            return watermark
+
+        return RefreshAhead(refresh, ttl=60, lead=30)
+
+    def refresh(previous):
+        watermark = refresh_rollups(engine)
+        try:
+            store.refresh(engine, watermark)
+        except Exception:
+            refresh_logger.exception("snapshot refresh failed")
+        if watermark != previous:
+            cache.sync_watermark(watermark)
+            prewarm(read_frame(engine, DIMENSION_QUERY), engine, store, cache)
+        return watermark
+
+    seed = Watermark.parse(store.manifest().get("watermark")) if store.available else None
+    if seed is not None:
+        cache.sync_watermark(seed)
+    return RefreshAhead(refresh, ttl=3600, lead=300, initial=seed)
+
+# 筛选维度：各地市可用的日期范围（只读汇总表，开销很小；快照即当前版本时读快照）
+@st.cache_data(show_spinner="📊 正在加载筛选条件...", ttl=3600)
+def load_dimensions(_engine, watermark=None):
+    try:
+        store = get_snapshot_store()
+        if snapshot_mode() == "worker" or store.is_current(watermark):
+            return store.dimensions()
+        return read_frame(_engine, DIMENSION_QUERY)
+    except Exception as e:
+        st.error(f"加载筛选条件失败: {str(e)}")
+        return pd.DataFrame()
 
-# 缓存数据查询（带自动刷新）
-@st.cache_data(show_spinner="📊 正在加载数据...", ttl=3600)
-def load_data(_conn, query_name, query_sql):
+# 图表HTML渲染缓存（所有会话共享，有界LRU）
+@st.cache_resource
+def get_render_cache():
+    return RenderCache(maxsize=64)
+
+# 时间分桶汇总缓存（所有会话共享）
+@st.cache_resource
+def get_bucket_engine():
+    return TimeBucketEngine()
+
+# KPI 异常检测（所有会话共享，新数据到达时只重算尾部）
+@st.cache_resource
+def get_anomaly_detector():
+    return AnomalyDetector()
+
+# 指标卡立方体：同一水位线、同一筛选条件下的数据相同，按筛选条件缓存
+@st.cache_resource(ttl=3600, max_entries=16)
+def get_headline_cube(watermark, cities, start, end, _base_df, _traffic_df):
+    return HeadlineCube(_base_df, _traffic_df)
+
+# 查询线程池（所有会话共享，三个数据集并行加载）
+@st.cache_resource
+def get_query_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="load_data")
+
+# 按所选 日期范围 × 地市 拉取数据，只补拉缓存中缺失的分片
+# 优先读取本地快照，快照未覆盖的范围再查库
+# 在线程池中执行，不能调用任何 st.* 命令
+def fetch_data(engine, store, cache, perf, query_name, query_sql, cities, date_range=None):
+    fetched = []
+
+    def fetch(start, end, fetch_cities):
+        # 快照水位线落后于缓存水位线时（快照刷新失败），只读取快照中已定型的日期
+        covered = store.covers(query_name, start, end, cache.watermark)
+        source = "snapshot" if covered else "mysql"
+        span = f"{start:%Y-%m-%d}~{end:%Y-%m-%d}" if start is not None else "-"
+        with perf.stage(f"fetch:{query_name}", source=source, span=span,
+                        cities=len(fetch_cities)) as record:
+            if source == "snapshot":
+                df = store.read(query_name, fetch_cities, start, end)
+            else:
+                params = {"cities": fetch_cities}
+                if start is not None:
+                    params.update(start=start.date(), end=end.date())
+                df = read_frame(engine, query_sql, params)
+            record["rows"] = len(df)
+            record["bytes"] = frame_bytes(df)
+        fetched.append(df)
+        return df
+
+    start, end = date_range if date_range else (None, None)
+    with perf.stage(f"load:{query_name}") as record:
+        df = cache.get(query_name, fetch, cities, start, end)
+        record["cache"] = "miss" if fetched else "hit"
+        record["rows"] = len(df)
+    return df
+
+# 预热默认筛选（全部地市 × 全部日期）的分片缓存，在后台刷新线程中执行
+def prewarm(dims, engine, store, cache):
+    if dims.empty:
+        return
+    cities = dims['地市编码'].tolist()
+    date_range = (
+        pd.to_datetime(dims['最早日期']).min().date(),
+        pd.to_datetime(dims['最晚日期']).max().date(),
+    )
+    for name, sql in QUERY_DICT.items():
+        fetch_data(engine, store, cache, NULL_RECORDER, name, sql, cities,
+                   date_range if name in DATED_QUERIES else None)
+
+# 业务诊断：所选窗口内每个小区一行的计数器合计
+# 结果可达百万行，用 cache_resource 共享同一份只读数据，避免 cache_data 每次反序列化复制
+@st.cache_resource(show_spinner="🔍 正在汇总小区级指标...", ttl=3600, max_entries=4)
+def load_cell_sums(_engine, watermark, cities, start, end):
+    df = read_frame(_engine, CELL_SUMS_QUERY, {
+        "start": start, "end": end, "cities": list(cities),
+    })
+    return normalize_frame(df, dated=False)
+
+# 诊断排名粒度的计数器合计（基站级由小区合计再求和）
+@st.cache_resource(ttl=3600, max_entries=8)
+def load_level_sums(_engine, watermark, cities, start, end, level):
+    return level_sums(load_cell_sums(_engine, watermark, cities, start, end), level)
+
+# 业务诊断下钻：单个小区/基站的逐日计数器
+@st.cache_data(ttl=3600, max_entries=64)
+def load_drill_series(_engine, watermark, level, name, city, start, end):
+    return read_frame(_engine, DRILL_QUERIES[level], {
+        "name": name, "city": city, "start": start, "end": end,
+    })
+
+# 业务诊断标签页：最差小区/基站排名 + 单对象时序下钻
+def show_diagnosis(engine, watermark, cities, date_range, perf):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        kpi = st.selectbox("诊断指标", options=DIAGNOSIS_KPIS)
+    with col2:
+        level = st.radio("排名粒度", options=list(LEVEL_KEYS), horizontal=True)
+    with col3:
+        top_n = st.number_input("最差 N 个", min_value=5, max_value=200, value=20, step=5)
+
+    # 小区级汇总按需加载：首次打开诊断前不查询
+    if not st.toggle("加载小区级诊断数据", value=False):
+        st.info("打开开关后按所选日期与地市汇总小区级指标")
+        return
+    if not cities:
+        st.warning("请至少选择一个地市")
+        return
+
+    start, end = date_range
+    try:
+        with perf.stage(f"diagnosis:sums/{level}") as record:
+            sums = load_level_sums(engine, watermark, tuple(sorted(cities)), start, end, level)
+            record["rows"] = len(sums)
+    except Exception as e:
+        st.error(f"加载小区级指标失败: {str(e)}")
+        return
+
+    with perf.stage(f"diagnosis:rank/{kpi}", k=top_n):
+        worst = rank_worst(sums, kpi, k=top_n, level=level)
+    if worst.empty:
+        st.warning("所选范围内无满足样本量要求的数据")
+        return
+
+    st.caption(f"共 {len(sums):,} 个{level}参与排名，按{kpi}由差到好排列")
+    st.dataframe(worst, use_container_width=True, hide_index=True)
+
+    # 下钻：选中对象的逐日 KPI
+    name_col = "小区名称" if level == "小区" else "基站名称"
+    options = list(worst.index)
+    choice = st.selectbox(
+        f"{level}下钻",
+        options=options,
+        format_func=lambda i: f"{worst.at[i, name_col]}（{worst.at[i, '地市编码']}）",
+    )
+    row = worst.loc[choice]
+    try:
+        with perf.stage(f"diagnosis:drill/{level}"):
+            series = drill_series(load_drill_series(
+                engine, watermark, level, row[name_col], row["地市编码"], start, end
+            ))
+    except Exception as e:
+        st.error(f"加载下钻数据失败: {str(e)}")
+        return
+    if series.empty:
+        st.warning("该对象在所选范围内无数据")
+        return
+    live_chart(chart_option(build_series_chart(series)), key="chart:下钻", height=450)
+
+# 大模型分析（secrets.toml 中配置 [llm] 时启用，所有会话共享结果缓存）
+@st.cache_resource
+def get_llm_analyzer():
+    config = st.secrets.get("llm", {})
+    if not config.get("base_url") or not config.get("model"):
+        return None
+    client = ChatClient(
+        config["base_url"], config["model"],
+        api_key=config.get("api_key"), timeout=config.get("timeout", 60),
+    )
+    return LLMAnalyzer(client, config.get("cache_dir", "llm_cache"))
+
+# 业务诊断：大模型分析当前筛选数据的统计摘要，后台生成，页面不等待
+def show_llm_analysis(chart_data, anomalies, perf):
+    st.subheader("🤖 智能分析")
+    analyzer = get_llm_analyzer()
+    if analyzer is None:
+        st.info("未配置大模型接口（secrets.toml 中的 [llm] base_url / model）")
+        return
+
+    with perf.stage("llm:summaries") as record:
+        sections = build_summaries(chart_data['kpi_df'], chart_data['traffic_df'], anomalies)
+        results = analyzer.analyze(sections)
+        record["sections"] = len(sections)
+    if not sections:
+        st.warning("当前筛选无可分析的数据")
+        return
+
+    running, failed = analyzer.status(sections)
+    for title, _ in sections:
+        with st.expander(title, expanded=results[title] is not None):
+            if results[title] is not None:
+                st.markdown(results[title])
+            elif title in failed:
+                st.error(f"生成失败: {failed[title]}")
+            else:
+                st.caption("⏳ 分析生成中...")
+    col1, col2 = st.columns(2)
+    with col1:
+        if running and st.button("刷新分析结果"):
+            st.rerun()
+    with col2:
+        if failed and st.button("重试失败部分"):
+            analyzer.retry(sections)
+            st.rerun()
+
+# 数据导出：看板数据按行切块、原始计数器走服务端游标，逐块写入磁盘后提供下载
+def show_export(engine, get_chart_data, cities, date_range, perf):
+    targets = {
+        "业务量（traffic_df）": "traffic_df",
+        "KPI计数器（kpi_df）": "kpi_df",
+        "小区原始计数器（kpibase）": "raw_counters",
+    }
+    col1, col2 = st.columns(2)
+    with col1:
+        target = st.selectbox("导出内容", options=list(targets))
+    with col2:
+        fmt = st.radio("文件格式", options=formats(), horizontal=True)
+    if not st.button("生成导出文件"):
+        return
+
+    name = targets[target]
+    if name == "raw_counters":
+        # 流式导出可能持续数分钟：不沿用分析查询的超时，改用 [dashboard] export_timeout_ms（默认不限时）
+        export_timeout_ms = st.secrets.get("dashboard", {}).get("export_timeout_ms")
+        start, end = date_range
+        chunks = read_chunks(reader(engine, export_timeout_ms), RAW_COUNTERS_QUERY, {
+            "start": pd.Timestamp(start).to_pydatetime(),
+            "end": (pd.Timestamp(end) + pd.Timedelta(days=1)).to_pydatetime(),
+            "cities": cities,
+        })
+    else:
+        chunks = iter_frame(get_chart_data()[name])
+
+    try:
+        with st.spinner("正在生成导出文件..."), perf.stage(f"export:{name}", format=fmt) as record:
+            parts = write_export(chunks, fmt, name)
+            record["rows"] = sum(rows for _, rows in parts)
+            record["bytes"] = sum(path.stat().st_size for path, _ in parts)
+            record["parts"] = len(parts)
+    except Exception as e:
+        st.error(f"导出失败: {str(e)}")
+        return
+
+    total_mb = record["bytes"] / 1024 / 1024
+    static = st.get_option("server.enableStaticServing")
+    st.markdown(f"✅ 共 {record['rows']:,} 行，{total_mb:,.1f} MB"
+                + (f"，分为 {len(parts)} 个文件" if len(parts) > 1 else ""))
+    for i, (path, rows) in enumerate(parts):
+        size_mb = path.stat().st_size / 1024 / 1024
+        link = download_link(path) if static else None
+        if link is not None:
+            # 静态链接由服务端直接从磁盘分块发送，不占用看板进程内存
+            st.markdown(f"{link}（{rows:,} 行，{size_mb:,.1f} MB）", unsafe_allow_html=True)
+        else:
+            st.caption(f"{path.name}：{rows:,} 行，{size_mb:,.1f} MB（未经静态文件服务，下载时需整体读入内存）")
+            with open(path, "rb") as f:
+                st.download_button("下载", data=f, file_name=path.name, key=f"export_{i}")
+
+# 在主线程等待对应数据集加载完成
+def load_data(query_name, future):
     try:
         with st.spinner(f"正在加载 {query_name} 数据..."):
-            df = _conn.query(query_sql)
+            df = future.result()
             if df.empty:
                 st.warning(f"{query_name} 数据为空")
             return df
@@ -34,127 +430,54 @@ def load_data(_conn, query_name, query_sql):
         st.error(f"加载 {query_name} 失败: {str(e)}")
         return pd.DataFrame()
 
-# 查询定义字典
-QUERY_DICT = {
-    "base_df": """
-    SELECT 
-        SJGZQYMC AS 省份编码,
-        DSJGZQYMC AS 地市编码,
-        frequency_band AS 频段,
-        COUNT(DISTINCT station_name) AS 5g基站数,
-        COUNT(DISTINCT cell_name) AS 5g小区数
-    FROM btsbase
-    GROUP BY SJGZQYMC, DSJGZQYMC, frequency_band
-    """,
-    
-    "traffic_df":"""
-    SELECT
-        -- 按天和区域分组
-        DATE(k.开始时间) AS 日期,
-        b.SJGZQYMC AS 省份编码,
-        b.DSJGZQYMC AS 地市编码,
-        b.frequency_band AS 频段,
-        -- 日级聚合计算
-        ROUND((SUM(k.R2032_001) + SUM(k.R2032_012)) / 1e9,2) AS 总流量_TB,  -- 日总流量（TB）
-        ROUND(SUM(k.R2032_012) / 1e9,2) AS 下行流量_TB,                     -- 日下行流量（GB）
-        ROUND(SUM(k.R2032_001) / 1e9,2) AS 上行流量_TB,                     -- 日上行流量（GB）
-        ROUND(SUM(k.K1009_001) / 4000,2) AS VoNR语音话务量_千Erl,          -- 日语音话务量
-        ROUND(SUM(k.K1009_002) / 4000,2) AS ViNR视频话务量_千Erl          -- 日视频话务量
-    FROM 
-        btsbase b
-    INNER JOIN 
-        kpibase k ON b.ID = k.ID
-    GROUP BY 
-        DATE(k.开始时间),  -- 按天分组
-        b.SJGZQYMC,         -- 按区域分组
-        b.DSJGZQYMC,
-        b.frequency_band;
-    """,
-    
-    "kpi_df": """
-            SELECT
-                DATE(k.开始时间) AS 日期,
-                b.SJGZQYMC AS 省份编码,
-                b.DSJGZQYMC AS 地市编码,
-                b.frequency_band AS 频段,
-        
-                -- 无线接通率
-                ROUND(
-                    (SUM(k.R1001_012) / NULLIF(SUM(k.R1001_001), 0)) 
-                    * (SUM(k.R1034_012) / NULLIF(SUM(k.R1034_001), 0)) 
-                    * (SUM(k.R1039_002) / NULLIF(SUM(k.R1039_001), 0)) 
-                    * 100, 
-                    2
-                ) AS 无线接通率,
-                
-                -- 无线掉线率
-                ROUND(
-                    100 * (SUM(k.R2004_003) - SUM(k.R2004_004)) 
-                    / NULLIF(SUM(k.R2004_003) + SUM(k.R2004_006), 0), 
-                    2
-                ) AS 无线掉线率,
-                
-                -- 切换成功率
-                ROUND(
-                    100 * (
-                        (SUM(k.R2007_002) + SUM(k.R2007_004) + SUM(k.R2006_004) + SUM(k.R2006_008) + SUM(k.R2005_004) + SUM(k.R2005_008)) 
-                        / NULLIF(
-                            SUM(k.R2007_001) + SUM(k.R2007_003) + SUM(k.R2006_001) + SUM(k.R2006_005) + SUM(k.R2005_001) + SUM(k.R2005_005), 
-                            0
-                        )
-                    ), 
-                    2
-                ) AS 切换成功率,
-                
-                -- VONR无线接通率
-                ROUND(
-                    100 * (SUM(k.R1034_013) / NULLIF(SUM(k.R1034_002), 0)) 
-                    * (SUM(k.R1001_018) + SUM(k.R1001_015)) 
-                    / NULLIF(SUM(k.R1001_007) + SUM(k.R1001_004), 0), 
-                    2
-                ) AS VONR无线接通率,
-                
-                -- VONR无线掉线率
-                ROUND(
-                    100 * (SUM(k.R2035_003) - SUM(k.R2035_013)) 
-                    / NULLIF(SUM(k.R2035_003) + SUM(k.R2035_026), 0), 
-                    2
-                ) AS VONR无线掉线率,
-                
-                -- VONR切换成功率
-                ROUND(
-                    100 * (
-                        (
-                            SUM(k.R2005_027) + SUM(k.R2005_031) + SUM(k.R2005_039) 
-                            + SUM(k.R2006_025) + SUM(k.R2006_029) + SUM(k.R2006_037) 
-                            + SUM(k.R2007_008) + SUM(k.R2007_010) + SUM(k.R2007_014)
-                        ) 
-                        / NULLIF(
-                            SUM(k.R2005_024) + SUM(k.R2005_028) + SUM(k.R2005_036) 
-                            + SUM(k.R2006_022) + SUM(k.R2006_026) + SUM(k.R2006_034) 
-                            + SUM(k.R2007_007) + SUM(k.R2007_009) + SUM(k.R2007_013), 
-                            0
-                        )
-                    ), 
-                    2
-                ) AS VONR切换成功率
-            FROM 
-                btsbase b
-            INNER JOIN 
-                kpibase k ON b.ID = k.ID
-            GROUP BY DATE(k.开始时间), b.SJGZQYMC, b.DSJGZQYMC , b.frequency_band;
-    """
-}
+# 性能日志以 JSON 行写到标准错误（进程内只配置一次）
+@st.cache_resource
+def setup_perf_logging():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+    perf_logger.addHandler(handler)
+    perf_logger.setLevel(logging.INFO)
+    perf_logger.propagate = False
+    return perf_logger
+
+# 性能调试面板
+def show_perf_panel(perf):
+    st.subheader("🛠 性能调试")
+    st.caption(f"本次运行 {perf.run_id} 总耗时 {perf.elapsed_ms():,.0f} ms")
+    records = pd.DataFrame(perf.records)
+    st.dataframe(records, use_container_width=True, hide_index=True)
+    cache = get_render_cache()
+    st.caption(f"图表缓存命中 {cache.hits} / 未命中 {cache.misses}")
+
+# 看板视图：{标签页: 标题}，与 charts.py 中 ChartSpec.tab 对应
+VIEWS = {"tab1": "📡 基站价值", "tab2": "📶 网络性能", "tab3": "📊 业务诊断"}
 
 def main():
+    setup_perf_logging()
+    perf = PerfRecorder()
+
     # 初始化连接
-    conn = get_db_connection()
-    
-    # 加载数据
-    data = {
-        name: load_data(conn, name, sql)
-        for name, sql in QUERY_DICT.items()
-    }
+    with perf.stage("get_db_connection"):
+        conn = get_db_connection()
+    # 汇总表水位线：首次加载需等待，之后到期前在后台刷新
+    refresher = get_refresher(conn, snapshot_mode())
+    with perf.stage("refresh", cache="hit" if refresher.loaded else "miss"):
+        try:
+            if refresher.loaded:
+                watermark = refresher.get()
+            else:
+                with st.spinner("🔄 正在同步汇总表..."):
+                    watermark = refresher.get()
+        except Exception as e:
+            st.error(f"同步汇总表失败: {str(e)}")
+            watermark = None
+    if watermark is None and snapshot_mode() == "worker":
+        st.warning("快照尚未发布，请先运行 python worker.py")
+    with perf.stage("get_read_engine"):
+        read_engine = get_read_engine(conn, watermark)
+    slice_cache = get_slice_cache()
+    with perf.stage("load_dimensions"):
+        dims = load_dimensions(read_engine, watermark)
     
         # ========== 侧边栏 ==========
     with st.sidebar:
@@ -162,10 +485,9 @@ def main():
         
         # 获取有效日期范围
         try:
-            traffic_dates = pd.to_datetime(data['traffic_df']['日期'])
-            min_date = traffic_dates.min().date()
-            max_date = traffic_dates.max().date()
-        except KeyError:
+            min_date = pd.to_datetime(dims['最早日期']).min().date()
+            max_date = pd.to_datetime(dims['最晚日期']).max().date()
+        except (KeyError, ValueError, AttributeError):
             min_date = max_date = pd.to_datetime('today').date()
 
         # 日期范围选择（关键修正点）
@@ -180,9 +502,9 @@ def main():
         if len(selected_dates) == 1:
             selected_dates = [selected_dates[0], selected_dates[0]]
 
-        # 地市多选（使用原始数据）
+        # 地市多选（使用汇总表中的地市）
         try:
-            cities = data['traffic_df']['地市编码'].unique().tolist()
+            cities = dims['地市编码'].tolist()
             selected_cities = st.multiselect(
                 "地市筛选",
                 options=cities,
@@ -192,701 +514,219 @@ def main():
             cities = []
             selected_cities = []
 
-   # ========== 数据过滤 ==========
-
-    def filter_data(df_name, df):
-        """支持不同数据集的差异化过滤"""
-        try:
-            # 日期过滤（使用已定义的selected_dates）
-            start_date = selected_dates[0]
-            end_date = selected_dates[-1]  # 兼容单选情况
-            
-            date_mask = (
-                (pd.to_datetime(df['日期']) >= pd.to_datetime(start_date)) &
-                (pd.to_datetime(df['日期']) <= pd.to_datetime(end_date))
-            )
-            
-            # 数据集特定过滤
-            if df_name == 'traffic_df':
-                city_mask = df['地市编码'].isin(selected_cities)
-                return df[date_mask & city_mask]
-            elif df_name == 'kpi_df':
-                city_mask = df['地市编码'].isin(selected_cities)
-                return df[date_mask & city_mask]
-            else:
-                return df
-        except KeyError as e:
-            st.error(f"数据集 {df_name} 缺少必要字段: {str(e)}")
-            return df
+        # 时间粒度（小时/15分钟下钻读取15分钟汇总表）
+        granularity = st.selectbox(
+            "时间粒度",
+            options=LEVEL_ORDER,
+            index=LEVEL_ORDER.index("day"),
+            format_func=lambda level: LEVELS[level].label,
+        )
 
-    # 应用过滤
-    filtered_data = {
-        'base_df': data['base_df'][
-            data['base_df']['地市编码'].isin(selected_cities)
-        ].copy(),
-        'traffic_df': filter_data('traffic_df', data['traffic_df']),
-        'kpi_df': filter_data('kpi_df', data['kpi_df'])
+        show_perf = st.checkbox("显示性能调试面板", value=False)
+        perf_slot = st.empty()
+
+    # ========== 数据加载（筛选条件下推到查询，三个数据集并行） ==========
+    date_range = (selected_dates[0], selected_dates[-1])
+    executor = get_query_executor()
+    store = get_snapshot_store()
+    futures = {
+        name: executor.submit(
+            fetch_data, read_engine, store, slice_cache, perf, name, sql, selected_cities,
+            date_range if name in DATED_QUERIES else None
+        )
+        for name, sql in QUERY_DICT.items()
     }
 
+    # 所选范围时间桶过多时自动放大粒度；只有小时/15分钟粒度才加载15分钟汇总表
+    # （在后台预取，当前视图不需要图表数据时也不等待）
+    level = choose_level(granularity, *date_range)
+    if LEVELS[level].source == "15min":
+        futures['fine_counters_df'] = executor.submit(
+            fetch_data, read_engine, store, slice_cache, perf, 'fine_counters_df',
+            FINE_COUNTERS_QUERY,
+            selected_cities, date_range
+        )
+
+    # 按需等待对应数据集，先到先渲染
+    filtered_data = {}
+    def resolve(*names):
+        for name in names:
+            if name not in filtered_data:
+                filtered_data[name] = load_data(name, futures[name])
+
+    resolve('base_df', 'counters_df')
+    with perf.stage("split_counters"):
+        filtered_data['traffic_df'], filtered_data['kpi_df'] = split_counters(
+            filtered_data['counters_df']
+        )
+
+    # 图表渲染：图表声明 + 数据指纹 未变化时直接复用上次生成的 option
+    fingerprints = {}
+    def fingerprint(data_name, frames=None):
+        if data_name not in fingerprints:
+            frames = get_chart_data() if frames is None else frames
+            with perf.stage(f"fingerprint:{data_name}"):
+                fingerprints[data_name] = frame_fingerprint(frames[data_name])
+        return fingerprints[data_name]
+
+    # 以下数据整形只在当前视图用到时执行（每次运行至多一次），
+    # 其他视图的结果留在进程级缓存（时间分桶、异常检测、图表 option）中，切换视图时直接命中
+
+    # 图表数据按所选时间粒度汇总（指标卡始终基于日级数据）
+    @functools.cache
+    def get_chart_data():
+        chart_data = dict(filtered_data)
+        if level == "day":
+            return chart_data
+        if LEVELS[level].source == "15min":
+            resolve('fine_counters_df')
+            chart_data['fine_counters_df'] = filtered_data['fine_counters_df']
+        sources = {"day": "counters_df", "15min": "fine_counters_df"}
+        with perf.stage(f"bucket:{level}"):
+            counters = get_bucket_engine().counters(
+                level,
+                {source: chart_data.get(name) for source, name in sources.items()},
+                lambda source: fingerprint(sources[source], chart_data),
+            )
+            chart_data['traffic_df'], chart_data['kpi_df'] = split_counters(counters)
+        return chart_data
+
+    # KPI 异常检测：所有 地市×频段×KPI 序列一次向量化完成
+    @functools.cache
+    def get_anomalies():
+        with perf.stage(f"anomaly:{level}") as record:
+            try:
+                anomalies = get_anomaly_detector().detect(
+                    (level, tuple(sorted(selected_cities))), get_chart_data()['kpi_df'], level
+                )
+            except Exception as e:
+                st.warning(f"异常检测失败: {str(e)}")
+                anomalies = pd.DataFrame()
+            record["rows"] = len(anomalies)
+        return anomalies
+
+    def show_charts(specs):
+        """按每行3列排布一组图表"""
+        marks = None
+        if any(spec.dataset == "kpi_df" for spec in specs):
+            marks = anomaly_marks(get_anomalies())
+        options = render_charts(specs, get_chart_data(), get_render_cache(), fingerprint, perf, marks)
+        for row_start in range(0, len(specs), 3):
+            with st.container():
+                columns = st.columns(3)
+                for column, spec in zip(columns, specs[row_start:row_start + 3]):
+                    with column:
+                        st.subheader(spec.chart_id)
+                        if spec.chart_id in options:
+                            # 固定 key：iframe 跨重跑保留，只发送 option 的增量
+                            with perf.stage(f"live_chart:{spec.chart_id}") as record:
+                                record["bytes"] = live_chart(
+                                    options[spec.chart_id], key=f"chart:{spec.chart_id}", height=500
+                                )
+                        elif spec.empty_text:
+                            st.warning(spec.empty_text)
 
     # 标题区
     st.title("📶 5G网络运营")
     st.caption("数据更新周期：每小时自动刷新 | 数据源：YD核心网管系统")
+    if refresher.loaded and refresher.last_error is not None:
+        st.warning(
+            f"后台刷新失败，当前显示 {refresher.refreshed_at:%Y-%m-%d %H:%M} "
+            f"刷新的数据: {str(refresher.last_error)}"
+        )
+    if level != granularity:
+        st.info(
+            f"所选日期范围按{LEVELS[granularity].label}粒度数据点过多，"
+            f"图表已自动切换为{LEVELS[level].label}粒度"
+        )
     
-    # 关键指标卡
-    col1, col2, col3 ,col4 = st.columns(4)
-    with col1:   
-        try:
-            total = filtered_data['base_df']['5g基站数'].sum()
-            # 添加黄冈市保护
-            band41_query = filtered_data['base_df'].query("频段 == 'band41'")
-            band41 = band41_query['5g基站数'].sum() if not band41_query.empty else 0
-            ratio = (band41 / total) * 100 if total > 0 else 0
-            st.metric("5G基站数", 
-                    f"{total:,}",
-                    delta=f"{(ratio - 50):+.1f}% vs 700M",
-                    help="2.6GHz频段(band41)基站占比")
-        except KeyError:
-            st.error("缺少必要数据列")
-        except ZeroDivisionError:
-            st.warning("无小区数据")
-    
-    with col2:
-        try:
-            total = filtered_data['base_df']['5g小区数'].sum()
-            band41 = filtered_data['base_df'].query("频段 == 'band41'")['5g小区数'].sum()
-            ratio = (band41 / total) * 100 if total > 0 else 0
-            st.metric("5G小区数", 
-                    f"{filtered_data['base_df']['5g小区数'].sum():,}",
-                    delta=f"{(ratio - 50):+.1f}% vs 700M",
-                    help="2.6GHz频段(band41)小区占比")
-        except KeyError:
-            st.error("缺少必要数据列")
-        except ZeroDivisionError:
-            st.warning("无小区数据")
-    
-    with col3:
-        try:
-            # 第一步：按日期汇总总流量后计算日均
-            daily_total = filtered_data['traffic_df'].groupby('日期')['总流量_TB'].sum()
-            total_avg = round(daily_total.mean(), 2) if not daily_total.empty else 0.00
-
-            # 第二步：筛选band41后按日期汇总，再计算日均
-            band41_df = filtered_data['traffic_df'].query("频段 == 'band41'")
-            daily_band41 = band41_df.groupby('日期')['总流量_TB'].sum() if not band41_df.empty else pd.Series([0])
-            band41_avg = round(daily_band41.mean(), 2) if not daily_band41.empty else 0.00
-
-            # 计算占比（带多重保护）
-            ratio = 0.00
-            if total_avg > 0 and not np.isnan(total_avg):
-                ratio = round((band41_avg / total_avg) * 100, 2)
-                
-                # 设置对比基准值（可配置化）
-                BENCHMARK = 50  # 700M基准值
-                delta_value = ratio - BENCHMARK
-                
-                st.metric(
-                    label="日均数据流量", 
-                    value=f"{total_avg:,.2f} TB",
-                    delta=f"{delta_value:+.2f}% vs 700M",
-                    help=(
-                        "2.6GHz频段(band41)日均数据流量占比计算逻辑：\n"
-                        "1. 按日期汇总各频段总流量\n"
-                        "2. 计算各频段日流量的平均值\n"
-                        "3. band41日均值 / 全频段日均值 × 100%"
-                    )
-                )
-            else:
-                st.metric(
-                    label="日均数据流量", 
-                    value=f"{total_avg:,.2f} TB",
-                    delta="N/A",
-                    help="无有效数据计算占比"
-                )
-
-        except KeyError as e:
-            st.error(f"关键数据列缺失: {str(e)}")
-        except ZeroDivisionError:
-            st.warning("全频段日均流量为零，无法计算占比")
-        except Exception as e:
-            st.error(f"计算过程发生异常: {str(e)}")
+    # 关键指标卡：由 日期×地市×频段 立方体求和，band41 占比与日均值共用同一套计算
+    # 加载失败或为空时不缓存，下次运行重新构建
+    with perf.stage("headline_cube"):
+        cube_frames = (filtered_data['base_df'], filtered_data['traffic_df'])
+        if any(df.empty for df in cube_frames):
+            cube = HeadlineCube(*cube_frames)
+        else:
+            cube = get_headline_cube(
+                watermark, tuple(sorted(selected_cities)), *date_range, *cube_frames
+            )
+    BENCHMARK = 50  # 700M基准值（可配置化）
+    share_help = (
+        "2.6GHz频段(band41)日均数据流量占比计算逻辑：\n"
+        "1. 按日期汇总各频段总流量\n"
+        "2. 计算各频段日流量的平均值\n"
+        "3. band41日均值 / 全频段日均值 × 100%"
+    )
 
-    with col4:
-        try:
-            # 第一步：按日期汇总总流量后计算日均
-            daily_total = filtered_data['traffic_df'].groupby('日期')['VoNR语音话务量_千Erl'].sum()
-            total_avg = round(daily_total.mean(), 2) if not daily_total.empty else 0.00
-
-            # 第二步：筛选band41后按日期汇总，再计算日均
-            band41_df = filtered_data['traffic_df'].query("频段 == 'band41'")
-            daily_band41 = band41_df.groupby('日期')['VoNR语音话务量_千Erl'].sum() if not band41_df.empty else pd.Series([0])
-            band41_avg = round(daily_band41.mean(), 2) if not daily_band41.empty else 0.00
-
-            # 计算占比（带多重保护）
-            ratio = 0.00
-            if total_avg > 0 and not np.isnan(total_avg):
-                ratio = round((band41_avg / total_avg) * 100, 2)
-                
-                # 设置对比基准值（可配置化）
-                BENCHMARK = 50  # 700M基准值
-                delta_value = ratio - BENCHMARK
-                
+    col1, col2, col3 ,col4 = st.columns(4)
+    for column, measure, label, help_text in (
+        (col1, "5g基站数", "5G基站数", "2.6GHz频段(band41)基站占比"),
+        (col2, "5g小区数", "5G小区数", "2.6GHz频段(band41)小区占比"),
+    ):
+        with column:
+            total = cube.base_total(measure)
+            ratio = share(cube.base_total(measure, band="band41"), total)
+            st.metric(label,
+                    f"{int(total):,}",
+                    delta=f"{(ratio - BENCHMARK):+.1f}% vs 700M",
+                    help=help_text)
+
+    for column, measure, label, empty_label, unit in (
+        (col3, "总流量_TB", "日均数据流量", "日均数据流量", "TB"),
+        (col4, "VoNR语音话务量_千Erl", "VONR业务流量", "日均VONR业务流量", "千Erl"),
+    ):
+        with column:
+            total_avg = round(cube.daily_mean(measure), 2)
+            band41_avg = round(cube.daily_mean(measure, band="band41"), 2)
+            if total_avg > 0:
+                ratio = round(share(band41_avg, total_avg), 2)
                 st.metric(
-                    label="VONR业务流量", 
-                    value=f"{total_avg:,.2f} 千Erl",
-                    delta=f"{delta_value:+.2f}% vs 700M",
-                    help=(
-                        "2.6GHz频段(band41)日均数据流量占比计算逻辑：\n"
-                        "1. 按日期汇总各频段总流量\n"
-                        "2. 计算各频段日流量的平均值\n"
-                        "3. band41日均值 / 全频段日均值 × 100%"
-                    )
+                    label=label,
+                    value=f"{total_avg:,.2f} {unit}",
+                    delta=f"{ratio - BENCHMARK:+.2f}% vs 700M",
+                    help=share_help,
                 )
             else:
                 st.metric(
-                    label="日均VONR业务流量", 
-                    value=f"{total_avg:,.2f} 千Erl",
+                    label=empty_label,
+                    value=f"{total_avg:,.2f} {unit}",
                     delta="N/A",
-                    help="无有效数据计算占比"
+                    help="无有效数据计算占比",
                 )
 
-        except KeyError as e:
-            st.error(f"关键数据列缺失: {str(e)}")
-        except ZeroDivisionError:
-            st.warning("全频段VONR业务流量为零，无法计算占比")
-        except Exception as e:
-            st.error(f"计算过程发生异常: {str(e)}")
-
-    # 可视化标签页
-    tab1, tab2, tab3 = st.tabs(["📡 基站价值", "📶 网络性能", "📊 业务诊断"])
-    
-    with tab1:
-        col4, col5, col6 = st.columns(3)
-        with col4:
-            st.subheader("主设备基站")
-            if not filtered_data['base_df'].empty:
-                # 处理数据
-                pivot_df = filtered_data['base_df'].pivot_table(
-                    index='地市编码',
-                    columns='频段',
-                    values='5g基站数',
-                    aggfunc='sum',
-                    fill_value=0
-                )
-                
-                # 生成图表
-                bar = (
-                    Bar(init_opts=opts.InitOpts(theme=ThemeType.LIGHT, width="100%"))
-                    .add_xaxis(pivot_df.index.tolist())
-                    .add_yaxis("2.6G(band41)", pivot_df.get('band41', pd.Series(0)).tolist())
-                    .add_yaxis("700M(band28)", pivot_df.get('band28', pd.Series(0)).tolist())
-                    .set_global_opts(
-                        title_opts=opts.TitleOpts(title=""),
-                        toolbox_opts=opts.ToolboxOpts(),
-                        datazoom_opts=[opts.DataZoomOpts()],
-                        xaxis_opts=opts.AxisOpts(axislabel_opts=opts.LabelOpts(rotate=30))
-                    )
-                    )                    
-                components.html(bar.render_embed(), height=500)
-            else:
-                st.warning("无基站分布数据")
-# ========== 区域流量图表 (col5) ==========
-        with col5:
-            st.subheader("数据业务流量")
-            if not filtered_data['traffic_df'].empty:
-                pivot_df = filtered_data['traffic_df'].pivot_table(
-                    index='日期',
-                    columns='频段',
-                    values='总流量_TB',
-                    aggfunc='sum',
-                    fill_value=0
-                ).round(2)
-
-                line = (
-                    Line(init_opts=opts.InitOpts(
-                        theme=ThemeType.LIGHT,
-                        width="100%",
-                        animation_opts=opts.AnimationOpts(animation=False)
-                    ))
-                    .add_xaxis(pivot_df.index.tolist())
-                    .add_yaxis(
-                        series_name="2.6G(band41)",
-                        y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                        linestyle_opts=opts.LineStyleOpts(width=1),
-                        label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                        markpoint_opts=opts.MarkPointOpts(
-                            data=[
-                                opts.MarkPointItem(type_="max", symbol_size=20),
-                                opts.MarkPointItem(type_="min", symbol_size=20)
-                            ],
-                        symbol="roundRect",
-                        symbol_size=12,
-                        label_opts=opts.LabelOpts(
-                            formatter=lambda params: f"{params.name}\n{params.value:.2f}千Erl",
-                            position="inside"
-                            )
-                        )
-                    )
-                    .add_yaxis(
-                        series_name="700M(band28)",
-                        y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                        linestyle_opts=opts.LineStyleOpts(width=1),
-                        label_opts=opts.LabelOpts(is_show=False),
-                        markpoint_opts=opts.MarkPointOpts(
-                            data=[
-                                opts.MarkPointItem(type_="max", symbol_size=20),
-                                opts.MarkPointItem(type_="min", symbol_size=20)
-                            ],
-                            symbol="roundRect",
-                            symbol_size=12,
-                            label_opts=opts.LabelOpts(
-                            formatter=lambda params: f"{params.name}\n{params.value:.2f}千Erl",
-                            position="inside"
-                                )
-                        )
-                    )
-                    .set_global_opts(
-                        xaxis_opts=opts.AxisOpts(
-                            axislabel_opts=opts.LabelOpts(is_show=False),
-                            boundary_gap=False,
-                        ),
-                        yaxis_opts=opts.AxisOpts(
-                            is_show=False,  # 隐藏纵坐标
-                            splitline_opts=opts.SplitLineOpts(is_show=False)
-                        ),
-                        tooltip_opts=opts.TooltipOpts(
-                            trigger="axis" ),
-                        datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                        legend_opts=opts.LegendOpts(
-                            pos_top="0.4%",
-                            item_width=25,
-                            item_height=12,  # 统一高度
-                            item_gap=10,     # 统一间距
-                            padding=[5, 0],  # 上/下内边距
-                            textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                        )
-                    )
-                )
-                components.html(line.render_embed(), height=500)
-
-        # ========== 区域VONR话务图表 (col6) ========== 
-        with col6:
-            st.subheader("VONR话务量")
-            if not filtered_data['traffic_df'].empty:
-                pivot_df = filtered_data['traffic_df'].pivot_table(
-                    index='日期',
-                    columns='频段',
-                    values='VoNR语音话务量_千Erl',
-                    aggfunc='sum',
-                    fill_value=0
-                ).round(2)
-
-                line = (
-                    Line(init_opts=opts.InitOpts(
-                        theme=ThemeType.LIGHT,
-                        width="100%",
-                        animation_opts=opts.AnimationOpts(animation=False)
-                    ))
-                    .add_xaxis(pivot_df.index.tolist())
-                    .add_yaxis(
-                        series_name="2.6G(band41)",
-                        y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                        linestyle_opts=opts.LineStyleOpts(width=1),
-                        label_opts=opts.LabelOpts(is_show=False),
-                        markpoint_opts=opts.MarkPointOpts(
-                            data=[
-                                opts.MarkPointItem(type_="max", symbol_size=20),
-                                opts.MarkPointItem(type_="min", symbol_size=20)
-                            ],
-                            symbol="roundRect",
-                            symbol_size=12,
-                            label_opts=opts.LabelOpts(
-                            formatter=lambda params: f"{params.name}\n{params.value:.2f}千Erl",
-                            position="inside"
-                            )
-                        )
-                    )
-                    .add_yaxis(
-                        series_name="700M(band28)",
-                        y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                        linestyle_opts=opts.LineStyleOpts(width=1),
-                        label_opts=opts.LabelOpts(is_show=False),
-                        markpoint_opts=opts.MarkPointOpts(
-                            data=[
-                                opts.MarkPointItem(type_="max", symbol_size=20),
-                                opts.MarkPointItem(type_="min", symbol_size=20)
-                            ],
-                            symbol="roundRect",
-                            symbol_size=12,
-                            label_opts=opts.LabelOpts(
-                            formatter=lambda params: f"{params.name}\n{params.value:.2f}千Erl",
-                            position="inside"
-                            )
-                        )
-                    )
-                    .set_global_opts(
-                        xaxis_opts=opts.AxisOpts(
-                            axislabel_opts=opts.LabelOpts(is_show=False),
-                            boundary_gap=False
-                        ),
-                        yaxis_opts=opts.AxisOpts(is_show=False),
-                        tooltip_opts=opts.TooltipOpts(
-                            trigger="axis"
-                        ),
-                        datazoom_opts=[opts.DataZoomOpts()],  # 统一交互轴
-                        legend_opts=opts.LegendOpts(
-                            pos_top="0.4%",
-                            item_width=25,
-                            item_height=12,  # 统一高度
-                            item_gap=10,     # 统一间距
-                            padding=[5, 0],  # 上/下内边距
-                            textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                        )
-                    )
-                )
-                components.html(line.render_embed(), height=500)
-
-# ========== 修改后的tab2代码块 ==========
-    with tab2:
-        # 第一行容器
-        with st.container():
-            row1_col1, row1_col2, row1_col3 = st.columns(3)
-            
-            with row1_col1:
-                st.subheader("无线接通率")
-                if not filtered_data['kpi_df'].empty:
-                    pivot_df = filtered_data['kpi_df'].pivot_table(
-                        index='日期',
-                        columns='频段',
-                        values='无线接通率',
-                        aggfunc='mean',
-                        fill_value=0
-                    ).round(2)
-
-                    line = (
-                        Line(init_opts=opts.InitOpts(
-                            theme=ThemeType.LIGHT,
-                            width="100%",
-                            animation_opts=opts.AnimationOpts(animation=False)
-                        ))
-                        .add_xaxis(pivot_df.index.tolist())
-                        .add_yaxis(
-                            series_name="2.6G(band41)",
-                            y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                        )
-                        .add_yaxis(
-                            series_name="700M(band28)",
-                            y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),
-                            )
-                        .set_global_opts(
-                            xaxis_opts=opts.AxisOpts(
-                                axislabel_opts=opts.LabelOpts(is_show=False),
-                                boundary_gap=False,
-                            ),
-                            yaxis_opts=opts.AxisOpts(
-                                is_show=False,  # 隐藏纵坐标
-                                splitline_opts=opts.SplitLineOpts(is_show=False),
-                                min_=90,    # 固定最小值
-                                max_=100    # 固定最大值
-                            ),
-                            tooltip_opts=opts.TooltipOpts(
-                                trigger="axis" ),
-                            datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                            legend_opts=opts.LegendOpts(
-                                pos_top="0.4%",
-                                item_width=25,
-                                item_height=12,  # 统一高度
-                                item_gap=10,     # 统一间距
-                                padding=[5, 0],  # 上/下内边距
-                                textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                            )
-                        )
-                    )
-                    components.html(line.render_embed(), height=500)
-
-            with row1_col2:
-                st.subheader("无线掉线率")
-                if not filtered_data['kpi_df'].empty:
-                    pivot_df = filtered_data['kpi_df'].pivot_table(
-                        index='日期',
-                        columns='频段',
-                        values='无线掉线率',
-                        aggfunc='mean',
-                        fill_value=0
-                    ).round(2)
-
-                    line = (
-                        Line(init_opts=opts.InitOpts(
-                            theme=ThemeType.LIGHT,
-                            width="100%",
-                            animation_opts=opts.AnimationOpts(animation=False)
-                        ))
-                        .add_xaxis(pivot_df.index.tolist())
-                        .add_yaxis(
-                            series_name="2.6G(band41)",
-                            y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                        )
-                        .add_yaxis(
-                            series_name="700M(band28)",
-                            y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),
-                            )
-                        .set_global_opts(
-                            xaxis_opts=opts.AxisOpts(
-                                axislabel_opts=opts.LabelOpts(is_show=False),
-                                boundary_gap=False,
-                            ),
-                            yaxis_opts=opts.AxisOpts(
-                                is_show=False,  # 隐藏纵坐标
-                                splitline_opts=opts.SplitLineOpts(is_show=False),
-                            ),
-                            tooltip_opts=opts.TooltipOpts(
-                                trigger="axis" ),
-                            datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                            legend_opts=opts.LegendOpts(
-                                pos_top="0.4%",
-                                item_width=25,
-                                item_height=12,  # 统一高度
-                                item_gap=10,     # 统一间距
-                                padding=[5, 0],  # 上/下内边距
-                                textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                            )
-                        )
-                    )
-                    components.html(line.render_embed(), height=500)
-
-            with row1_col3:
-                st.subheader("切换成功率")
-                if not filtered_data['kpi_df'].empty:
-                    pivot_df = filtered_data['kpi_df'].pivot_table(
-                        index='日期',
-                        columns='频段',
-                        values='切换成功率',
-                        aggfunc='mean',
-                        fill_value=0
-                    ).round(2)
-
-                    line = (
-                        Line(init_opts=opts.InitOpts(
-                            theme=ThemeType.LIGHT,
-                            width="100%",
-                            animation_opts=opts.AnimationOpts(animation=False)
-                        ))
-                        .add_xaxis(pivot_df.index.tolist())
-                        .add_yaxis(
-                            series_name="2.6G(band41)",
-                            y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                        )
-                        .add_yaxis(
-                            series_name="700M(band28)",
-                            y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                            linestyle_opts=opts.LineStyleOpts(width=1),
-                            label_opts=opts.LabelOpts(is_show=False),
-                            )
-                        .set_global_opts(
-                            xaxis_opts=opts.AxisOpts(
-                                axislabel_opts=opts.LabelOpts(is_show=False),
-                                boundary_gap=False,
-                            ),
-                            yaxis_opts=opts.AxisOpts(
-                                is_show=False,  # 隐藏纵坐标
-                                splitline_opts=opts.SplitLineOpts(is_show=False),
-                                min_=90,    # 固定最小值
-                                max_=100    # 固定最大值
-                            ),
-                            tooltip_opts=opts.TooltipOpts(
-                                trigger="axis" ),
-                            datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                            legend_opts=opts.LegendOpts(
-                                pos_top="0.4%",
-                                item_width=25,
-                                item_height=12,  # 统一高度
-                                item_gap=10,     # 统一间距
-                                padding=[5, 0],  # 上/下内边距
-                                textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                            )
-                        )
-                    )
-                    components.html(line.render_embed(), height=500)
-
-    # 第二行        
-        with st.container():
-            row2_col1, row2_col2, row2_col3 = st.columns(3)
-            
-            with row2_col1:
-                    st.subheader("VONR无线接通率")
-                    if not filtered_data['kpi_df'].empty:
-                        pivot_df = filtered_data['kpi_df'].pivot_table(
-                            index='日期',
-                            columns='频段',
-                            values='VONR无线接通率',
-                            aggfunc='mean',
-                            fill_value=0
-                        ).round(2)
-
-                        line = (
-                            Line(init_opts=opts.InitOpts(
-                                theme=ThemeType.LIGHT,
-                                width="100%",
-                                animation_opts=opts.AnimationOpts(animation=False)
-                            ))
-                            .add_xaxis(pivot_df.index.tolist())
-                            .add_yaxis(
-                                series_name="2.6G(band41)",
-                                y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                            )
-                            .add_yaxis(
-                                series_name="700M(band28)",
-                                y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),
-                                )
-                            .set_global_opts(
-                                xaxis_opts=opts.AxisOpts(
-                                    axislabel_opts=opts.LabelOpts(is_show=False),
-                                    boundary_gap=False,
-                                ),
-                                yaxis_opts=opts.AxisOpts(
-                                    is_show=False,  # 隐藏纵坐标
-                                    splitline_opts=opts.SplitLineOpts(is_show=False),
-                                    min_=90,    # 固定最小值
-                                    max_=100    # 固定最大值
-                                ),
-                                tooltip_opts=opts.TooltipOpts(
-                                    trigger="axis" ),
-                                datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                                legend_opts=opts.LegendOpts(
-                                    pos_top="0.4%",
-                                    item_width=25,
-                                    item_height=12,  # 统一高度
-                                    item_gap=10,     # 统一间距
-                                    padding=[5, 0],  # 上/下内边距
-                                    textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                                )
-                            )
-                        )
-                        components.html(line.render_embed(), height=500)
-            
-            with row2_col2:
-                    st.subheader("VONR无线掉线率")
-                    if not filtered_data['kpi_df'].empty:
-                        pivot_df = filtered_data['kpi_df'].pivot_table(
-                            index='日期',
-                            columns='频段',
-                            values='VONR无线掉线率',
-                            aggfunc='mean',
-                            fill_value=0
-                        ).round(2)
-
-                        line = (
-                            Line(init_opts=opts.InitOpts(
-                                theme=ThemeType.LIGHT,
-                                width="100%",
-                                animation_opts=opts.AnimationOpts(animation=False)
-                            ))
-                            .add_xaxis(pivot_df.index.tolist())
-                            .add_yaxis(
-                                series_name="2.6G(band41)",
-                                y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                            )
-                            .add_yaxis(
-                                series_name="700M(band28)",
-                                y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),
-                                )
-                            .set_global_opts(
-                                xaxis_opts=opts.AxisOpts(
-                                    axislabel_opts=opts.LabelOpts(is_show=False),
-                                    boundary_gap=False,
-                                ),
-                                yaxis_opts=opts.AxisOpts(
-                                    is_show=False,  # 隐藏纵坐标
-                                    splitline_opts=opts.SplitLineOpts(is_show=False)
-                                ),
-                                tooltip_opts=opts.TooltipOpts(
-                                    trigger="axis" ),
-                                datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                                legend_opts=opts.LegendOpts(
-                                    pos_top="0.4%",
-                                    item_width=25,
-                                    item_height=12,  # 统一高度
-                                    item_gap=10,     # 统一间距
-                                    padding=[5, 0],  # 上/下内边距
-                                    textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                                )
-                            )
-                        )
-                        components.html(line.render_embed(), height=500)
-            
-            with row2_col3:
-                    st.subheader("VONR切换成功率")
-                    if not filtered_data['kpi_df'].empty:
-                        pivot_df = filtered_data['kpi_df'].pivot_table(
-                            index='日期',
-                            columns='频段',
-                            values='VONR切换成功率',
-                            aggfunc='mean',
-                            fill_value=0
-                        ).round(2)
-
-                        line = (
-                            Line(init_opts=opts.InitOpts(
-                                theme=ThemeType.LIGHT,
-                                width="100%",
-                                animation_opts=opts.AnimationOpts(animation=False)
-                            ))
-                            .add_xaxis(pivot_df.index.tolist())
-                            .add_yaxis(
-                                series_name="2.6G(band41)",
-                                y_axis=pivot_df.get('band41', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
-                            )
-                            .add_yaxis(
-                                series_name="700M(band28)",
-                                y_axis=pivot_df.get('band28', pd.Series(0)).tolist(),
-                                linestyle_opts=opts.LineStyleOpts(width=1),
-                                label_opts=opts.LabelOpts(is_show=False),
-                                )
-                            .set_global_opts(
-                                xaxis_opts=opts.AxisOpts(
-                                    axislabel_opts=opts.LabelOpts(is_show=False),
-                                    boundary_gap=False,
-                                ),
-                                yaxis_opts=opts.AxisOpts(
-                                    is_show=False,  # 隐藏纵坐标
-                                    splitline_opts=opts.SplitLineOpts(is_show=False),
-                                    min_=90,    # 固定最小值
-                                    max_=100    # 固定最大值
-                                ),
-                                tooltip_opts=opts.TooltipOpts(
-                                    trigger="axis" ),
-                                datazoom_opts=[opts.DataZoomOpts()],  # 与col4相同的可活动轴
-                                legend_opts=opts.LegendOpts(
-                                    pos_top="0.4%",
-                                    item_width=25,
-                                    item_height=12,  # 统一高度
-                                    item_gap=10,     # 统一间距
-                                    padding=[5, 0],  # 上/下内边距
-                                    textstyle_opts=opts.TextStyleOpts(font_size=12)  # 统一字体大小
-                                )
-                            )
-                        )
-                        components.html(line.render_embed(), height=500)
+    # 视图选择：st.tabs 会在每次运行时执行所有标签页，这里只执行当前视图
+    view = st.radio(
+        "视图", options=list(VIEWS), format_func=VIEWS.get,
+        horizontal=True, key="view", label_visibility="collapsed",
+    )
+    if st.session_state.get("_rendered_view") != view:
+        # 切换视图后图表组件重新挂载，先前发送的版本已随 iframe 销毁
+        forget_charts()
+        st.session_state["_rendered_view"] = view
+
+    if view == "tab1":
+        show_charts(specs_for("tab1"))
+
+    elif view == "tab2":
+        show_charts(specs_for("tab2"))
+        anomalies = get_anomalies()
+        st.subheader("⚠️ 指标异常")
+        if anomalies.empty:
+            st.success("所选范围内未检测到指标劣化")
+        else:
+            st.caption(f"共 {len(anomalies):,} 个异常点（按偏离基线的稳健 z 分数排序，图中红色图钉标注）")
+            st.dataframe(anomalies, use_container_width=True, hide_index=True)
+
+    elif view == "tab3":
+        show_diagnosis(read_engine, watermark, selected_cities, date_range, perf)
+        show_llm_analysis(get_chart_data(), get_anomalies(), perf)
+
+    with st.expander("📥 数据导出"):
+        show_export(read_engine, get_chart_data, selected_cities, date_range, perf)
+
+    if show_perf:
+        with perf_slot.container():
+            show_perf_panel(perf)
 
 if __name__ == "__main__":
     main()
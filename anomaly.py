@@ -0,0 +1,245 @@
+"""
+KPI 时间序列异常检测
+
+把 日期 × (KPI, 地市, 频段) 的 KPI 矩阵作为一个二维数组整体处理，
+所有序列一次向量化完成：
+1. 季节项：同相位前几个周期（去掉尾随趋势后）的中位数
+2. 滚动基线：去季节后的滚动中位数（只用当前点之前的数据）
+3. 稳健 z 分数：残差 / (1.4826 × 滚动 MAD)，MAD 同样只用历史数据
+只标记劣化方向（掉线率升高、接通率/切换成功率下降）。
+每个得分只依赖它之前的数据，新数据到达不会改变历史得分。
+
+除 地市×频段 序列外，矩阵还包含各频段的地市合计序列（地市编码 = ALL_CITIES），
+与图表绘制的曲线相同，图表只用合计序列的异常点标注。
+
+AnomalyDetector 缓存上一次的矩阵与得分，新时间桶到达时只重算尾部，
+最后一个时间桶（当天可能仍在累加）总是重算，结果与全量计算一致。
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from kpi_engine import compute_kpis
+from timebuckets import LEVELS
+
+try:
+    import bottleneck as bn
+except ImportError:  # 未安装 bottleneck 时用 numpy 滑动窗口排序（长窗口较慢）
+    bn = None
+
+SERIES_KEYS = ["地市编码", "频段"]
+# 地市合计序列的地市编码
+ALL_CITIES = "全部地市"
+
+# 粒度 -> (季节周期, 滚动基线窗口)，单位均为时间桶个数
+SEASONS = {
+    "15min": (96, 96 * 3),
+    "hour": (24, 24 * 7),
+    "day": (7, 28),
+    "week": (1, 12),
+}
+
+# 劣化方向：+1 数值升高为劣化，-1 数值下降为劣化
+DIRECTIONS = {
+    "无线接通率": -1,
+    "无线掉线率": 1,
+    "切换成功率": -1,
+    "VONR无线接通率": -1,
+    "VONR无线掉线率": 1,
+    "VONR切换成功率": -1,
+}
+
+Z_THRESHOLD = 3.5
+# 离散度下限（百分点），避免长期稳定在 99.9x 的序列因微小波动被误报
+MIN_SCALE = 0.05
+
+ANOMALY_COLUMNS = ["日期", "KPI", "地市编码", "频段", "指标值", "基线", "偏离度"]
+
+
+def kpi_matrix(kpi_df, level):
+    """KPI 计数器明细 -> 行为连续时间桶、列为 (KPI, 地市, 频段) 的矩阵（含地市合计序列）"""
+    kpis = list(DIRECTIONS)
+    by_city = compute_kpis(kpi_df, ["日期", *SERIES_KEYS], kpis=kpis, decimals=None)
+    by_city = by_city.unstack(SERIES_KEYS)
+    by_band = compute_kpis(kpi_df, ["日期", "频段"], kpis=kpis, decimals=None).unstack("频段")
+    names = [None, *SERIES_KEYS]
+    by_city.columns = pd.MultiIndex.from_tuples(list(by_city.columns), names=names)
+    by_band.columns = pd.MultiIndex.from_tuples(
+        [(kpi, ALL_CITIES, band) for kpi, band in by_band.columns], names=names
+    )
+    wide = pd.concat([by_city, by_band], axis=1)
+    full = pd.date_range(wide.index.min(), wide.index.max(), freq=LEVELS[level].step)
+    return wide.reindex(full)
+
+
+def _rolling_median(values, window, min_periods):
+    """二维数组逐列的尾随滚动中位数（含当前行，忽略 NaN），所有列一次完成"""
+    if bn is not None:
+        # 每列转为连续内存后沿行滚动，访存连续
+        columns = np.ascontiguousarray(values.T)
+        return bn.move_median(columns, window, min_count=min_periods, axis=1).T
+
+    rows, cols = values.shape
+    padded = np.vstack([np.full((window - 1, cols), np.nan), values])
+    valid = np.vstack([np.zeros((1, cols)), np.cumsum(~np.isnan(padded), axis=0)])
+    count = (valid[window:] - valid[:-window]).astype(np.int64)
+    result = np.empty(values.shape)
+    # 按列分块，滑动窗口排序的临时数组控制在约 400 万个元素以内
+    step = max(1, 4_000_000 // (rows * window))
+    for lo in range(0, cols, step):
+        hi = min(lo + step, cols)
+        ordered = np.sort(sliding_window_view(padded[:, lo:hi], window, axis=0), axis=-1)
+        n = count[:, lo:hi, None]
+        lower = np.take_along_axis(ordered, np.maximum(n - 1, 0) // 2, axis=-1)[..., 0]
+        upper = np.take_along_axis(ordered, n // 2 % window, axis=-1)[..., 0]
+        result[:, lo:hi] = (lower + upper) / 2
+    result[count < max(min_periods, 1)] = np.nan
+    return result
+
+
+def _shift(values, n):
+    """整体下移 n 行，空出的行为 NaN"""
+    shifted = np.full(values.shape, np.nan)
+    if n < len(values):
+        shifted[n:] = values[:len(values) - n]
+    return shifted
+
+
+def _nanmedian(stack):
+    """沿第 0 维的中位数（忽略 NaN，第 0 维很短）"""
+    ordered = np.sort(stack, axis=0)   # NaN 排在最后
+    count = (~np.isnan(stack)).sum(axis=0)
+    lo = np.take_along_axis(ordered, (np.maximum(count - 1, 0) // 2)[None], axis=0)[0]
+    hi = np.take_along_axis(ordered, (count // 2)[None], axis=0)[0]
+    return np.where(count > 0, (lo + hi) / 2, np.nan)
+
+
+def _cycles(level):
+    period, window = SEASONS[level]
+    return max(window // period, 1)
+
+
+def _seasonal(values, level):
+    """每个时间桶的季节偏移：同相位前几个周期去趋势值（尾随滚动中位数趋势）的中位数"""
+    period, _ = SEASONS[level]
+    if period <= 1:
+        return np.zeros(values.shape)
+    detrended = values - _rolling_median(values, period, 1)
+    stack = np.stack([_shift(detrended, k * period) for k in range(1, _cycles(level) + 1)])
+    return np.nan_to_num(_nanmedian(stack))
+
+
+def history(level):
+    """某一行的得分最多依赖之前多少行（季节项 + 基线 + MAD 的回看长度）"""
+    period, window = SEASONS[level]
+    return (_cycles(level) + 1) * period + 2 * window
+
+
+def score(frame, level):
+    """返回 (期望值, 稳健 z 分数)，均与 frame 同形状"""
+    _, window = SEASONS[level]
+    min_periods = max(window // 4, 3)
+    values = frame.to_numpy(dtype=np.float64)
+    seasonal = _seasonal(values, level)
+    adjusted = values - seasonal
+
+    baseline = _shift(_rolling_median(adjusted, window, min_periods), 1)
+    resid = adjusted - baseline
+    mad = _shift(_rolling_median(np.abs(resid), window, min_periods), 1)
+    scale = np.maximum(1.4826 * mad, MIN_SCALE)   # NaN（历史不足）保持 NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = resid / scale
+    return (
+        pd.DataFrame(baseline + seasonal, index=frame.index, columns=frame.columns),
+        pd.DataFrame(z, index=frame.index, columns=frame.columns),
+    )
+
+
+def flag(frame, expected, z, threshold=Z_THRESHOLD):
+    """劣化方向上偏离度超过阈值的点，长表输出"""
+    kpi_level = frame.columns.get_level_values(0)
+    direction = np.array([DIRECTIONS[name] for name in kpi_level])
+    z_values = z.to_numpy()
+    with np.errstate(invalid="ignore"):
+        rows, cols = np.nonzero(z_values * direction > threshold)
+    columns = frame.columns[cols]
+    return pd.DataFrame({
+        "日期": frame.index[rows],
+        "KPI": columns.get_level_values(0),
+        "地市编码": columns.get_level_values(1),
+        "频段": columns.get_level_values(2),
+        "指标值": np.round(frame.to_numpy()[rows, cols], 2),
+        "基线": np.round(expected.to_numpy()[rows, cols], 2),
+        "偏离度": np.round(z_values[rows, cols], 1),
+    }, columns=ANOMALY_COLUMNS)
+
+
+def _reusable_rows(old, new):
+    """新矩阵是旧矩阵向后延伸时，返回可复用得分的行数；否则返回 None"""
+    if len(old) < 2 or len(new) < len(old) or not old.columns.equals(new.columns):
+        return None
+    keep = len(old) - 1
+    if not old.index.equals(new.index[:len(old)]):
+        return None
+    if not np.array_equal(old.to_numpy()[:keep], new.to_numpy()[:keep], equal_nan=True):
+        return None
+    return keep
+
+
+class AnomalyDetector:
+    """按 key（粒度 + 地市选择）缓存 KPI 矩阵与得分的有界 LRU"""
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def detect(self, key, kpi_df, level):
+        """返回异常点长表（按偏离度绝对值降序）"""
+        if kpi_df.empty:
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+        frame = kpi_matrix(kpi_df, level)
+
+        with self._lock:
+            cached = self._items.get(key)
+        expected = z = None
+        if cached is not None:
+            old_frame, old_expected, old_z = cached
+            keep = _reusable_rows(old_frame, frame)
+            if keep is not None:
+                # 尾部带上得分依赖的全部历史重算，结果与全量计算一致
+                context = max(keep - history(level), 0)
+                tail_expected, tail_z = score(frame.iloc[context:], level)
+                expected = pd.concat([old_expected.iloc[:keep], tail_expected.iloc[keep - context:]])
+                z = pd.concat([old_z.iloc[:keep], tail_z.iloc[keep - context:]])
+        if expected is None:
+            expected, z = score(frame, level)
+
+        with self._lock:
+            self._items[key] = (frame, expected, z)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+        anomalies = flag(frame, expected, z)
+        order = np.argsort(-anomalies["偏离度"].abs().to_numpy(), kind="stable")
+        return anomalies.iloc[order].reset_index(drop=True)
+
+
+def anomaly_marks(anomalies):
+    """
+    {KPI: frozenset((日期, 频段))}，供图表标注异常点
+
+    图表绘制的是所选地市合计后的频段曲线，只取合计序列的异常点，
+    单个地市的异常不会被钉在合计曲线上。
+    """
+    if anomalies.empty:
+        return {}
+    pairs = anomalies[anomalies["地市编码"] == ALL_CITIES]
+    return {
+        kpi: frozenset(zip(group["日期"], group["频段"]))
+        for kpi, group in pairs.groupby("KPI", sort=False)
+    }
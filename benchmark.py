@@ -0,0 +1,264 @@
+"""
+离线性能基准
+
+生成指定规模的 btsbase（小区/基站/频段/地市）与 kpibase（15分钟粒度 R 计数器）合成数据，
+载入本地 SQLite 作为 MySQL 替身，依次计时：
+    汇总表折叠（原 traffic_df/kpi_df 的全量 join+group by）、QUERY_DICT 各查询、
+    分片缓存筛选（冷/热）、计数器拆分、KPI 透视、图表 option 生成、最差小区排名、KPI 异常检测
+结果输出为 JSON，可用 --baseline 与上次结果对比，超出阈值时以非零状态退出。
+
+用法：
+    python benchmark.py --cells 10000 100000 1000000 --days 1 --slots 4 --output bench.json
+    python benchmark.py --cells 10000 --baseline bench.json --threshold 1.3
+"""
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from anomaly import AnomalyDetector
+from charts import CHART_SPECS, build_chart, chart_option, pivot_specs
+from diagnosis import level_sums, rank_worst
+from kpi_engine import DIAGNOSIS_KPIS, KPI_FORMULAS, TRAFFIC_COUNTERS, split_counters
+from perf import PerfRecorder
+from queries import CELL_SUMS_QUERY, DATED_QUERIES, DIMENSION_QUERY, QUERY_DICT
+from query_layer import SliceCache, normalize_frame, read_frame
+from rollup import CELL_ROLLUP_TABLE, ROLLUP_TABLE, ddl_statements, fold_select_sql, insert_columns
+
+PROVINCE = "湖北"
+CITIES = [
+    "武汉", "黄石", "十堰", "宜昌", "襄阳", "鄂州", "荆门", "孝感", "荆州",
+    "黄冈", "咸宁", "随州", "恩施", "仙桃", "潜江", "天门", "神农架",
+]
+BANDS = ["band41", "band28"]
+CELLS_PER_STATION = 3
+START_DAY = pd.Timestamp("2025-01-01")
+
+
+def generate_btsbase(cells, rng):
+    """合成小区工参：每站3个小区，地市按长尾分布，频段约 6:4"""
+    ids = np.arange(1, cells + 1)
+    city_weights = 1.0 / np.arange(1, len(CITIES) + 1)
+    city_idx = rng.choice(len(CITIES), size=cells, p=city_weights / city_weights.sum())
+    band_idx = rng.choice(len(BANDS), size=cells, p=[0.6, 0.4])
+    return pd.DataFrame({
+        "ID": ids,
+        "SJGZQYMC": PROVINCE,
+        "DSJGZQYMC": np.asarray(CITIES)[city_idx],
+        "frequency_band": np.asarray(BANDS)[band_idx],
+        "station_name": [f"站点{i // CELLS_PER_STATION:07d}" for i in ids],
+        "cell_name": [f"小区{i:08d}" for i in ids],
+    })
+
+
+def generate_counters(cells, rng):
+    """
+    合成一个15分钟时段的全部计数器
+
+    分母类计数器按泊松分布生成，分子按二项分布从对应分母抽样，
+    保证成功率类 KPI 落在合理区间。
+    """
+    values = {}
+    for factors in KPI_FORMULAS.values():
+        for num, den in factors:
+            for counter in den:
+                values.setdefault(counter, rng.poisson(200, cells))
+            base = values[next(iter(den))]
+            for counter, coef in num.items():
+                if counter not in values:
+                    values[counter] = rng.binomial(base, 0.99 if coef > 0 else 0.01)
+    for counter in TRAFFIC_COUNTERS:
+        if counter.startswith("R2032"):
+            values[counter] = rng.lognormal(17, 1, cells)   # 字节数
+        else:
+            values[counter] = rng.poisson(40, cells)        # 话务量
+    return values
+
+
+def load_synthetic(engine, cells, days, slots, seed=0):
+    """按时段分块写入 SQLite，内存占用与单个时段的规模成正比"""
+    rng = np.random.default_rng(seed)
+    bts = generate_btsbase(cells, rng)
+    bts.to_sql("btsbase", engine, if_exists="replace", index=False)
+
+    step = pd.Timedelta(minutes=15)
+    rows = 0
+    for day in range(days):
+        for slot in range(slots):
+            ts = START_DAY + pd.Timedelta(days=day) + slot * step
+            kpi = pd.DataFrame({"ID": bts["ID"], "开始时间": ts, **generate_counters(cells, rng)})
+            kpi.to_sql("kpibase", engine, if_exists="append" if rows else "replace",
+                       index=False, chunksize=50_000)
+            rows += len(kpi)
+    with engine.begin() as cx:
+        cx.execute(text("CREATE INDEX IF NOT EXISTS ix_btsbase_id ON btsbase (ID)"))
+        cx.execute(text("CREATE INDEX IF NOT EXISTS ix_kpibase_ts ON kpibase (开始时间)"))
+    return rows
+
+
+def build_rollup(engine, table=ROLLUP_TABLE):
+    """在 SQLite 上全量折叠一次汇总表（MySQL 上为增量 upsert，这里只测聚合本身）"""
+    cols = ", ".join(insert_columns(table))
+    with engine.begin() as cx:
+        cx.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        for ddl in ddl_statements(table):
+            cx.execute(text(ddl))
+        cx.execute(
+            text(f"INSERT INTO {table} ({cols}) {fold_select_sql(table)}"),
+            {"low": "1970-01-01 00:00:00", "high": "9999-12-31 23:59:59"},
+        )
+
+
+def run_scale(cells, days, slots, workdir, render=True):
+    """在一个规模下跑完整条链路，返回机器可读的结果字典"""
+    perf = PerfRecorder()
+    engine = create_engine(f"sqlite:///{Path(workdir) / f'bench_{cells}.db'}")
+
+    with perf.stage("generate_and_load") as record:
+        record["rows"] = load_synthetic(engine, cells, days, slots)
+    with perf.stage("rollup_fold"):
+        build_rollup(engine)
+    with perf.stage("cell_rollup_fold"):
+        build_rollup(engine, CELL_ROLLUP_TABLE)
+
+    dims = read_frame(engine, DIMENSION_QUERY)
+    cities = dims["地市编码"].tolist()
+    start = pd.to_datetime(dims["最早日期"]).min()
+    end = pd.to_datetime(dims["最晚日期"]).max()
+
+    for name, sql in QUERY_DICT.items():
+        params = {"cities": cities}
+        if name in DATED_QUERIES:
+            params.update(start=start.date(), end=end.date())
+        with perf.stage(f"query:{name}") as record:
+            record["rows"] = len(read_frame(engine, sql, params))
+
+    # 分片缓存：第一次为冷缓存（查库），第二次为热缓存（纯内存切片）
+    cache = SliceCache()
+
+    def fetch(fetch_start, fetch_end, fetch_cities):
+        return read_frame(engine, QUERY_DICT["counters_df"], {
+            "start": fetch_start.date(), "end": fetch_end.date(), "cities": fetch_cities,
+        })
+
+    with perf.stage("filter_cold") as record:
+        counters = cache.get("counters_df", fetch, cities, start, end)
+        record["rows"] = len(counters)
+    with perf.stage("filter_warm") as record:
+        record["rows"] = len(cache.get("counters_df", fetch, cities[:3], start, end))
+
+    with perf.stage("split_counters"):
+        traffic_df, kpi_df = split_counters(counters)
+
+    base_df = read_frame(engine, QUERY_DICT["base_df"], {"cities": cities})
+    frames = {"base_df": base_df, "traffic_df": traffic_df, "kpi_df": kpi_df}
+
+    with perf.stage("pivot_all"):
+        pivots = pivot_specs(CHART_SPECS, frames, perf)
+    with perf.stage("anomaly_detect") as record:
+        record["rows"] = len(AnomalyDetector().detect("bench", kpi_df, "day"))
+
+    if render:
+        # 与看板相同：生成 ECharts option，字节数按 live_chart 首次发送的完整载荷计
+        with perf.stage("chart_option_all") as record:
+            options = [
+                chart_option(build_chart(spec, pivots[spec.chart_id]))
+                for spec in CHART_SPECS
+                if spec.chart_id in pivots
+            ]
+            record["bytes"] = sum(
+                len(json.dumps({"version": 1, "base": None, "option": option}, ensure_ascii=False))
+                for option in options
+            )
+
+    # 业务诊断：小区级合计 → 各 KPI 最差 20 个小区/基站
+    with perf.stage("query:cell_sums") as record:
+        cell_sums = normalize_frame(read_frame(engine, CELL_SUMS_QUERY, {
+            "start": start.date(), "end": end.date(), "cities": cities,
+        }), dated=False)
+        record["rows"] = len(cell_sums)
+    for level in ("小区", "基站"):
+        with perf.stage(f"diagnosis_rank:{level}") as record:
+            sums = level_sums(cell_sums, level)
+            record["rows"] = sum(len(rank_worst(sums, kpi, k=20, level=level)) for kpi in DIAGNOSIS_KPIS)
+
+    engine.dispose()
+    return {
+        "cells": cells,
+        "days": days,
+        "slots": slots,
+        "stages": {
+            r["stage"]: {k: v for k, v in r.items() if k not in ("stage", "run_id", "thread")}
+            for r in perf.records
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    """与基线逐阶段比较耗时，返回超过阈值的回归项"""
+    base = {(r["cells"], r["days"], r["slots"]): r["stages"] for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = base.get((result["cells"], result["days"], result["slots"]))
+        if not before:
+            continue
+        for stage, now in result["stages"].items():
+            old_ms = before.get(stage, {}).get("ms")
+            if old_ms and now["ms"] > old_ms * threshold:
+                regressions.append({
+                    "cells": result["cells"],
+                    "stage": stage,
+                    "baseline_ms": old_ms,
+                    "ms": now["ms"],
+                    "ratio": round(now["ms"] / old_ms, 2),
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="5G看板离线性能基准")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--days", type=int, default=1, help="合成数据天数")
+    parser.add_argument("--slots", type=int, default=4, help="每天的15分钟时段数（最多96）")
+    parser.add_argument("--workdir", default=None, help="SQLite 文件目录，默认临时目录")
+    parser.add_argument("--no-render", action="store_true", help="跳过图表 option 生成")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件，默认输出到标准输出")
+    parser.add_argument("--baseline", default=None, help="用于对比的历史结果 JSON")
+    parser.add_argument("--threshold", type=float, default=1.3, help="耗时超过基线的倍数视为回归")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        results = [
+            run_scale(cells, args.days, min(args.slots, 96), workdir, render=not args.no_render)
+            for cells in args.cells
+        ]
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "results": results,
+    }
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        report["regressions"] = compare(results, baseline, args.threshold)
+
+    payload = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(payload, encoding="utf-8")
+    else:
+        print(payload)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
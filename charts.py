@@ -0,0 +1,303 @@
+"""
+图表注册表与渲染
+
+每张图表用一条 ChartSpec 声明（指标、汇总方式、坐标轴范围、图表类型），
+由同一个渲染器生成 pyecharts 图表：
+- 同一数据集、同一维度的图表共用一次 groupby 透视，而不是每张图各做一次 pivot_table
+- 生成的 ECharts option 按 (图表声明, 数据指纹) 缓存，输入未变化的图表直接复用
+- 折线图按点数预算降采样后再发送，长时间范围不会生成过大的 option
+新增 KPI 图表只需在 CHART_SPECS 中加一行。
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import pandas as pd
+from pyecharts import options as opts
+from pyecharts.charts import Bar, Line
+from pyecharts.globals import ThemeType
+
+from downsample import MAX_POINTS, downsample_pivot
+from kpi_engine import compute_kpis
+from perf import NULL_RECORDER
+
+# 频段系列：(频段, 图例名称)
+BAND_SERIES = (
+    ("band41", "2.6G(band41)"),
+    ("band28", "700M(band28)"),
+)
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    chart_id: str               # 图表标题，同时作为缓存键
+    tab: str                    # 所在标签页
+    dataset: str                # filtered_data 中的数据集
+    metric: str                 # 指标列（或 KPI 名称）
+    index: str = "日期"          # 横轴维度
+    agg: str = "sum"            # sum：直接求和；kpi：汇总计数器后按公式计算
+    kind: str = "line"          # line / bar
+    y_min: float = None
+    y_max: float = None
+    unit: str = ""              # 最大/最小值标注的单位，为空则不标注
+    empty_text: str = None      # 数据为空时的提示
+    max_points: int = MAX_POINTS  # 折线图每条曲线的点数预算，None 表示不降采样
+    downsample: str = "lttb"    # lttb：保留形状；minmax：保留尖峰
+
+
+CHART_SPECS = [
+    # ===== 📡 基站价值 =====
+    ChartSpec("主设备基站", "tab1", "base_df", "5g基站数",
+              index="地市编码", kind="bar", empty_text="无基站分布数据"),
+    ChartSpec("数据业务流量", "tab1", "traffic_df", "总流量_TB", unit="TB"),
+    ChartSpec("VONR话务量", "tab1", "traffic_df", "VoNR语音话务量_千Erl", unit="千Erl"),
+    # ===== 📶 网络性能 =====
+    ChartSpec("无线接通率", "tab2", "kpi_df", "无线接通率", agg="kpi", y_min=90, y_max=100),
+    ChartSpec("无线掉线率", "tab2", "kpi_df", "无线掉线率", agg="kpi", downsample="minmax"),
+    ChartSpec("切换成功率", "tab2", "kpi_df", "切换成功率", agg="kpi", y_min=90, y_max=100),
+    ChartSpec("VONR无线接通率", "tab2", "kpi_df", "VONR无线接通率", agg="kpi", y_min=90, y_max=100),
+    ChartSpec("VONR无线掉线率", "tab2", "kpi_df", "VONR无线掉线率", agg="kpi", downsample="minmax"),
+    ChartSpec("VONR切换成功率", "tab2", "kpi_df", "VONR切换成功率", agg="kpi", y_min=90, y_max=100),
+]
+
+
+def specs_for(tab):
+    return [spec for spec in CHART_SPECS if spec.tab == tab]
+
+
+def frame_fingerprint(df):
+    """DataFrame 内容指纹（列名 + 逐行哈希），内容相同则指纹相同"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(list(df.columns)).encode("utf-8"))
+    if not df.empty:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """有界 LRU：超过 maxsize 时淘汰最久未使用的图表 option"""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, option):
+        with self._lock:
+            self._items[key] = option
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+def pivot_specs(specs, frames, perf=NULL_RECORDER):
+    """按 (数据集, 维度, 汇总方式) 分组，每组一次 groupby 得到所有图表的 频段宽表"""
+    groups = {}
+    for spec in specs:
+        groups.setdefault((spec.dataset, spec.index, spec.agg), []).append(spec)
+
+    pivots = {}
+    for (dataset, index, agg), group in groups.items():
+        df = frames[dataset]
+        if df.empty:
+            continue
+        metrics = list(dict.fromkeys(spec.metric for spec in group))
+        with perf.stage(f"pivot:{dataset}/{index}/{agg}", charts=len(group)) as record:
+            if agg == "kpi":
+                wide = compute_kpis(df, [index, "频段"], kpis=metrics)
+            else:
+                wide = df.groupby([index, "频段"], observed=True, sort=True)[metrics].sum().round(2)
+            wide = wide.unstack("频段", fill_value=0)
+            record["rows"] = len(df)
+        for spec in group:
+            pivots[spec.chart_id] = wide[spec.metric]
+    return pivots
+
+
+def _axis_labels(index):
+    if isinstance(index, pd.DatetimeIndex):
+        # 日及以上粒度只显示日期，小时/15分钟粒度带上时刻
+        fmt = "%Y-%m-%d" if (index == index.normalize()).all() else "%Y-%m-%d %H:%M"
+        return index.strftime(fmt).tolist()
+    return index.tolist()
+
+
+def _band_values(pivot, band):
+    if band in pivot.columns:
+        return pivot[band].tolist()
+    return [0] * len(pivot)
+
+
+def _anomaly_items(labels, values, rows):
+    """异常点标注：红色图钉，按横轴标签定位"""
+    return [
+        opts.MarkPointItem(
+            name="异常",
+            coord=[labels[row], values[row]],
+            value=values[row],
+            symbol="pin",
+            symbol_size=30,
+            itemstyle_opts=opts.ItemStyleOpts(color="#d62728"),
+        )
+        for row in rows
+    ]
+
+
+def _markpoint(unit, anomalies=()):
+    data = list(anomalies)
+    if unit:
+        data += [
+            opts.MarkPointItem(type_="max", symbol_size=20),
+            opts.MarkPointItem(type_="min", symbol_size=20),
+        ]
+    if not data:
+        return None
+    return opts.MarkPointOpts(
+        data=data,
+        symbol="roundRect",
+        symbol_size=12,
+        # 字符串模板（而非 JS 函数），option 可以作为纯 JSON 增量发送；数值在透视时已保留2位
+        label_opts=opts.LabelOpts(formatter="{b}\n{c}" + unit, position="inside"),
+    )
+
+
+def _legend():
+    return opts.LegendOpts(
+        pos_top="0.4%",
+        item_width=25,
+        item_height=12,  # 统一高度
+        item_gap=10,     # 统一间距
+        padding=[5, 0],  # 上/下内边距
+        textstyle_opts=opts.TextStyleOpts(font_size=12),  # 统一字体大小
+    )
+
+
+def _mark_rows(pivot, marks, band):
+    """marks 中属于该频段的点在宽表中的行号"""
+    dates = {day for day, mark_band in marks if mark_band == band}
+    return [row for row, day in enumerate(pivot.index) if day in dates]
+
+
+def build_chart(spec, pivot, marks=frozenset()):
+    """
+    根据图表声明和频段宽表生成 pyecharts 图表
+
+    marks 为需要标注为异常的 (日期, 频段) 集合（仅折线图），
+    取自与图表相同的地市合计序列（anomaly.ALL_CITIES）。
+    """
+    if spec.kind == "bar":
+        chart = Bar(init_opts=opts.InitOpts(theme=ThemeType.LIGHT, width="100%"))
+        chart.add_xaxis(_axis_labels(pivot.index))
+        for band, series_name in BAND_SERIES:
+            chart.add_yaxis(series_name, _band_values(pivot, band))
+        chart.set_global_opts(
+            title_opts=opts.TitleOpts(title=""),
+            toolbox_opts=opts.ToolboxOpts(),
+            datazoom_opts=[opts.DataZoomOpts()],
+            xaxis_opts=opts.AxisOpts(axislabel_opts=opts.LabelOpts(rotate=30)),
+        )
+        return chart
+
+    # 超出点数预算时降采样（保留异常点）；缩小日期范围即可看到完整分辨率
+    keep = [row for band, _ in BAND_SERIES for row in _mark_rows(pivot, marks, band)]
+    pivot = downsample_pivot(pivot, spec.max_points, spec.downsample, keep=keep)
+    labels = _axis_labels(pivot.index)
+    chart = Line(init_opts=opts.InitOpts(
+        theme=ThemeType.LIGHT,
+        width="100%",
+        animation_opts=opts.AnimationOpts(animation=False),
+    ))
+    chart.add_xaxis(labels)
+    for band, series_name in BAND_SERIES:
+        values = _band_values(pivot, band)
+        anomalies = _anomaly_items(labels, values, _mark_rows(pivot, marks, band))
+        chart.add_yaxis(
+            series_name=series_name,
+            y_axis=values,
+            linestyle_opts=opts.LineStyleOpts(width=1),
+            label_opts=opts.LabelOpts(is_show=False),  # 关闭数据标签
+            markpoint_opts=_markpoint(spec.unit, anomalies),
+        )
+    chart.set_global_opts(
+        xaxis_opts=opts.AxisOpts(
+            axislabel_opts=opts.LabelOpts(is_show=False),
+            boundary_gap=False,
+        ),
+        yaxis_opts=opts.AxisOpts(
+            is_show=False,  # 隐藏纵坐标
+            splitline_opts=opts.SplitLineOpts(is_show=False),
+            min_=spec.y_min,
+            max_=spec.y_max,
+        ),
+        tooltip_opts=opts.TooltipOpts(trigger="axis"),
+        datazoom_opts=[opts.DataZoomOpts()],  # 统一可活动轴
+        legend_opts=_legend(),
+    )
+    return chart
+
+
+def build_series_chart(frame):
+    """每列一条曲线的折线图（业务诊断下钻使用）"""
+    chart = Line(init_opts=opts.InitOpts(theme=ThemeType.LIGHT, width="100%"))
+    chart.add_xaxis(_axis_labels(frame.index))
+    for column in frame.columns:
+        chart.add_yaxis(
+            series_name=column,
+            y_axis=frame[column].tolist(),
+            linestyle_opts=opts.LineStyleOpts(width=1),
+            label_opts=opts.LabelOpts(is_show=False),
+        )
+    chart.set_global_opts(
+        tooltip_opts=opts.TooltipOpts(trigger="axis"),
+        datazoom_opts=[opts.DataZoomOpts()],
+        legend_opts=_legend(),
+    )
+    return chart
+
+
+def chart_option(chart):
+    """pyecharts 图表 -> 可 JSON 序列化的 option 字典"""
+    return json.loads(chart.dump_options_with_quotes())
+
+
+def render_charts(specs, frames, cache, fingerprint, perf=NULL_RECORDER, marks=None):
+    """
+    批量生成一组图表的 ECharts option，返回 {chart_id: option}
+
+    先按 (图表声明, 数据指纹, 异常标注) 查缓存，只对未命中的图表做一次合并透视；
+    数据为空的图表不出现在结果中。marks 为 {指标: (日期, 频段) 集合}。
+    """
+    marks = marks or {}
+    options = {}
+    missing = []
+    for spec in specs:
+        cached = cache.get((spec, fingerprint(spec.dataset), marks.get(spec.metric)))
+        if cached is None:
+            missing.append(spec)
+        else:
+            options[spec.chart_id] = cached
+            perf.add({"stage": f"render:{spec.chart_id}", "cache": "hit"})
+
+    pivots = pivot_specs(missing, frames, perf)
+    for spec in missing:
+        if spec.chart_id not in pivots:
+            continue
+        with perf.stage(f"render:{spec.chart_id}", cache="miss") as record:
+            chart = build_chart(spec, pivots[spec.chart_id], marks.get(spec.metric, frozenset()))
+            options[spec.chart_id] = chart_option(chart)
+            record["points"] = len(pivots[spec.chart_id])
+        cache.put((spec, fingerprint(spec.dataset), marks.get(spec.metric)), options[spec.chart_id])
+    return options
@@ -0,0 +1,100 @@
+"""
+数据库访问：连接池、查询超时与只读副本路由
+
+连接池参数写在 secrets.toml 的 [connections.<名称>.create_engine_kwargs] 中，
+由 st.connection 直接传给 create_engine。
+看板的分析查询通过 reader() 取得带超时的读引擎：
+- 查询超时以 MySQL 优化器提示 MAX_EXECUTION_TIME 附加在 SELECT 上，
+  只作用于看板读查询，汇总表折叠、快照导出等维护任务不受影响
+- 配置了只读副本且副本的汇总表水位线已追上主库时读副本，否则回退主库，
+  避免副本延迟导致分片缓存缓存到旧数据
+"""
+import re
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL
+
+from rollup import read_data_version, read_watermarks
+
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+
+def install_query_timeout(engine):
+    """为带 max_execution_ms 执行选项的连接上的 SELECT 加上超时提示（仅 MySQL）"""
+    if engine.dialect.name != "mysql":
+        return
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def _add_timeout_hint(conn, cursor, statement, parameters, context, executemany):
+        timeout_ms = conn.get_execution_options().get("max_execution_ms")
+        if timeout_ms:
+            statement = _SELECT.sub(
+                lambda m: f"{m.group(0)} /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */",
+                statement,
+                count=1,
+            )
+        return statement, parameters
+
+
+def reader(engine, timeout_ms=None):
+    """
+    共享连接池、带查询超时的读引擎
+
+    timeout_ms 为空时返回不限时的引擎（同时清除 engine 上已有的超时），
+    供流式导出等长查询使用。
+    """
+    if not timeout_ms:
+        if engine.get_execution_options().get("max_execution_ms"):
+            return engine.execution_options(max_execution_ms=None)
+        return engine
+    return engine.execution_options(max_execution_ms=int(timeout_ms))
+
+
+def replica_is_current(replica_engine, primary_engine):
+    """副本上每张汇总表的水位线及数据版本都不落后于主库"""
+    primary = read_watermarks(primary_engine)
+    replica = read_watermarks(replica_engine)
+    return read_data_version(replica_engine) >= read_data_version(primary_engine) and all(
+        replica.get(table) is not None and replica[table] >= ts
+        for table, ts in primary.items()
+    )
+
+
+def route_reader(primary, replica=None, timeout_ms=None, replica_current=replica_is_current):
+    """分析查询的读引擎：副本的汇总表水位线已追上主库时读副本，否则回退主库"""
+    if replica is not None and replica_current(replica, primary):
+        return reader(replica, timeout_ms)
+    return reader(primary, timeout_ms)
+
+
+def load_secrets(path):
+    """读取 Streamlit 的 secrets.toml（供 worker 等非 Streamlit 进程使用）"""
+    try:
+        import tomllib
+    except ImportError:  # Python < 3.11，使用 Streamlit 自带的 toml
+        import toml
+        return toml.load(path)
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+def engine_from_secrets(secrets, name="my_database"):
+    """按 [connections.<name>] 配置创建引擎，参数含义与 st.connection 一致"""
+    config = dict(secrets["connections"][name])
+    kwargs = dict(config.pop("create_engine_kwargs", {}))
+    if "url" in config:
+        url = config["url"]
+    else:
+        drivername = config["dialect"]
+        if config.get("driver"):
+            drivername += f"+{config['driver']}"
+        url = URL.create(
+            drivername,
+            username=config.get("username"),
+            password=config.get("password"),
+            host=config.get("host"),
+            port=config.get("port"),
+            database=config.get("database"),
+            query=config.get("query", {}),
+        )
+    return create_engine(url, **kwargs)
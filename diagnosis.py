@@ -0,0 +1,91 @@
+"""
+业务诊断：最差小区/基站排名
+
+小区级日汇总表（kpi_cell_daily_rollup）先在库内把所选窗口按小区求和，
+每个小区只返回一行计数器；KPI 由计数器向量化计算，
+用 np.argpartition 只挑出最差的 k 个再排序，不对全网小区做全量排序。
+基站排名由小区计数器再求和得到（先求和、后相除），不对小区比值取平均。
+"""
+import numpy as np
+import pandas as pd
+
+from kpi_engine import DIAGNOSIS_COUNTERS, DIAGNOSIS_KPIS, KPI_FORMULAS, compute_kpis, evaluate_kpis
+
+# KPI -> 是否数值越高越差
+HIGHER_IS_WORSE = {
+    "无线掉线率": True,
+    "无线接通率": False,
+    "切换成功率": False,
+}
+
+# 排名粒度 -> 分组维度
+LEVEL_KEYS = {
+    "小区": ["省份编码", "地市编码", "频段", "基站名称", "小区名称"],
+    "基站": ["省份编码", "地市编码", "基站名称"],
+}
+
+# 样本量低于该值的对象不参与排名（少量请求的失败会把比值拉到极端）
+MIN_SAMPLES = 100
+
+
+def worst_k(values, k, higher_is_worse):
+    """返回最差 k 个值的下标（由差到好），NaN 不参与排名"""
+    valid = np.flatnonzero(~np.isnan(values))
+    k = min(k, valid.size)
+    if k <= 0:
+        return valid[:0]
+    badness = values[valid] if higher_is_worse else -values[valid]
+    if k < valid.size:
+        top = np.argpartition(-badness, k - 1)[:k]
+    else:
+        top = np.arange(valid.size)
+    # 只对选出的 k 个排序
+    return valid[top[np.argsort(-badness[top], kind="stable")]]
+
+
+def kpi_samples(sums_df, kpi):
+    """KPI 第一个因子的分母作为样本量（如 RRC 建立请求次数）"""
+    _, den = KPI_FORMULAS[kpi][0]
+    total = np.zeros(len(sums_df), dtype=np.float64)
+    for counter, coef in den.items():
+        total += coef * sums_df[counter].to_numpy(dtype=np.float64)
+    return total
+
+
+def level_sums(cell_sums, level):
+    """把小区计数器合计汇总到排名粒度"""
+    if level == "小区" or cell_sums.empty:
+        return cell_sums
+    return (
+        cell_sums.groupby(LEVEL_KEYS[level], observed=True, sort=False)[DIAGNOSIS_COUNTERS]
+        .sum()
+        .reset_index()
+    )
+
+
+def rank_worst(sums_df, kpi, k=20, level="小区", min_samples=MIN_SAMPLES):
+    """
+    返回 kpi 最差的 k 个小区/基站：维度列 + 三项诊断 KPI + 样本量
+
+    sums_df 为 level_sums 的结果（每个对象一行计数器合计）。
+    """
+    if sums_df.empty:
+        return pd.DataFrame()
+    kpis = evaluate_kpis(sums_df, DIAGNOSIS_KPIS, decimals=None)
+    samples = kpi_samples(sums_df, kpi)
+    values = np.where(samples >= min_samples, kpis[kpi].to_numpy(), np.nan)
+    rows = worst_k(values, k, HIGHER_IS_WORSE[kpi])
+
+    result = sums_df[LEVEL_KEYS[level]].iloc[rows].reset_index(drop=True)
+    for name in DIAGNOSIS_KPIS:
+        result[name] = np.round(kpis[name].to_numpy()[rows], 2)
+    result["样本量"] = samples[rows].astype(np.int64)
+    return result
+
+
+def drill_series(series_df):
+    """单个小区/基站的逐日诊断 KPI，行为日期、列为 KPI"""
+    if series_df.empty:
+        return pd.DataFrame()
+    series_df = series_df.assign(日期=pd.to_datetime(series_df["日期"]))
+    return compute_kpis(series_df, ["日期"], kpis=DIAGNOSIS_KPIS)
@@ -0,0 +1,84 @@
+"""
+时间序列降采样
+
+折线图按点数预算降采样后再嵌入 HTML，避免长时间范围（多年日粒度、
+数月小时粒度）生成数 MB 的 iframe：
+- lttb：Largest-Triangle-Three-Buckets，保留曲线形状
+- minmax：每个桶保留最小值和最大值，保留尖峰
+两种方式都会保留每条曲线的全局最大/最小点和调用方指定的点（如异常点），
+图上的标注不受影响。
+多条曲线（频段）共用横轴，取各曲线保留点的并集；预算按曲线数均分，
+并集（含保留点）不超过预算，每条曲线的点数因此也不超过预算。
+"""
+import numpy as np
+
+# 单张折线图的默认点数预算（每条曲线）
+MAX_POINTS = 600
+
+
+def _bucket_edges(n, threshold):
+    """首尾各自成桶，中间 n-2 个点均分成 threshold-2 个桶"""
+    return np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+
+def lttb_indices(y, threshold):
+    """返回 LTTB 选中的下标（横轴按等间距处理）"""
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = _bucket_edges(n, threshold)
+    x = np.arange(n, dtype=np.float64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # 下一个桶的均值作为第三个顶点（最后一个桶取末点）
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs(
+            (x[prev] - avg_x) * (y[lo:hi] - y[prev])
+            - (x[prev] - x[lo:hi]) * (avg_y - y[prev])
+        )
+        prev = lo + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def minmax_indices(y, threshold):
+    """每个桶保留最小值和最大值的下标"""
+    n = len(y)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+    buckets = max((threshold - 2) // 2, 1)
+    edges = _bucket_edges(n, buckets + 2)
+    picks = [0, n - 1]
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        if hi > lo:
+            picks += [lo + int(np.argmin(y[lo:hi])), lo + int(np.argmax(y[lo:hi]))]
+    return np.unique(picks)
+
+
+METHODS = {"lttb": lttb_indices, "minmax": minmax_indices}
+
+
+def downsample_pivot(pivot, max_points=MAX_POINTS, method="lttb", keep=()):
+    """
+    对 频段宽表（行：时间，列：频段）降采样
+
+    点数不超过预算时原样返回；NaN（分母为0的 KPI）按 0 参与选点，输出保留原值。
+    keep 为必须保留的行号，先从预算中扣除；余下的预算按频段均分，
+    每个频段再预留全局最大/最小两个点。keep 本身超出预算时仍全部保留。
+    """
+    if max_points is None or len(pivot) <= max_points:
+        return pivot
+    pick = METHODS[method]
+    keep = set(keep)
+    bands = max(len(pivot.columns), 1)
+    # 每个频段至少 4 点（minmax 的下限），预算极小时以保留形状为先
+    per_band = max((max_points - len(keep)) // bands - 2, 4)
+    for band in pivot.columns:
+        y = np.nan_to_num(pivot[band].to_numpy(dtype=np.float64))
+        keep.update(pick(y, per_band).tolist())
+        keep.update((int(np.argmax(y)), int(np.argmin(y))))
+    return pivot.iloc[sorted(keep)]
@@ -0,0 +1,154 @@
+"""
+数据导出（CSV / Parquet）
+
+导出数据逐块写入磁盘文件，不在内存中拼接完整结果：
+- 看板已加载的 traffic_df / kpi_df 按行切块写出
+- 小区级原始计数器用服务端游标（query_layer.read_chunks）分块读取、逐块写出
+文件写在 Streamlit 静态目录 static/exports（需在 .streamlit/config.toml 开启
+server.enableStaticServing），浏览器通过静态链接直接从磁盘下载；
+st.download_button 会把整个文件读入内存，只在未开启静态服务时兜底使用。
+静态文件服务拒绝超过 200 MB 的文件（返回 404 File is too large），
+因此导出按 PART_BYTES 分卷，每卷都是可单独打开的完整 CSV/Parquet 文件。
+"""
+import os
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装 pyarrow 时只提供 CSV 导出
+    pa = pq = None
+
+EXPORT_DIR = Path(__file__).resolve().parent / "static" / "exports"
+EXPORT_URL = "app/static/exports"
+CHUNK_ROWS = 50_000
+# 导出文件保留时长，超过后在下一次导出时清理
+MAX_AGE_SECONDS = 3600
+
+SUFFIXES = {"CSV": ".csv", "Parquet": ".parquet"}
+
+# Streamlit 静态文件服务的单文件上限（MAX_APP_STATIC_FILE_SIZE）
+MAX_STATIC_BYTES = 200 * 1024 * 1024
+# 分卷大小：写满后再写完当前分块才换卷，为一个分块留出余量
+PART_BYTES = 160 * 1024 * 1024
+
+
+def formats():
+    """当前环境可用的导出格式"""
+    return [fmt for fmt in SUFFIXES if fmt != "Parquet" or pq is not None]
+
+
+def iter_frame(df, chunksize=CHUNK_ROWS):
+    """已在内存中的 DataFrame 按行切块（iloc 切片不复制数据）"""
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+def _write_csv(chunks, path, max_bytes=None):
+    rows = 0
+    # utf-8-sig：Excel 直接打开中文列名不乱码
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        for chunk in chunks:
+            chunk.to_csv(f, index=False, header=rows == 0)
+            rows += len(chunk)
+            if max_bytes and f.tell() >= max_bytes:
+                break
+    return rows
+
+
+def _parquet_schema(table):
+    """
+    首块的 schema，其中整列为空（null 类型）的字段提升为 float64
+
+    ParquetWriter 的 schema 打开后不能再改；若首块某计数器整列为 NULL，
+    推断出的 null 类型无法容纳后续分块的数值。明细中只有计数器可能整块为空。
+    """
+    return pa.schema([
+        field.with_type(pa.float64()) if pa.types.is_null(field.type) else field
+        for field in table.schema
+    ], metadata=table.schema.metadata)
+
+
+def _write_parquet(chunks, path, max_bytes=None):
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            if writer is None:
+                schema = _parquet_schema(pa.Table.from_pandas(chunk, preserve_index=False))
+                writer = pq.ParquetWriter(path, schema)
+            # 各分块都按 writer 的 schema 转换，某一块整列为空时类型不会漂移
+            table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            rows += len(chunk)
+            if max_bytes and path.stat().st_size >= max_bytes:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def cleanup_exports(max_age=MAX_AGE_SECONDS):
+    """删除过期的导出文件"""
+    if not EXPORT_DIR.exists():
+        return
+    cutoff = time.time() - max_age
+    for path in EXPORT_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def write_export(chunks, fmt, prefix, part_bytes=PART_BYTES):
+    """
+    把分块逐块写入导出目录，返回 [(文件路径, 行数)]
+
+    文件超过 part_bytes 后换到下一卷（<名称>_part<N>），不超过时只有一个文件。
+    每卷先写临时文件再原子替换，下载链接不会指向写了一半的文件。
+    """
+    cleanup_exports()
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    write = _write_parquet if fmt == "Parquet" else _write_csv
+    base = f"{prefix}_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    chunks = iter(chunks)
+    parts = []
+    while True:
+        tmp = EXPORT_DIR / f".{base}_part{len(parts) + 1}.tmp"
+        try:
+            rows = write(chunks, tmp, part_bytes)
+            if not tmp.exists():
+                tmp.touch()
+            full = tmp.stat().st_size >= part_bytes
+            if rows == 0 and parts:   # 上一卷恰好写满时数据已经写完
+                break
+            name = base if not parts and not full else f"{base}_part{len(parts) + 1}"
+            path = EXPORT_DIR / f"{name}{SUFFIXES[fmt]}"
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        parts.append((path, rows))
+        if not full:
+            return parts
+    return parts
+
+
+def export_url(path):
+    """导出文件的静态下载链接（相对于看板地址）"""
+    return f"{EXPORT_URL}/{path.name}"
+
+
+def download_link(path):
+    """
+    带 download 属性的下载链接（静态文件服务不发送 Content-Disposition，
+    普通链接会让浏览器在新标签页中直接打开 CSV）；超过静态服务上限时返回 None
+    """
+    if path.stat().st_size > MAX_STATIC_BYTES:
+        return None
+    return f'<a href="{export_url(path)}" download="{path.name}">下载 {path.name}</a>'
+
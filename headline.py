@@ -0,0 +1,80 @@
+"""
+头部指标立方体
+
+把 base_df / traffic_df 一次性折叠成稠密数组：
+    基站侧：地市 × 频段 → 5G基站数、5G小区数
+    业务侧：日期 × 地市 × 频段 → 总流量、VoNR话务量
+指标卡的合计、band41 占比和日均值都在这几个小数组上求和得到，
+不再对筛选后的明细反复 query/groupby。
+"""
+import numpy as np
+import pandas as pd
+
+BASE_MEASURES = ["5g基站数", "5g小区数"]
+TRAFFIC_MEASURES = ["总流量_TB", "VoNR语音话务量_千Erl"]
+
+
+def _fold(df, keys, axes, measures):
+    """按 keys 把 measures 累加到以 axes 为坐标轴的稠密数组，同时返回有数据的格子"""
+    shape = tuple(len(axis) for axis in axes)
+    values = np.zeros(shape + (len(measures),))
+    present = np.zeros(shape, dtype=bool)
+    if df.empty:
+        return values, present
+    codes = [
+        pd.Categorical(df[key], categories=axis).codes for key, axis in zip(keys, axes)
+    ]
+    # 维度为空的行（code 为 -1）不计入
+    valid = np.logical_and.reduce([code >= 0 for code in codes])
+    codes = tuple(code[valid] for code in codes)
+    measure_values = df[measures].to_numpy(dtype=np.float64, na_value=0.0)[valid]
+    np.add.at(values, codes, measure_values)
+    present[codes] = True
+    return values, present
+
+
+def _axis(*columns):
+    return pd.Index(sorted(set().union(*(column.dropna().unique() for column in columns))))
+
+
+class HeadlineCube:
+    """日期 × 地市 × 频段 的指标卡立方体"""
+
+    def __init__(self, base_df, traffic_df):
+        base_cols = [base_df[c] for c in ("地市编码", "频段") if c in base_df.columns]
+        traffic_cols = [traffic_df[c] for c in ("地市编码", "频段") if c in traffic_df.columns]
+        self.cities = _axis(*base_cols[:1], *traffic_cols[:1])
+        self.bands = _axis(*base_cols[1:], *traffic_cols[1:])
+        self.dates = _axis(traffic_df["日期"]) if "日期" in traffic_df.columns else pd.Index([])
+
+        self.base, _ = _fold(
+            base_df, ["地市编码", "频段"], [self.cities, self.bands], BASE_MEASURES
+        )
+        self.traffic, self.traffic_present = _fold(
+            traffic_df, ["日期", "地市编码", "频段"],
+            [self.dates, self.cities, self.bands], TRAFFIC_MEASURES,
+        )
+
+    def _band_mask(self, band):
+        if band is None:
+            return np.ones(len(self.bands), dtype=bool)
+        return np.asarray(self.bands == band)
+
+    def base_total(self, measure, band=None):
+        """基站/小区数合计"""
+        values = self.base[..., BASE_MEASURES.index(measure)]
+        return float(values[:, self._band_mask(band)].sum())
+
+    def daily_mean(self, measure, band=None):
+        """按日期汇总后的日均值（只统计该频段有数据的日期）"""
+        mask = self._band_mask(band)
+        values = self.traffic[..., TRAFFIC_MEASURES.index(measure)][:, :, mask]
+        days = self.traffic_present[:, :, mask].any(axis=(1, 2))
+        if not days.any():
+            return 0.0
+        return float(values.sum(axis=(1, 2))[days].mean())
+
+
+def share(part, total):
+    """part / total × 100，total 为 0 时返回 0"""
+    return part / total * 100 if total > 0 else 0.0
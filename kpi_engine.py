@@ -0,0 +1,151 @@
+"""
+KPI 公式引擎
+
+数据库只返回按 日期/省份/地市/频段 汇总的原始计数器，
+KPI 比值在 Python 中由"先求和、后相除"的分子/分母向量化计算，
+因此同一份计数器可以在任意粒度（省/地市/频段/天/小时）上得到加权正确的 KPI，
+而不需要对已经取整的比值再做平均，也不需要回库重新查询。
+"""
+import numpy as np
+import pandas as pd
+
+# 汇总表的维度列
+KEY_COLUMNS = ["日期", "省份编码", "地市编码", "频段"]
+
+# 流量/话务量 = 计数器之和 / 换算系数
+TRAFFIC_FORMULAS = {
+    "总流量_TB": (["R2032_001", "R2032_012"], 1e9),
+    "下行流量_TB": (["R2032_012"], 1e9),
+    "上行流量_TB": (["R2032_001"], 1e9),
+    "VoNR语音话务量_千Erl": (["K1009_001"], 4000),
+    "ViNR视频话务量_千Erl": (["K1009_002"], 4000),
+}
+
+TRAFFIC_COUNTERS = list(dict.fromkeys(
+    counter for counters, _ in TRAFFIC_FORMULAS.values() for counter in counters
+))
+
+# 每个 KPI = 100 × ∏(分子线性组合 / 分母线性组合)
+# 线性组合写成 {计数器: 系数}，分母为 0 时结果为 NaN（与 SQL 中 NULLIF 一致）
+KPI_FORMULAS = {
+    "无线接通率": [
+        ({"R1001_012": 1}, {"R1001_001": 1}),
+        ({"R1034_012": 1}, {"R1034_001": 1}),
+        ({"R1039_002": 1}, {"R1039_001": 1}),
+    ],
+    "无线掉线率": [
+        ({"R2004_003": 1, "R2004_004": -1}, {"R2004_003": 1, "R2004_006": 1}),
+    ],
+    "切换成功率": [
+        (
+            {"R2007_002": 1, "R2007_004": 1, "R2006_004": 1,
+             "R2006_008": 1, "R2005_004": 1, "R2005_008": 1},
+            {"R2007_001": 1, "R2007_003": 1, "R2006_001": 1,
+             "R2006_005": 1, "R2005_001": 1, "R2005_005": 1},
+        ),
+    ],
+    "VONR无线接通率": [
+        ({"R1034_013": 1}, {"R1034_002": 1}),
+        ({"R1001_018": 1, "R1001_015": 1}, {"R1001_007": 1, "R1001_004": 1}),
+    ],
+    "VONR无线掉线率": [
+        ({"R2035_003": 1, "R2035_013": -1}, {"R2035_003": 1, "R2035_026": 1}),
+    ],
+    "VONR切换成功率": [
+        (
+            {"R2005_027": 1, "R2005_031": 1, "R2005_039": 1,
+             "R2006_025": 1, "R2006_029": 1, "R2006_037": 1,
+             "R2007_008": 1, "R2007_010": 1, "R2007_014": 1},
+            {"R2005_024": 1, "R2005_028": 1, "R2005_036": 1,
+             "R2006_022": 1, "R2006_026": 1, "R2006_034": 1,
+             "R2007_007": 1, "R2007_009": 1, "R2007_013": 1},
+        ),
+    ],
+}
+
+KPI_NAMES = list(KPI_FORMULAS)
+
+# 公式用到的全部计数器（保持首次出现的顺序）
+KPI_COUNTERS = list(dict.fromkeys(
+    counter
+    for factors in KPI_FORMULAS.values()
+    for num, den in factors
+    for counter in (*num, *den)
+))
+
+
+def _counters_of(kpis):
+    return list(dict.fromkeys(
+        counter
+        for name in kpis
+        for num, den in KPI_FORMULAS[name]
+        for counter in (*num, *den)
+    ))
+
+
+# 业务诊断（最差小区/基站排名）使用的 KPI 及其计数器，小区级汇总表只保存这些列
+DIAGNOSIS_KPIS = ["无线掉线率", "无线接通率", "切换成功率"]
+DIAGNOSIS_COUNTERS = _counters_of(DIAGNOSIS_KPIS)
+
+
+def _linear(arrays, terms, size):
+    total = np.zeros(size, dtype=np.float64)
+    for counter, coef in terms.items():
+        total += coef * arrays[counter]
+    return total
+
+
+def evaluate_kpis(sums_df, kpis=None, decimals=2):
+    """对已经汇总好的计数器逐行计算 KPI，返回与 sums_df 同索引的 DataFrame"""
+    kpis = KPI_NAMES if kpis is None else list(kpis)
+    size = len(sums_df)
+    arrays = {
+        c: sums_df[c].to_numpy(dtype=np.float64, na_value=0.0)
+        for c in _counters_of(kpis)
+    }
+
+    result = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name in kpis:
+            value = np.full(size, 100.0)
+            for num, den in KPI_FORMULAS[name]:
+                denominator = _linear(arrays, den, size)
+                ratio = _linear(arrays, num, size) / denominator
+                value *= np.where(denominator != 0, ratio, np.nan)
+            result[name] = np.round(value, decimals) if decimals is not None else value
+    return pd.DataFrame(result, index=sums_df.index)
+
+
+def compute_kpis(counters_df, by, kpis=None, decimals=2):
+    """
+    按 by 维度汇总计数器后计算 KPI
+
+    counters_df 为任意粒度的计数器明细（如 日期×地市×频段），
+    by 可以是其中任意列的组合，例如 ['日期', '频段'] 或 ['地市编码']。
+    """
+    kpis = KPI_NAMES if kpis is None else list(kpis)
+    sums = counters_df.groupby(by, observed=True, sort=True)[_counters_of(kpis)].sum()
+    return evaluate_kpis(sums, kpis, decimals)
+
+
+def evaluate_traffic(sums_df, decimals=None):
+    """由流量/话务计数器换算出 TB、千Erl 等业务量"""
+    result = {}
+    for name, (counters, scale) in TRAFFIC_FORMULAS.items():
+        value = sums_df[counters].sum(axis=1).to_numpy(dtype=np.float64) / scale
+        result[name] = np.round(value, decimals) if decimals is not None else value
+    return pd.DataFrame(result, index=sums_df.index)
+
+
+def split_counters(counters_df):
+    """
+    把一次查询得到的全部计数器拆成 traffic_df（业务量）和 kpi_df（KPI计数器）
+
+    两者共用同一次汇总表扫描，不再分别查询。
+    """
+    if counters_df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    keys = counters_df[KEY_COLUMNS]
+    traffic_df = pd.concat([keys, evaluate_traffic(counters_df)], axis=1)
+    kpi_df = counters_df[KEY_COLUMNS + KPI_COUNTERS]
+    return traffic_df, kpi_df
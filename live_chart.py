@@ -0,0 +1,106 @@
+"""
+增量更新的 ECharts 组件
+
+每张图表是一个带固定 key 的自定义组件（echarts_component/index.html）：
+iframe 在重跑之间保持不变，ECharts 只加载、初始化一次；
+每次重跑只把 option 相对上一次的增量发给浏览器，由 setOption 原地合并。
+前端缺少增量所依赖的版本（如 iframe 被重建）时会回传 need_full，
+下一次重跑改发完整 option。
+"""
+import json
+from pathlib import Path
+
+import streamlit as st
+import streamlit.components.v1 as components
+from pyecharts.globals import CurrentConfig, ThemeType
+
+_component = components.declare_component(
+    "echarts_live", path=str(Path(__file__).resolve().parent / "echarts_component")
+)
+
+_STATE_KEY = "_live_charts"
+
+
+class _NeedsFull(Exception):
+    """增量无法用 setOption 的合并语义表达"""
+
+
+def _merge_delta(old, new):
+    """
+    对象按键深度比较；数组（包括数据数组）整体替换，与 ECharts 合并规则一致。
+    键被删除时合并无法还原，需要完整 option。
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        if not set(old) <= set(new):
+            raise _NeedsFull
+        return {
+            key: _merge_delta(old[key], value) if key in old else value
+            for key, value in new.items()
+            if key not in old or old[key] != value
+        }
+    return new
+
+
+def option_delta(old, new):
+    """
+    new 相对 old 的增量 option；无法增量表达时返回 None
+
+    顶层组件数组（series、xAxis 等）按下标合并，长度变化时需要完整 option。
+    """
+    try:
+        if not set(old) <= set(new):
+            raise _NeedsFull
+        delta = {}
+        for key, value in new.items():
+            if key in old and old[key] == value:
+                continue
+            if key in old and isinstance(value, list) and isinstance(old[key], list):
+                if len(value) != len(old[key]):
+                    raise _NeedsFull
+                delta[key] = [_merge_delta(o, n) if o != n else {} for o, n in zip(old[key], value)]
+            elif key in old:
+                delta[key] = _merge_delta(old[key], value)
+            else:
+                delta[key] = value
+        return delta
+    except _NeedsFull:
+        return None
+
+
+def forget_charts():
+    """
+    清除已发送记录：组件被移出页面（如切换视图）后 iframe 会重建，
+    下一次渲染直接发送完整 option，而不是先发增量再等前端回传 need_full
+    """
+    st.session_state.pop(_STATE_KEY, None)
+
+
+def live_chart(option, key, height=500, theme=ThemeType.LIGHT):
+    """渲染/更新一张图表，返回本次发送的字节数"""
+    state = st.session_state.setdefault(_STATE_KEY, {})
+    last = state.get(key)                 # (已发送版本, 已发送的完整 option, 已处理的 need_full)
+    value = st.session_state.get(key) or {}
+
+    delta = None
+    if last is not None and value.get("nonce") in (None, last[2]):
+        delta = option_delta(last[1], option)
+    if delta is None:
+        version = (last[0] if last else 0) + 1
+        payload = {"version": version, "base": None, "option": option}
+    elif not delta:
+        version = last[0]
+        payload = {"version": version, "base": version, "option": {}}
+    else:
+        version = last[0] + 1
+        payload = {"version": version, "base": last[0], "option": delta}
+    state[key] = (version, option, value.get("nonce"))
+
+    _component(
+        payload=payload,
+        height=height,
+        theme=theme,
+        host=CurrentConfig.ONLINE_HOST,
+        key=key,
+        default=None,
+    )
+    return len(json.dumps(payload, ensure_ascii=False))
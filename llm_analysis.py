@@ -0,0 +1,269 @@
+"""
+大模型业务分析
+
+把看板当前筛选下的 kpi_df / traffic_df 和异常点压缩成几段统计摘要（而不是明细），
+再交给 OpenAI 兼容接口（/chat/completions）生成分析：
+- 缓存：每段摘要按 (模型, 提示词版本, 摘要内容) 的哈希缓存到磁盘，
+  重复查看、其他用户、其他进程命中同一摘要时不再调用模型
+- 批量：未命中的摘要按字数上限打包成尽量少的请求，模型按段返回 JSON
+- 异步：请求在后台线程执行，页面只读取已完成的结果，不会阻塞
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from anomaly import DIRECTIONS
+from kpi_engine import KPI_NAMES, compute_kpis
+
+logger = logging.getLogger("dashboard.llm")
+
+PROMPT_VERSION = "v1"
+SYSTEM_PROMPT = (
+    "你是移动通信 5G 网络运营分析专家。根据给出的统计摘要，"
+    "指出关键结论、劣化风险和建议排查方向，每部分不超过 200 字，不要编造摘要中没有的数据。"
+)
+# 单次请求中摘要的最大字符数
+MAX_BATCH_CHARS = 6000
+TOP_CITIES = 3
+TOP_ANOMALIES = 20
+
+
+def _round(value, decimals=2):
+    return None if pd.isna(value) else round(float(value), decimals)
+
+
+def _kpi_overview(kpi_df):
+    """各频段 KPI 的整体值、最好/最差日期与近 7 天对比前 7 天的变化"""
+    overview = {}
+    totals = compute_kpis(kpi_df, ["频段"])
+    daily = compute_kpis(kpi_df, ["频段", "日期"])
+    for band, frame in daily.groupby(level="频段", observed=True):
+        frame = frame.droplevel("频段")
+        total = totals.loc[band]
+        band_stats = {}
+        for name in KPI_NAMES:
+            series = frame[name].dropna()
+            if series.empty:
+                continue
+            recent, prior = series.iloc[-7:], series.iloc[-14:-7]
+            band_stats[name] = {
+                "整体": _round(total[name]),
+                "最低": [f"{series.idxmin():%Y-%m-%d %H:%M}", _round(series.min())],
+                "最高": [f"{series.idxmax():%Y-%m-%d %H:%M}", _round(series.max())],
+                "近7期较前7期": _round(recent.mean() - prior.mean()) if len(prior) else None,
+            }
+        overview[str(band)] = band_stats
+    return overview
+
+
+def _city_ranking(kpi_df):
+    """每项 KPI 表现最差的几个地市（先汇总计数器再计算）"""
+    by_city = compute_kpis(kpi_df, ["地市编码"])
+    ranking = {}
+    for name in KPI_NAMES:
+        series = by_city[name].dropna()
+        worst = series.nlargest(TOP_CITIES) if DIRECTIONS[name] > 0 else series.nsmallest(TOP_CITIES)
+        ranking[name] = {str(city): _round(value) for city, value in worst.items()}
+    return ranking
+
+
+def _traffic_overview(traffic_df):
+    """日均业务量及各频段占比"""
+    daily = traffic_df.groupby(["日期", "频段"], observed=True)[["总流量_TB", "VoNR语音话务量_千Erl"]].sum()
+    overview = {}
+    for column in daily.columns:
+        by_band = daily[column].groupby(level="频段", observed=True).mean()
+        total = by_band.sum()
+        overview[column] = {
+            "日均": _round(total),
+            "频段占比%": {str(band): _round(value / total * 100 if total else np.nan, 1)
+                        for band, value in by_band.items()},
+        }
+    return overview
+
+
+def build_summaries(kpi_df, traffic_df, anomalies=None):
+    """生成待分析的摘要：[(标题, 摘要字典)]，数据为空的部分不生成"""
+    sections = []
+    if not kpi_df.empty:
+        sections.append(("KPI整体表现", _kpi_overview(kpi_df)))
+        sections.append(("地市短板", _city_ranking(kpi_df)))
+    if not traffic_df.empty:
+        sections.append(("业务量", _traffic_overview(traffic_df)))
+    if anomalies is not None and not anomalies.empty:
+        top = anomalies.head(TOP_ANOMALIES).astype({"日期": str})
+        sections.append(("指标异常", {
+            "异常点总数": len(anomalies),
+            "最显著": top.to_dict(orient="records"),
+        }))
+    return sections
+
+
+def summary_text(summary):
+    return json.dumps(summary, ensure_ascii=False, sort_keys=True, default=str)
+
+
+class ChatClient:
+    """OpenAI 兼容的 /chat/completions 接口（urllib 实现，无额外依赖）"""
+
+    def __init__(self, base_url, model, api_key=None, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def complete(self, system, user):
+        body = json.dumps({
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": user},
+            ],
+            "temperature": 0.2,
+        }).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        request = urllib.request.Request(
+            f"{self.base_url}/chat/completions", data=body, headers=headers, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = json.loads(response.read().decode("utf-8"))
+        return payload["choices"][0]["message"]["content"]
+
+
+def _parse_sections(content, titles):
+    """
+    模型按 {标题: 分析} 返回 JSON，返回 {标题: 分析文字或 None}
+
+    缺失、为空或无法解析的部分为 None（由调用方记为失败，不写缓存）；
+    只有一个部分时，非 JSON 的整段文本即为该部分的分析。
+    """
+    text = content.strip()
+    if text.startswith("```"):
+        text = text.strip("`").split("\n", 1)[-1]
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        parsed = None
+    if isinstance(parsed, dict):
+        sections = {title: parsed.get(title) for title in titles}
+    elif len(titles) == 1:
+        sections = {titles[0]: content}
+    else:
+        sections = {}
+    return {
+        title: str(sections[title]).strip() if sections.get(title) not in (None, "") else None
+        for title in titles
+    }
+
+
+class LLMAnalyzer:
+    """摘要哈希缓存 + 批量请求 + 后台执行"""
+
+    def __init__(self, client, cache_dir, max_workers=2):
+        self.client = client
+        self.cache_dir = Path(cache_dir)
+        self._memory = {}
+        self._inflight = {}    # 摘要哈希 -> Future
+        self.errors = {}       # 摘要哈希 -> 错误信息
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+
+    def key(self, title, summary):
+        raw = f"{self.client.model}|{PROMPT_VERSION}|{title}|{summary_text(summary)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cached(self, key):
+        if key in self._memory:
+            return self._memory[key]
+        try:
+            text = (self.cache_dir / f"{key}.json").read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        self._memory[key] = json.loads(text)["analysis"]
+        return self._memory[key]
+
+    def _store(self, key, title, analysis):
+        self._memory[key] = analysis
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{key}.json"
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"title": title, "analysis": analysis}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, path)
+
+    def _run_batch(self, batch):
+        titles = [title for _, title, _ in batch]
+        user = (
+            "请分别分析以下各部分数据，以 JSON 对象返回，键为部分标题、值为分析文字：\n\n"
+            + "\n\n".join(f"【{title}】\n{summary_text(summary)}" for _, title, summary in batch)
+        )
+        try:
+            results = _parse_sections(self.client.complete(SYSTEM_PROMPT, user), titles)
+            with self._lock:
+                for key, title, _ in batch:
+                    # 缺失或为空的部分记为失败，不写缓存，重试时重新生成
+                    if results[title]:
+                        self._store(key, title, results[title])
+                    else:
+                        self.errors[key] = "模型未返回该部分的分析"
+        except Exception as e:
+            logger.exception("llm batch failed")
+            with self._lock:
+                for key, _, _ in batch:
+                    self.errors[key] = str(e)
+        finally:
+            with self._lock:
+                for key, _, _ in batch:
+                    self._inflight.pop(key, None)
+
+    def analyze(self, sections):
+        """
+        返回 {标题: 分析文字或 None}，None 表示仍在生成或失败（见 errors）
+
+        未缓存、未在生成、未失败的摘要按 MAX_BATCH_CHARS 打包后提交到后台。
+        """
+        results, pending = {}, []
+        with self._lock:
+            for title, summary in sections:
+                key = self.key(title, summary)
+                results[title] = self._cached(key)
+                if results[title] is None and key not in self._inflight and key not in self.errors:
+                    pending.append((key, title, summary))
+
+            batches, size = [], 0
+            for item in pending:
+                length = len(summary_text(item[2]))
+                if not batches or size + length > MAX_BATCH_CHARS:
+                    batches.append([])
+                    size = 0
+                batches[-1].append(item)
+                size += length
+            for batch in batches:
+                future = self._executor.submit(self._run_batch, batch)
+                for key, _, _ in batch:
+                    self._inflight[key] = future
+        return results
+
+    def status(self, sections):
+        """(生成中的部分数, {标题: 错误信息})"""
+        with self._lock:
+            keys = {title: self.key(title, summary) for title, summary in sections}
+            running = sum(key in self._inflight for key in keys.values())
+            failed = {title: self.errors[key] for title, key in keys.items() if key in self.errors}
+        return running, failed
+
+    def retry(self, sections):
+        """清除失败记录，下一次 analyze 时重新生成"""
+        with self._lock:
+            for title, summary in sections:
+                self.errors.pop(self.key(title, summary), None)
@@ -0,0 +1,66 @@
+"""
+热路径耗时统计
+
+记录一次页面运行中各阶段（建连、查询、筛选、透视、渲染）的耗时、行数、
+字节数和缓存命中情况；每条记录同时以 JSON 写入 dashboard.perf 日志，
+便于在真实负载下对比回归。
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger("dashboard.perf")
+
+
+def frame_bytes(df):
+    """DataFrame 占用的内存字节数"""
+    return int(df.memory_usage(deep=True).sum())
+
+
+class PerfRecorder:
+    """一次页面运行的耗时记录，可在线程池中并发写入"""
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex[:8]
+        self.records = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """统计一个阶段的耗时；可在 with 块内向 yield 出的字典补充 rows/bytes/cache 等字段"""
+        record = {"stage": name, **fields}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.add(record)
+
+    def add(self, record):
+        record.setdefault("ms", 0.0)
+        record["run_id"] = self.run_id
+        record["thread"] = threading.current_thread().name
+        with self._lock:
+            self.records.append(record)
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 2)
+
+
+class NullRecorder:
+    """不记录任何内容，供非看板调用方使用"""
+
+    @contextmanager
+    def stage(self, name, **fields):
+        yield {}
+
+    def add(self, record):
+        pass
+
+
+NULL_RECORDER = NullRecorder()
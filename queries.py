@@ -0,0 +1,113 @@
+"""
+看板查询定义
+
+与 Streamlit 无关，看板查询与快照导出共用同一套 SQL。
+"""
+from kpi_engine import DIAGNOSIS_COUNTERS, KPI_COUNTERS, TRAFFIC_COUNTERS
+
+# 查询定义字典
+QUERY_DICT = {
+    "base_df": """
+    SELECT 
+        SJGZQYMC AS 省份编码,
+        DSJGZQYMC AS 地市编码,
+        frequency_band AS 频段,
+        COUNT(DISTINCT station_name) AS `5g基站数`,
+        COUNT(DISTINCT cell_name) AS `5g小区数`
+    FROM btsbase
+    WHERE DSJGZQYMC IN :cities
+    GROUP BY SJGZQYMC, DSJGZQYMC, frequency_band
+    """,
+    
+    # 流量与KPI计数器一次扫描取回，traffic_df / kpi_df 在内存中拆分
+    # （读取日级预聚合表，rollup.py 增量维护，不再全量扫描 kpibase）
+    "counters_df": f"""
+    SELECT
+        日期,
+        省份编码,
+        地市编码,
+        频段,
+        {", ".join(TRAFFIC_COUNTERS + KPI_COUNTERS)}
+    FROM 
+        kpi_daily_rollup
+    WHERE 日期 BETWEEN :start AND :end
+        AND 地市编码 IN :cities;
+    """
+}
+
+# 按日期分片的查询（其余查询只按地市过滤）
+DATED_QUERIES = {"counters_df"}
+
+# 侧边栏筛选维度
+DIMENSION_QUERY = """
+    SELECT
+        地市编码,
+        MIN(日期) AS 最早日期,
+        MAX(日期) AS 最晚日期
+    FROM kpi_daily_rollup
+    GROUP BY 地市编码
+"""
+
+# 15分钟粒度计数器（小时/15分钟下钻时按需加载）
+# 时段列重命名为 日期，与日级数据同构，后续汇总与图表无需区分粒度
+FINE_COUNTERS_QUERY = f"""
+    SELECT
+        时段 AS 日期,
+        省份编码,
+        地市编码,
+        频段,
+        {", ".join(TRAFFIC_COUNTERS + KPI_COUNTERS)}
+    FROM 
+        kpi_15min_rollup
+    WHERE 时段 >= :start AND 时段 < :end + INTERVAL 1 DAY
+        AND 地市编码 IN :cities;
+"""
+
+# 业务诊断：所选窗口内每个小区一行的计数器合计（小区级日汇总表，库内求和）
+CELL_DIMENSION_COLUMNS = "省份编码, 地市编码, 频段, 基站名称, 小区名称"
+CELL_SUMS_QUERY = f"""
+    SELECT
+        {CELL_DIMENSION_COLUMNS},
+        {", ".join(f"SUM({c}) AS {c}" for c in DIAGNOSIS_COUNTERS)}
+    FROM
+        kpi_cell_daily_rollup
+    WHERE 日期 BETWEEN :start AND :end
+        AND 地市编码 IN :cities
+    GROUP BY {CELL_DIMENSION_COLUMNS}
+"""
+
+# 业务诊断下钻：单个小区/基站的逐日计数器，按 基站名称 或 小区名称 过滤
+DRILL_QUERIES = {
+    level: f"""
+    SELECT
+        日期,
+        {", ".join(f"SUM({c}) AS {c}" for c in DIAGNOSIS_COUNTERS)}
+    FROM
+        kpi_cell_daily_rollup
+    WHERE {column} = :name
+        AND 地市编码 = :city
+        AND 日期 BETWEEN :start AND :end
+    GROUP BY 日期
+    ORDER BY 日期
+    """
+    for level, column in (("小区", "小区名称"), ("基站", "基站名称"))
+}
+
+# 导出：小区级原始计数器（直接读 kpibase，只用于服务端游标分块导出）
+# :end 为不含的上界（所选结束日的次日），与 SQLite 基准兼容
+RAW_COUNTERS_QUERY = f"""
+    SELECT
+        k.开始时间,
+        b.SJGZQYMC AS 省份编码,
+        b.DSJGZQYMC AS 地市编码,
+        b.frequency_band AS 频段,
+        b.station_name AS 基站名称,
+        b.cell_name AS 小区名称,
+        {", ".join(f"k.{c}" for c in TRAFFIC_COUNTERS + KPI_COUNTERS)}
+    FROM
+        kpibase k
+    INNER JOIN
+        btsbase b ON b.ID = k.ID
+    WHERE k.开始时间 >= :start AND k.开始时间 < :end
+        AND b.DSJGZQYMC IN :cities
+"""
@@ -0,0 +1,236 @@
+"""
+参数化查询与日期分片缓存
+
+看板查询按所选 日期范围 × 地市 下推到数据库；
+结果按 (查询名, 日期) 分片缓存在进程内，筛选条件放宽时只补拉缺失的分片。
+缓存的数据以紧凑类型保存（category、按取值收窄的数值、Arrow 字符串），
+每个进程只保存一份，会话拿到的是只读视图（看板进程开启 pandas 写时复制）。
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from rollup import LATE_WINDOW, Watermark
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = "string[pyarrow]"
+except ImportError:  # 未安装 pyarrow 时保持 object
+    STRING_DTYPE = None
+
+# 低基数字符串列，载入时统一转为 category
+CATEGORY_COLUMNS = ["省份编码", "地市编码", "频段"]
+
+
+def _statement(sql, params):
+    """cities 参数按 IN 列表展开"""
+    stmt = text(sql)
+    if "cities" in params:
+        stmt = stmt.bindparams(bindparam("cities", expanding=True))
+    return stmt
+
+
+def read_frame(engine, sql, params=None):
+    """执行参数化查询，cities 参数按 IN 列表展开"""
+    if getattr(engine, "sharded", False):   # shards.ShardedEngine：并行下发后合并
+        return engine.read_frame(sql, params)
+    params = dict(params or {})
+    with engine.connect() as cx:
+        return pd.read_sql(_statement(sql, params), cx, params=params)
+
+
+def read_chunks(engine, sql, params=None, chunksize=50_000):
+    """
+    以服务端游标执行查询，逐块产出 DataFrame
+
+    结果集不会一次性载入客户端，内存占用只与 chunksize 有关（用于大范围导出）。
+    """
+    if getattr(engine, "sharded", False):
+        yield from engine.read_chunks(sql, params, chunksize)
+        return
+    params = dict(params or {})
+    with engine.connect() as cx:
+        cx = cx.execution_options(stream_results=True)
+        yield from pd.read_sql(_statement(sql, params), cx, params=params, chunksize=chunksize)
+
+
+# 收窄时依次尝试的整数类型（与 pd.to_numeric(downcast="integer") 一致，只用有符号类型）
+_INT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def _smallest_int(values):
+    """能容纳 values 取值范围的最小整数类型；超出 int64 时返回 None"""
+    lo, hi = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return dtype
+    return None
+
+
+def _compact_numeric(series):
+    """
+    无损收窄数值列：取值全为整数的计数器转为能容纳的最小整数类型，其余保持 float64。
+    整数列的求和由 pandas/numpy 提升到 64 位；含小数的计数器不转 float32，
+    否则 groupby 求和会以 float32 累加，结果精度下降。
+    目标类型先按最小/最大值选定再转换：pd.to_numeric 的 downcast 会逐个试转，
+    字节计数器（~1e10）试转 int8 时会触发 "invalid value encountered in cast" 警告。
+    """
+    if series.dtype.kind not in "iuf":
+        return series
+    values = series.to_numpy()
+    if series.dtype.kind == "f" and not (
+        np.isfinite(values).all() and np.array_equal(values, np.round(values))
+    ):
+        return series.astype(np.float64)
+    dtype = _smallest_int(values)
+    if dtype is None:
+        return series if series.dtype.kind in "iu" else series.astype(np.float64)
+    return series.astype(dtype)
+
+
+def compact_frame(frame):
+    """低基数维度转 category，其余字符串列转 Arrow 字符串，数值列无损收窄"""
+    for col in frame.columns:
+        if col in CATEGORY_COLUMNS:
+            frame[col] = frame[col].astype("category")
+        elif frame[col].dtype == object and STRING_DTYPE is not None:
+            frame[col] = frame[col].astype(STRING_DTYPE)
+        else:
+            frame[col] = _compact_numeric(frame[col])
+    return frame
+
+
+def normalize_frame(frame, dated):
+    """
+    载入时一次性规整：日期转 datetime64，地市/省份/频段转 category、数值收窄（compact_frame），
+    并按 (日期, 地市编码) 排序，之后的筛选只需二分切片，不再逐行转换
+    """
+    if frame.empty:
+        return frame
+    if dated:
+        frame["日期"] = pd.to_datetime(frame["日期"])
+    frame = compact_frame(frame)
+    sort_keys = ["日期", "地市编码"] if dated else ["地市编码"]
+    return frame.sort_values(sort_keys, kind="mergesort", ignore_index=True)
+
+
+def _missing_runs(days, coverage, cities):
+    """把缺失分片合并成连续区间：[(起始日, 结束日, 缺失地市, 区间内日期)]"""
+    runs = []
+    open_run = False
+    for day in days:
+        missing = frozenset(cities - coverage.get(day, frozenset()))
+        if not missing:
+            open_run = False
+            continue
+        if open_run and runs[-1][2] == missing:
+            run_start, _, _, run_days = runs[-1]
+            run_days.append(day)
+            runs[-1] = (run_start, day, missing, run_days)
+        else:
+            runs.append((day, day, missing, [day]))
+            open_run = True
+    return runs
+
+
+class SliceCache:
+    """
+    按 (查询名, 日期) 分片的进程级缓存
+
+    记录每个日期已经拉取过哪些地市：筛选放宽时只补拉缺失的日期/地市，
+    汇总表水位线推进或数据版本变化时只丢弃旧水位线（减去迟到数据窗口）所在日期及之后的分片。
+    不分日期的查询（如 base_df）以 None 作为唯一分片。
+    """
+
+    def __init__(self):
+        self._frames = {}     # 查询名 -> 已缓存的 DataFrame
+        self._coverage = {}   # 查询名 -> {日期或None: 已拉取的地市集合}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._watermark = None
+
+    def _lock_for(self, name):
+        with self._guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+    @property
+    def watermark(self):
+        """缓存数据对应的汇总表水位线（最近一次 sync_watermark 的值）"""
+        return self._watermark
+
+    def sync_watermark(self, watermark):
+        """汇总表水位线或数据版本（rollup.Watermark）变化时失效受影响的分片"""
+        with self._guard:
+            if watermark == self._watermark:
+                return
+            old, self._watermark = self._watermark, watermark
+            names = list(self._frames)
+
+        for name in names:
+            with self._lock_for(name):
+                coverage = self._coverage.get(name, {})
+                if old is None or None in coverage:
+                    self._frames.pop(name, None)
+                    self._coverage.pop(name, None)
+                    continue
+                # 汇总表只会重算旧水位线前 LATE_WINDOW 内的时间桶，从那一天起失效
+                cutoff = (pd.Timestamp(Watermark.parse(old).ts) - LATE_WINDOW).normalize()
+                frame = self._frames[name]
+                if "日期" in frame.columns:
+                    self._frames[name] = frame[frame["日期"] < cutoff]
+                self._coverage[name] = {
+                    day: cities for day, cities in coverage.items() if day < cutoff
+                }
+
+    def get(self, name, fetch, cities, start=None, end=None):
+        """
+        返回 [start, end] × cities 范围内的数据，start/end 为 None 表示不分日期
+
+        fetch(start, end, cities) 负责实际查询，只会被调用在缺失的分片上。
+        返回值可能是缓存数据的视图，调用方只读不改。
+        """
+        cities = set(cities)
+        if start is None:
+            days = [None]
+        else:
+            start, end = pd.Timestamp(start), pd.Timestamp(end)
+            days = list(pd.date_range(start, end, freq="D"))
+
+        with self._lock_for(name):
+            coverage = self._coverage.setdefault(name, {})
+            # 全部缺失区间都拉取成功后才同时更新 coverage 与缓存数据；
+            # 任一区间失败时整体放弃，已拉取的区间下次重新拉取，不会被误记为已覆盖
+            fetched = [
+                (run_days, missing, fetch(run_start, run_end, sorted(missing)))
+                for run_start, run_end, missing, run_days in _missing_runs(days, coverage, cities)
+            ]
+            parts = [part for _, _, part in fetched]
+            for run_days, missing, _ in fetched:
+                for day in run_days:
+                    coverage.setdefault(day, set()).update(missing)
+            if parts:
+                # 合并后重新规整：各分片的 category 取值不同，concat 后需要统一
+                self._frames[name] = normalize_frame(
+                    pd.concat([self._frames.get(name), *parts], ignore_index=True),
+                    dated=start is not None,
+                )
+            frame = self._frames.get(name)
+
+        if frame is None or frame.empty:
+            return pd.DataFrame() if frame is None else frame
+
+        # 日期：在有序列上二分定位，iloc 切片不复制数据
+        # 结束日取整天（15分钟粒度的数据带时刻）
+        if start is not None:
+            dates = frame["日期"].to_numpy()
+            lo = dates.searchsorted(start.to_datetime64(), side="left")
+            hi = dates.searchsorted((end + pd.Timedelta(days=1)).to_datetime64(), side="left")
+            frame = frame.iloc[lo:hi]
+        # 地市：缓存中的地市全部被选中时（默认全选）无需过滤
+        present = frame["地市编码"].cat.categories
+        if not cities.issuperset(present):
+            frame = frame[frame["地市编码"].isin(cities)]
+        return frame
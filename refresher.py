@@ -0,0 +1,74 @@
+"""
+单飞刷新与过期前后台刷新（stale-while-revalidate）
+
+看板的数据新鲜度由一个进程级的 RefreshAhead 统一维护：
+- 单飞：同一时刻只有一个刷新在执行，并发的调用方共享同一个 Future
+- 过期前刷新：到期前 lead 秒起，调用方立即拿到当前值，刷新在后台线程进行，
+  完成后才替换为新值；用户不会因为 TTL 到期而等待全量查询
+- 刷新失败时保留旧值，retry 秒后再试
+只有首次加载（还没有任何值）时调用方才需要等待；以 initial 预置一个值
+（如上次发布的快照水位线）时，首次调用立即返回它，并在后台开始第一次刷新。
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger("dashboard.refresh")
+
+
+class RefreshAhead:
+    """refresh(previous) 返回新值；get() 返回当前值并在需要时触发后台刷新"""
+
+    def __init__(self, refresh, ttl=3600, lead=300, retry=60, initial=None):
+        self._refresh = refresh
+        self.ttl = ttl
+        self.lead = lead
+        self.retry = retry
+        self.value = initial
+        self.loaded = initial is not None
+        self.refreshed_at = None   # 最近一次成功刷新的时间
+        self.last_error = None
+        self._next_refresh = 0.0
+        self._future = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="refresh")
+
+    def _run(self):
+        try:
+            value = self._refresh(self.value)
+        except Exception as e:
+            logger.exception("refresh failed")
+            with self._lock:
+                self.last_error = e
+                self._next_refresh = time.monotonic() + self.retry
+            raise
+        with self._lock:
+            self.value = value
+            self.loaded = True
+            self.refreshed_at = datetime.now()
+            self.last_error = None
+            self._next_refresh = time.monotonic() + self.ttl - self.lead
+        return value
+
+    def _start(self):
+        """启动刷新（已有刷新在执行时复用它），调用方需持有 _lock"""
+        if self._future is None or self._future.done():
+            self._future = self._executor.submit(self._run)
+        return self._future
+
+    def get(self):
+        with self._lock:
+            if self.loaded and time.monotonic() < self._next_refresh:
+                return self.value
+            future = self._start()
+            if self.loaded:
+                return self.value
+        # 首次加载：所有调用方等待同一次刷新
+        return future.result()
+
+    def refresh_now(self):
+        """立即触发一次刷新（不等待），返回对应的 Future"""
+        with self._lock:
+            return self._start()
@@ -0,0 +1,500 @@
+"""
+kpibase 预聚合（rollup）
+
+按 时间桶/省份/地市/频段 保存原始 R 计数器的累计值，目前维护三张表：
+- kpi_daily_rollup：日级，看板默认视图使用
+- kpi_15min_rollup：15分钟级，小时/15分钟下钻使用
+- kpi_cell_daily_rollup：小区×日级，只含诊断 KPI 的计数器，业务诊断排名使用
+每次刷新只把 kpibase 中晚于各表水位线（watermark）的新记录增量累加进来，
+看板查询读取汇总表，而不是每小时全量扫描 kpibase。
+迟到记录（只入库了一部分的时段、迟到的网管文件）：
+- 15分钟表每次刷新重算水位线前 LATE_WINDOW 内的时段（只扫描这段时间的 kpibase）
+- 日级表由15分钟表上卷，只重新汇总最近的日期，不再扫描 kpibase
+- 小区级表在 kpibase 有入库时间列时按入库时间增量折叠；没有时与日级表逐日核对，
+  只重折叠计数器合计不一致的日期
+重算改变了水位线之前已折叠的行时数据版本（rollup_version）加一，
+看板以 Watermark(水位线, 数据版本) 作为缓存与快照的版本标识。
+"""
+import math
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, text
+
+from kpi_engine import DIAGNOSIS_COUNTERS, KPI_COUNTERS, TRAFFIC_COUNTERS
+
+ROLLUP_TABLE = "kpi_daily_rollup"
+FINE_ROLLUP_TABLE = "kpi_15min_rollup"
+CELL_ROLLUP_TABLE = "kpi_cell_daily_rollup"
+WATERMARK_TABLE = "rollup_watermark"
+VERSION_TABLE = "rollup_version"
+
+# 计数器清单由 kpi_engine 的公式定义统一派生
+COUNTER_COLUMNS = TRAFFIC_COUNTERS + KPI_COUNTERS
+
+# 维度列：(列名, 列类型, btsbase 中的来源列)
+AREA_DIMENSIONS = [
+    ("省份编码", "VARCHAR(64)", "SJGZQYMC"),
+    ("地市编码", "VARCHAR(64)", "DSJGZQYMC"),
+    ("频段", "VARCHAR(32)", "frequency_band"),
+]
+CELL_DIMENSIONS = AREA_DIMENSIONS + [
+    ("基站名称", "VARCHAR(128)", "station_name"),
+    ("小区名称", "VARCHAR(128)", "cell_name"),
+]
+
+# time_col/time_type：时间列及类型；bucket：由 开始时间 计算时间桶的表达式；step：时间桶长度
+Rollup = namedtuple("Rollup", "time_col time_type bucket step dimensions counters")
+
+DAY_BUCKET = "DATE(k.开始时间)"
+ROLLUPS = {
+    ROLLUP_TABLE: Rollup(
+        "日期", "DATE", DAY_BUCKET, timedelta(days=1), AREA_DIMENSIONS, COUNTER_COLUMNS
+    ),
+    FINE_ROLLUP_TABLE: Rollup(
+        "时段",
+        "DATETIME",
+        "TIMESTAMP(DATE(k.开始时间), SEC_TO_TIME(FLOOR(TIME_TO_SEC(k.开始时间) / 900) * 900))",
+        timedelta(minutes=15),
+        AREA_DIMENSIONS,
+        COUNTER_COLUMNS,
+    ),
+    CELL_ROLLUP_TABLE: Rollup(
+        "日期", "DATE", DAY_BUCKET, timedelta(days=1), CELL_DIMENSIONS, DIAGNOSIS_COUNTERS
+    ),
+}
+
+# 刷新顺序：日级表由15分钟表上卷，小区级表与日级表核对
+REFRESH_ORDER = [FINE_ROLLUP_TABLE, ROLLUP_TABLE, CELL_ROLLUP_TABLE]
+# 由其他汇总表上卷的表：{表: 来源表}
+DERIVED_FROM = {ROLLUP_TABLE: FINE_ROLLUP_TABLE}
+# 迟到记录不在窗口内重算的表：{表: 逐日核对用的表}
+RECONCILE_WITH = {CELL_ROLLUP_TABLE: ROLLUP_TABLE}
+
+# 迟到数据窗口：水位线之前这段时间所在的15分钟时段每次刷新都重算
+# （网管文件按15分钟时段陆续入库，同一时段的记录可能分多批到达）
+LATE_WINDOW = timedelta(hours=2)
+_EPOCH = datetime(2000, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+# kpibase 的入库时间列（NOT NULL DEFAULT CURRENT_TIMESTAMP，需建索引）；存在时小区级表按它增量折叠
+INGEST_COLUMN = "入库时间"
+# 入库事务从开始到提交的最长时间：只折叠早于 NOW() - INGEST_SETTLE 入库的记录
+INGEST_SETTLE = timedelta(minutes=2)
+
+
+class Watermark(namedtuple("Watermark", "ts version")):
+    """
+    看板数据的版本标识：日级表水位线 ts + 数据版本 version
+
+    迟到记录改变了水位线之前已折叠的行时 version 加一，水位线不动时
+    以它为键的缓存和快照同样会失效。str() 写入快照 manifest，parse() 还原。
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.ts:%Y-%m-%d %H:%M:%S}#{self.version}"
+
+    @classmethod
+    def parse(cls, value):
+        """从 str(Watermark) 还原；不带版本号的旧 manifest 视为版本 0"""
+        if value is None or isinstance(value, cls):
+            return value
+        ts, _, version = str(value).partition("#")
+        return cls(datetime.fromisoformat(ts), int(version or 0))
+
+
+def insert_columns(table=ROLLUP_TABLE):
+    """汇总表的写入列顺序，与 fold_select_sql 的输出列一一对应"""
+    rollup = ROLLUPS[table]
+    return [rollup.time_col, *(name for name, _, _ in rollup.dimensions), *rollup.counters]
+
+
+def ddl_statements(table=ROLLUP_TABLE):
+    rollup = ROLLUPS[table]
+    dim_cols = "\n".join(
+        f"        {name} {col_type} NOT NULL," for name, col_type, _ in rollup.dimensions
+    )
+    counter_cols = ",\n".join(
+        f"        {c} DOUBLE NOT NULL DEFAULT 0" for c in rollup.counters
+    )
+    keys = ", ".join([rollup.time_col, *(name for name, _, _ in rollup.dimensions)])
+    return [
+        f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        {rollup.time_col} {rollup.time_type} NOT NULL,
+{dim_cols}
+{counter_cols},
+        PRIMARY KEY ({keys})
+    )
+    """,
+        f"""
+    CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+        rollup_name VARCHAR(64) NOT NULL PRIMARY KEY,
+        last_ts DATETIME NOT NULL
+    )
+    """,
+        f"""
+    CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+        rollup_name VARCHAR(64) NOT NULL PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+    """,
+    ]
+
+
+def fold_select_sql(table=ROLLUP_TABLE, key="开始时间"):
+    """key 在 (low, high] 区间内的 kpibase 记录按 时间桶 + 维度列 的计数器求和"""
+    rollup = ROLLUPS[table]
+    dims = ",\n        ".join(
+        f"COALESCE(b.{source}, '未知')" for _, _, source in rollup.dimensions
+    )
+    sums = ",\n        ".join(f"COALESCE(SUM(k.{c}), 0)" for c in rollup.counters)
+    group_by = ", ".join([rollup.bucket, *(f"b.{source}" for _, _, source in rollup.dimensions)])
+    return f"""
+    SELECT
+        {rollup.bucket},
+        {dims},
+        {sums}
+    FROM
+        btsbase b
+    INNER JOIN
+        kpibase k ON b.ID = k.ID
+    WHERE k.{key} > :low AND k.{key} <= :high
+    GROUP BY {group_by}
+    """
+
+
+def _fold_sql(table, key="开始时间"):
+    """把 key 在 (low, high] 区间内的 kpibase 记录累加进 rollup 表"""
+    cols = ", ".join(insert_columns(table))
+    updates = ",\n        ".join(f"{c} = {c} + VALUES({c})" for c in ROLLUPS[table].counters)
+    return f"""
+    INSERT INTO {table} ({cols})
+    {fold_select_sql(table, key)}
+    ON DUPLICATE KEY UPDATE
+        {updates}
+    """
+
+
+def _read_watermark(cx, table):
+    return cx.execute(
+        text(f"SELECT last_ts FROM {WATERMARK_TABLE} WHERE rollup_name = :name"),
+        {"name": table},
+    ).scalar()
+
+
+def read_watermarks(engine):
+    """各汇总表的水位线 {表名: 最大已折叠开始时间}，水位线表不存在时返回空字典"""
+    with engine.connect() as cx:
+        try:
+            rows = cx.execute(text(f"SELECT rollup_name, last_ts FROM {WATERMARK_TABLE}"))
+        except Exception:
+            return {}
+        return {name: ts for name, ts in rows}
+
+
+def read_data_version(engine):
+    """各汇总表数据版本之和，版本表不存在时为 0"""
+    with engine.connect() as cx:
+        try:
+            version = cx.execute(text(f"SELECT COALESCE(SUM(version), 0) FROM {VERSION_TABLE}"))
+            return int(version.scalar())
+        except Exception:
+            return 0
+
+
+def _bump_version(cx, table):
+    cx.execute(
+        text(f"""
+    INSERT INTO {VERSION_TABLE} (rollup_name, version) VALUES (:name, 1)
+    ON DUPLICATE KEY UPDATE version = version + 1
+    """),
+        {"name": table},
+    )
+
+
+def _write_watermark(cx, table, ts):
+    cx.execute(
+        text(f"""
+    INSERT INTO {WATERMARK_TABLE} (rollup_name, last_ts) VALUES (:name, :ts)
+    ON DUPLICATE KEY UPDATE last_ts = VALUES(last_ts)
+    """),
+        {"name": table, "ts": ts},
+    )
+
+
+def bucket_start(ts, step):
+    """ts 所在时间桶的起点（日桶为当天 0 点，15分钟桶为时段起点）"""
+    return _EPOCH + (ts - _EPOCH) // step * step
+
+
+@contextmanager
+def _named_lock(engine, name):
+    """MySQL 命名锁，拿不到（其他进程正在刷新）时 yield False"""
+    with engine.connect() as lock_cx:
+        got_lock = lock_cx.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": name}).scalar()
+        try:
+            yield bool(got_lock)
+        finally:
+            if got_lock:
+                lock_cx.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": name})
+
+
+def _ingest_key(table):
+    """rollup_watermark 中按入库时间折叠的水位线名"""
+    return f"{table}.{INGEST_COLUMN}"
+
+
+def _has_ingest_column(engine):
+    """kpibase 是否有入库时间列"""
+    return INGEST_COLUMN in {col["name"] for col in inspect(engine).get_columns("kpibase")}
+
+
+def _day_totals(cx, table, since, counters=None):
+    """{日期: (各计数器合计)}：since 及之后各日的计数器合计"""
+    time_col = ROLLUPS[table].time_col
+    sums = ", ".join(f"SUM({c})" for c in counters or ROLLUPS[table].counters)
+    rows = cx.execute(
+        text(f"""
+    SELECT DATE({time_col}), {sums} FROM {table}
+    WHERE {time_col} >= :since
+    GROUP BY DATE({time_col})
+    """),
+        {"since": since},
+    )
+    return {str(row[0]): tuple(float(value or 0) for value in row[1:]) for row in rows}
+
+
+def _changed_days(before, after):
+    """合计不一致的日期（不同折叠顺序的浮点误差不算变化）"""
+    return {
+        day for day in before.keys() | after.keys()
+        if day not in before or day not in after or not all(
+            math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+            for a, b in zip(before[day], after[day])
+        )
+    }
+
+
+def _fold_chunks(engine, table, low, high, chunk_days):
+    """(low, high] 按 chunk_days 分块累加，每块的累加与水位线推进在同一事务内提交"""
+    step = timedelta(days=chunk_days)
+    fold_sql = text(_fold_sql(table))
+    while low < high:
+        upper = min(low + step, high)
+        with engine.begin() as cx:
+            cx.execute(fold_sql, {"low": low, "high": upper})
+            _write_watermark(cx, table, upper)
+        low = upper
+
+
+def _refold_late(engine, table, low, late_window):
+    """
+    重算 水位线前 late_window 内的时间桶，水位线不变
+
+    删除与重新折叠 (桶起点, 水位线] 的记录在同一事务内提交；
+    前后各日合计不同说明有迟到记录，数据版本加一。
+    """
+    rollup = ROLLUPS[table]
+    refold_from = bucket_start(low - late_window, rollup.step)
+    with engine.begin() as cx:
+        before = _day_totals(cx, table, refold_from)
+        cx.execute(
+            text(f"DELETE FROM {table} WHERE {rollup.time_col} >= :start"),
+            {"start": refold_from},
+        )
+        # 开始时间为整秒，(起点前一秒, …] 即从桶起点开始
+        cx.execute(text(_fold_sql(table)), {"low": refold_from - _SECOND, "high": low})
+        if _changed_days(before, _day_totals(cx, table, refold_from)):
+            _bump_version(cx, table)
+
+
+def _reconcile(engine, table, reference, since):
+    """
+    与 reference 表逐日核对 since 之后各日的计数器合计，只重折叠不一致的日期
+
+    迟到记录已经由15分钟表重算进 reference；两表水位线一致时合计应当相同，
+    不一致的日期从 kpibase 重新折叠到水位线，数据版本加一。
+    """
+    rollup = ROLLUPS[table]
+    fold_sql = text(_fold_sql(table))
+    with engine.begin() as cx:
+        ts = _read_watermark(cx, table)
+        if ts is None or ts != _read_watermark(cx, reference):
+            return
+        changed = _changed_days(
+            _day_totals(cx, table, since), _day_totals(cx, reference, since, rollup.counters)
+        )
+        for day in sorted(changed):
+            day_start = datetime.fromisoformat(day)
+            cx.execute(
+                text(f"DELETE FROM {table} WHERE {rollup.time_col} = :day"), {"day": day_start.date()}
+            )
+            cx.execute(fold_sql, {
+                "low": day_start - _SECOND,
+                "high": min(day_start + timedelta(days=1) - _SECOND, ts),
+            })
+        if changed:
+            _bump_version(cx, table)
+
+
+def _refresh_from_kpibase(engine, table, chunk_days, late_window, high):
+    """按开始时间增量折叠；有水位线时先处理迟到记录"""
+    with engine.connect() as cx:
+        previous = low = _read_watermark(cx, table)
+        if low is None and high is not None:
+            # 首次构建：从最早一条记录的前一秒开始
+            low = cx.execute(text("SELECT MIN(开始时间) FROM kpibase")).scalar() - _SECOND
+    if previous is not None and late_window and table not in RECONCILE_WITH:
+        _refold_late(engine, table, previous, late_window)
+
+    if high is not None and high > low:
+        _fold_chunks(engine, table, low, high, chunk_days)
+        low = high
+    if previous is not None and late_window and table in RECONCILE_WITH:
+        since = bucket_start(previous - late_window, ROLLUPS[table].step)
+        _reconcile(engine, table, RECONCILE_WITH[table], since)
+    return low
+
+
+def _refresh_by_ingest(engine, table, chunk_days):
+    """
+    按入库时间增量折叠（迟到记录随其入库时间被折叠一次，不重扫整天）
+
+    开始时间水位线取已折叠记录的最大开始时间；本轮折叠到开始时间不晚于
+    原水位线的记录（迟到记录）时数据版本加一。
+    首次改为按入库时间折叠时（还没有入库水位线）整表重建。
+    """
+    key = _ingest_key(table)
+    with engine.connect() as cx:
+        low = _read_watermark(cx, key)
+        ts = _read_watermark(cx, table)
+        high = cx.execute(
+            text(f"""
+    SELECT LEAST(MAX({INGEST_COLUMN}), NOW() - INTERVAL :settle SECOND) FROM kpibase
+    """),
+            {"settle": int(INGEST_SETTLE.total_seconds())},
+        ).scalar()
+        rebuild = low is None and ts is not None
+        if low is None and high is not None:
+            low = cx.execute(text(f"SELECT MIN({INGEST_COLUMN}) FROM kpibase")).scalar() - _SECOND
+    if high is None or high <= low:
+        return ts
+
+    if rebuild:
+        with engine.begin() as cx:
+            cx.execute(text(f"DELETE FROM {table}"))
+            cx.execute(
+                text(f"DELETE FROM {WATERMARK_TABLE} WHERE rollup_name = :name"), {"name": table}
+            )
+            _bump_version(cx, table)
+        ts = None
+
+    step = timedelta(days=chunk_days)
+    fold_sql = text(_fold_sql(table, INGEST_COLUMN))
+    while low < high:
+        upper = min(low + step, high)
+        params = {"low": low, "high": upper}
+        with engine.begin() as cx:
+            first, last = cx.execute(
+                text(f"""
+    SELECT MIN(开始时间), MAX(开始时间) FROM kpibase
+    WHERE {INGEST_COLUMN} > :low AND {INGEST_COLUMN} <= :high
+    """),
+                params,
+            ).one()
+            if last is not None:
+                cx.execute(fold_sql, params)
+                if ts is not None and first <= ts:
+                    _bump_version(cx, table)
+                ts = last if ts is None else max(ts, last)
+                _write_watermark(cx, table, ts)
+            _write_watermark(cx, key, upper)
+        low = upper
+    return ts
+
+
+def _derive_sql(table, source):
+    """由 source 汇总表上卷 since 及之后的日期"""
+    rollup, source_time = ROLLUPS[table], ROLLUPS[source].time_col
+    dims = ", ".join(name for name, _, _ in rollup.dimensions)
+    sums = ", ".join(f"SUM({c})" for c in rollup.counters)
+    return f"""
+    INSERT INTO {table} ({", ".join(insert_columns(table))})
+    SELECT DATE({source_time}), {dims}, {sums}
+    FROM {source}
+    WHERE {source_time} >= :since
+    GROUP BY DATE({source_time}), {dims}
+    """
+
+
+def _refresh_derived(engine, table, source, late_window):
+    """
+    由 source 表重新上卷水位线前 late_window 所在日期及之后的日期，水位线与 source 一致
+
+    只读取汇总表（每天 96 个时段），删除与上卷在同一事务内提交。
+    """
+    rollup = ROLLUPS[table]
+    with engine.begin() as cx:
+        low = _read_watermark(cx, table)
+        high = _read_watermark(cx, source)
+        if high is None:
+            return low
+        since = _EPOCH if low is None else bucket_start(low - (late_window or timedelta()), rollup.step)
+        cx.execute(text(f"DELETE FROM {table} WHERE {rollup.time_col} >= :since"), {"since": since})
+        cx.execute(text(_derive_sql(table, source)), {"since": since})
+        _write_watermark(cx, table, high)
+    return high
+
+
+def _refresh_table(engine, table, chunk_days, rebuild, late_window, high, by_ingest):
+    with engine.begin() as cx:
+        for ddl in ddl_statements(table):
+            cx.execute(text(ddl))
+
+    with _named_lock(engine, table) as got_lock:
+        if not got_lock:
+            # 其他进程正在刷新，直接返回当前水位线
+            with engine.connect() as cx:
+                return _read_watermark(cx, table)
+
+        if rebuild:
+            with engine.begin() as cx:
+                cx.execute(text(f"DELETE FROM {table}"))
+                cx.execute(
+                    text(f"DELETE FROM {WATERMARK_TABLE} WHERE rollup_name IN (:name, :ingest)"),
+                    {"name": table, "ingest": _ingest_key(table)},
+                )
+                _bump_version(cx, table)
+
+        if table in DERIVED_FROM:
+            return _refresh_derived(engine, table, DERIVED_FROM[table], late_window)
+        if by_ingest and table in RECONCILE_WITH:
+            return _refresh_by_ingest(engine, table, chunk_days)
+        return _refresh_from_kpibase(engine, table, chunk_days, late_window, high)
+
+
+def refresh_rollup(engine, chunk_days=7, rebuild=False, late_window=LATE_WINDOW):
+    """
+    增量刷新全部 rollup 表，返回 Watermark(日级表水位线, 数据版本)，尚无数据时返回 None
+
+    - 每个分块的累加与水位线推进在同一事务内提交，中途失败不会重复累加
+    - 迟到记录：15分钟表重算水位线前 late_window 内的时段，日级表由15分钟表重新上卷，
+      小区级表按入库时间折叠或逐日核对（见模块说明）；改变了已折叠的行时数据版本加一
+    - 各表折叠到同一个 MAX(开始时间)，小区级表才能与日级表逐日核对
+    - 通过 MySQL 命名锁保证多个进程不会同时折叠同一张表
+    - rebuild=True 时清空后全量重建（btsbase 归属变更或补录历史数据后使用）
+    """
+    with engine.connect() as cx:
+        high = cx.execute(text("SELECT MAX(开始时间) FROM kpibase")).scalar()
+    by_ingest = _has_ingest_column(engine)
+    watermarks = {
+        table: _refresh_table(engine, table, chunk_days, rebuild, late_window, high, by_ingest)
+        for table in REFRESH_ORDER
+    }
+    if watermarks[ROLLUP_TABLE] is None:
+        return None
+    return Watermark(watermarks[ROLLUP_TABLE], read_data_version(engine))
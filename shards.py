@@ -0,0 +1,168 @@
+"""
+按省份分片的查询层
+
+多省份部署时，每个省份（或每个数据库分片）有各自的 btsbase/kpibase 及汇总表。
+ShardedEngine 把同一条聚合查询并行下发到各分片，再合并各分片的部分计数器和：
+- 按地市路由：每个分片只收到属于它的地市，不含所选地市的分片不查询
+- 合并时按维度列重新分组求和（同一分组可能分布在多个分片上），
+  KPI 比率由合并后的计数器按 kpi_engine 的公式计算，不对各分片的比率取平均
+- 汇总表由各分片各自增量折叠，合并水位线取各分片水位线的最小值
+query_layer.read_frame/read_chunks 遇到分片引擎时自动转交，调用方无需区分单库与分片。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from db import engine_from_secrets
+from queries import DIMENSION_QUERY
+from query_layer import read_chunks, read_frame
+from rollup import Watermark, refresh_rollup
+
+logger = logging.getLogger("dashboard.shards")
+
+# 合并时的分组维度；其余列为可加的计数器和（COUNT DISTINCT 的基站/小区数
+# 在分片间不重叠时同样可加，按省份分片时成立）
+GROUP_COLUMNS = ["日期", "省份编码", "地市编码", "频段", "基站名称", "小区名称"]
+# 不可加的列
+MERGE_AGG = {"最早日期": "min", "最晚日期": "max"}
+
+
+def merge_partials(frames):
+    """合并各分片的部分结果：按维度列分组，计数器求和"""
+    parts = [frame for frame in frames if not frame.empty]
+    if not parts:
+        return frames[0] if frames else pd.DataFrame()
+    if len(parts) == 1:
+        return parts[0]
+
+    merged = pd.concat(parts, ignore_index=True)
+    keys = [col for col in GROUP_COLUMNS if col in merged.columns]
+    if not keys:
+        return merged
+    grouped = merged.groupby(keys, dropna=False, observed=True)
+    sums = [col for col in merged.columns if col not in keys and col not in MERGE_AGG]
+    # min_count=1：各分片全为 NULL 的计数器合并后仍为 NULL，而不是 0
+    result = grouped[sums].sum(min_count=1)
+    for col, how in MERGE_AGG.items():
+        if col in merged.columns:
+            result[col] = grouped[col].agg(how)
+    return result.reset_index()[list(merged.columns)]
+
+
+class ShardedEngine:
+    """
+    {分片名: engine} 的并行查询外观
+
+    execution_options 与 Engine 同名同义（逐分片设置），因此 db.reader 的查询超时照常生效。
+    """
+
+    sharded = True
+
+    def __init__(self, engines, max_workers=None, _executor=None, _routes=None):
+        self.engines = dict(engines)
+        self._executor = _executor or ThreadPoolExecutor(
+            max_workers=max_workers or 2 * len(self.engines), thread_name_prefix="shard"
+        )
+        # 地市 -> 分片名；与派生出的引擎共享，discover() 后所有派生引擎同时更新
+        self._routes = _routes if _routes is not None else {}
+
+    def execution_options(self, **options):
+        return ShardedEngine(
+            {name: engine.execution_options(**options) for name, engine in self.engines.items()},
+            _executor=self._executor,
+            _routes=self._routes,
+        )
+
+    def get_execution_options(self):
+        # 各分片的执行选项总是一起设置，取任一分片即可
+        return next(iter(self.engines.values())).get_execution_options()
+
+    def map(self, fn, names=None):
+        """在各分片上并行执行 fn(engine)，返回 {分片名: 结果}"""
+        names = list(self.engines) if names is None else names
+        futures = {name: self._executor.submit(fn, self.engines[name]) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def discover(self):
+        """按各分片汇总表中的地市重建路由"""
+        dims = self.map(lambda engine: read_frame(engine, DIMENSION_QUERY))
+        routes = {}
+        for name, frame in dims.items():
+            for city in frame["地市编码"]:
+                routes.setdefault(city, []).append(name)
+        # 原地更新，不清空：并发查询不会看到空路由
+        self._routes.update(routes)
+        for city in set(self._routes) - set(routes):
+            self._routes.pop(city, None)
+        return routes
+
+    def _plan(self, params):
+        """{分片名: 该分片的查询参数}；路由未知的地市下发到全部分片"""
+        if "cities" in params:
+            cities = list(params["cities"])
+        elif "city" in params:
+            cities = [params["city"]]
+        else:
+            return {name: params for name in self.engines}
+
+        if not self._routes:
+            self.discover()
+        shard_cities = {}
+        for city in cities:
+            for name in self._routes.get(city, self.engines):
+                shard_cities.setdefault(name, []).append(city)
+        if "cities" not in params:
+            return {name: params for name in shard_cities}
+        return {name: {**params, "cities": subset} for name, subset in shard_cities.items()}
+
+    def read_frame(self, sql, params=None):
+        plan = self._plan(dict(params or {}))
+        if not plan:
+            return pd.DataFrame()
+        futures = [
+            self._executor.submit(read_frame, self.engines[name], sql, shard_params)
+            for name, shard_params in plan.items()
+        ]
+        return merge_partials([future.result() for future in futures])
+
+    def read_chunks(self, sql, params=None, chunksize=50_000):
+        """明细查询无需合并，按分片依次以服务端游标分块读取"""
+        for name, shard_params in self._plan(dict(params or {})).items():
+            yield from read_chunks(self.engines[name], sql, shard_params, chunksize)
+
+
+def is_sharded(engine):
+    return getattr(engine, "sharded", False)
+
+
+def refresh_rollups(engine, **kwargs):
+    """
+    增量刷新汇总表；分片引擎上各分片并行折叠
+
+    返回合并的 Watermark：水位线取各分片的最小值，即全部分片都已折叠到的时刻；
+    数据版本取各分片之和，任一分片的迟到记录都会使其变化。
+    """
+    if not is_sharded(engine):
+        return refresh_rollup(engine, **kwargs)
+    watermarks = engine.map(lambda shard: refresh_rollup(shard, **kwargs))
+    logger.info("shard watermarks %s", watermarks)
+    engine.discover()
+    folded = [watermark for watermark in watermarks.values() if watermark is not None]
+    if not folded:
+        return None
+    return Watermark(
+        min(watermark.ts for watermark in folded),
+        sum(watermark.version for watermark in folded),
+    )
+
+
+def sharded_from_secrets(secrets):
+    """按 [shards] 配置（分片名 = 连接名）创建分片引擎，未配置时返回 None"""
+    shards = secrets.get("shards", {})
+    if not shards:
+        return None
+    return ShardedEngine({
+        name: engine_from_secrets(secrets, connection)
+        for name, connection in shards.items()
+    })
@@ -0,0 +1,254 @@
+"""
+本地列式快照（Parquet）
+
+把汇总表导出为按日期分区的 Parquet 文件，进程重启、重新部署或多副本
+都可以直接以内存映射方式读取，而不必回 MySQL 重跑查询。
+
+快照按版本发布，目录结构：
+    <root>/manifest.json                                当前版本：水位线、日期范围、各分区文件
+    <root>/counters_df/date=YYYY-MM-DD/v<版本>.parquet
+    <root>/base_df/v<版本>.parquet
+    <root>/dimensions/v<版本>.parquet                  侧边栏筛选维度
+
+每次发布只重写变化的分区（文件名带新版本号，不覆盖旧文件），其余分区沿用上一版本；
+manifest 最后原子替换，读取方只按 manifest 列出的文件读取，
+因此任何时刻看到的都是某一个完整版本。不再被引用的旧文件记入 manifest 的 retired
+（文件 -> 停止引用的时刻），从停止引用起超过宽限期后才删除。
+"""
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from queries import DATED_QUERIES, DIMENSION_QUERY, QUERY_DICT
+from query_layer import CATEGORY_COLUMNS, read_frame
+from rollup import LATE_WINDOW, Watermark
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 未安装 pyarrow 时快照不可用，退化为直接查库
+    pa = pq = None
+
+SNAPSHOT_QUERIES = ("base_df", "counters_df")
+DIMENSIONS = "dimensions"
+UNDATED = "-"
+# 旧版本文件从停止引用起的保留时长，保证仍持有旧 manifest 的进程不会读到被删除的文件
+GRACE_SECONDS = 3600
+
+
+def _relpaths(partitions):
+    return {relpath for files in partitions.values() for relpath in files.values()}
+
+
+class SnapshotStore:
+    """按日期分区、按版本发布的 Parquet 快照目录"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    @property
+    def available(self):
+        return pq is not None
+
+    def manifest(self):
+        try:
+            return json.loads((self.root / "manifest.json").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _relpath(self, name, day, version):
+        if day is None:
+            return f"{name}/v{version}.parquet"
+        return f"{name}/date={day:%Y-%m-%d}/v{version}.parquet"
+
+    def _atomic_write(self, path, write):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        write(tmp)
+        os.replace(tmp, path)
+
+    def _write_frame(self, df, relpath):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        self._atomic_write(self.root / relpath, lambda tmp: pq.write_table(table, tmp))
+        return relpath
+
+    def is_current(self, watermark):
+        """快照是否就是 watermark（rollup.Watermark）对应的版本"""
+        snapshot = self.manifest().get("watermark")
+        return watermark is not None and snapshot is not None and (
+            Watermark.parse(watermark) == Watermark.parse(snapshot)
+        )
+
+    def covers(self, name, start=None, end=None, watermark=None):
+        """
+        快照是否包含该查询在 [start, end] 内的数据
+
+        watermark 为当前的 rollup.Watermark（水位线 + 数据版本）。快照与之不一致（快照刷新失败或尚未追上，
+        watermark 为 None 时同样按不一致处理）时，只有快照水位线减去迟到数据窗口
+        所在日期之前的分区已经定型，可以读取；之后的日期与不分日期的查询回库查询。
+        """
+        if not self.available or name not in SNAPSHOT_QUERIES:
+            return False
+        manifest = self.manifest()
+        if not manifest.get("watermark") or name not in manifest.get("partitions", {}):
+            return False
+        snapshot = Watermark.parse(manifest["watermark"])
+        current = self.is_current(watermark)
+        if start is None:
+            return current and UNDATED in manifest["partitions"][name]
+        max_date = manifest["max_date"]
+        if not current:
+            # 汇总表会重算快照水位线前 LATE_WINDOW 内的时间桶，从那一天起快照可能已过期
+            settled = (pd.Timestamp(snapshot.ts) - LATE_WINDOW).normalize()
+            max_date = min(max_date, f"{settled - pd.Timedelta(days=1):%Y-%m-%d}")
+        return manifest["min_date"] <= f"{start:%Y-%m-%d}" and f"{end:%Y-%m-%d}" <= max_date
+
+    def _read_table(self, relpath, filters=None):
+        path = self.root / relpath
+        # 维度列按字典编码读取，转换为 pandas 时直接得到 category，不生成逐行字符串对象
+        names = pq.read_schema(path).names
+        return pq.read_table(
+            path, memory_map=True, filters=filters,
+            read_dictionary=[col for col in CATEGORY_COLUMNS if col in names],
+        )
+
+    def _read_tables(self, relpaths, filters=None):
+        return [self._read_table(relpath, filters) for relpath in relpaths]
+
+    def read(self, name, cities, start=None, end=None):
+        """以内存映射方式读取当前版本的快照，并在读取时按地市下推过滤"""
+        partitions = self.manifest().get("partitions", {}).get(name, {})
+        if start is None:
+            keys = [UNDATED]
+        else:
+            keys = [f"{day:%Y-%m-%d}" for day in pd.date_range(start, end, freq="D")]
+
+        tables = self._read_tables(
+            [partitions[key] for key in keys if key in partitions],
+            filters=[("地市编码", "in", list(cities))],
+        )
+        if not tables:
+            return pd.DataFrame()
+        # split_blocks：每列单独成块，避免转换时再整体合并复制一次
+        return pa.concat_tables(tables).to_pandas(split_blocks=True)
+
+    def dimensions(self):
+        """当前版本的筛选维度（地市及其日期范围）"""
+        relpath = self.manifest().get("partitions", {}).get(DIMENSIONS, {}).get(UNDATED)
+        if not self.available or relpath is None:
+            return pd.DataFrame()
+        return self._read_tables([relpath])[0].to_pandas()
+
+    def refresh(self, engine, watermark, chunk_days=31):
+        """
+        把汇总表增量发布为新版本快照，返回快照水位线
+
+        只重导旧水位线（减去迟到数据窗口）所在日期及之后的分区（这些日期可能还在累加），
+        更早的分区沿用上一版本的文件。watermark 为 rollup.Watermark，
+        水位线不动而数据版本变化（迟到记录改变了已折叠的行）时同样重导。
+        """
+        if not self.available or watermark is None:
+            return None
+        manifest = self.manifest()
+        if manifest.get("watermark") == str(watermark) and "partitions" in manifest:
+            return manifest["watermark"]
+
+        dims = read_frame(engine, DIMENSION_QUERY)
+        if dims.empty:
+            return None
+        cities = dims["地市编码"].tolist()
+        min_date = pd.to_datetime(dims["最早日期"]).min()
+        max_date = pd.to_datetime(dims["最晚日期"]).max()
+
+        version = manifest.get("version", 0) + 1
+        previous = manifest.get("partitions", {})
+        start = min_date
+        if manifest.get("watermark") and previous:
+            # 汇总表重算了旧水位线前 LATE_WINDOW 内的时间桶，这些日期一并重导
+            previous_ts = pd.Timestamp(Watermark.parse(manifest["watermark"]).ts)
+            start = max(min_date, (previous_ts - LATE_WINDOW).normalize())
+
+        partitions = {}
+        for name in DATED_QUERIES:
+            # 沿用 start 之前、仍在日期范围内的旧分区
+            kept = {
+                day: relpath for day, relpath in previous.get(name, {}).items()
+                if f"{min_date:%Y-%m-%d}" <= day < f"{start:%Y-%m-%d}"
+            }
+            for chunk_start in pd.date_range(start, max_date, freq=f"{chunk_days}D"):
+                chunk_end = min(chunk_start + pd.Timedelta(days=chunk_days - 1), max_date)
+                df = read_frame(engine, QUERY_DICT[name], {
+                    "start": chunk_start.date(),
+                    "end": chunk_end.date(),
+                    "cities": cities,
+                })
+                for day, part in df.groupby("日期"):
+                    day = pd.Timestamp(day)
+                    kept[f"{day:%Y-%m-%d}"] = self._write_frame(
+                        part, self._relpath(name, day, version)
+                    )
+            partitions[name] = kept
+
+        for name in set(SNAPSHOT_QUERIES) - DATED_QUERIES:
+            df = read_frame(engine, QUERY_DICT[name], {"cities": cities})
+            partitions[name] = {UNDATED: self._write_frame(df, self._relpath(name, None, version))}
+        partitions[DIMENSIONS] = {
+            UNDATED: self._write_frame(dims, self._relpath(DIMENSIONS, None, version))
+        }
+
+        manifest = {
+            "watermark": str(watermark),
+            "min_date": f"{min_date:%Y-%m-%d}",
+            "max_date": f"{max_date:%Y-%m-%d}",
+            "version": version,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "partitions": partitions,
+            "retired": self._retire(manifest, partitions),
+        }
+        self._atomic_write(
+            self.root / "manifest.json",
+            lambda tmp: tmp.write_text(
+                json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8"
+            ),
+        )
+        self.cleanup(manifest)
+        return manifest["watermark"]
+
+    @staticmethod
+    def _retire(previous, partitions, grace=GRACE_SECONDS):
+        """
+        新版本的 retired：上一版本引用、新版本不再引用的文件记下停止引用的时刻，
+        已退役超过宽限期的文件移出（随后由 cleanup 删除）
+        """
+        now = time.time()
+        referenced = _relpaths(partitions)
+        retired = {
+            relpath: at for relpath, at in previous.get("retired", {}).items()
+            if relpath not in referenced
+        }
+        for relpath in _relpaths(previous.get("partitions", {})) - referenced:
+            retired.setdefault(relpath, now)
+        return {relpath: at for relpath, at in retired.items() if now - at < grace}
+
+    def cleanup(self, manifest, grace=GRACE_SECONDS):
+        """
+        删除当前版本既不引用、也未在宽限期内退役的分区文件
+
+        从未被任何 manifest 引用的文件（如中途失败的发布）按修改时间判断，
+        避免删除并发发布中刚写入、尚未发布的文件。
+        """
+        keep = {
+            (self.root / relpath).resolve()
+            for relpath in _relpaths(manifest.get("partitions", {})) | set(manifest.get("retired", {}))
+        }
+        cutoff = time.time() - grace
+        for path in self.root.rglob("*.parquet"):
+            try:
+                if path.resolve() not in keep and path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 看板模块位于仓库根目录（平铺模块，无包结构）
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,63 @@
+"""anomaly.py：因果性（增量重算与全量一致）与图表标注只取地市合计序列"""
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+import pytest
+
+from anomaly import ALL_CITIES, AnomalyDetector, anomaly_marks, kpi_matrix, score
+from kpi_engine import KEY_COLUMNS, KPI_COUNTERS
+
+
+def _kpi_df(days, cities=("A", "B", "C"), bands=("band41", "band28"), freq="D", seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2024-01-01", periods=days, freq=freq)
+    index = pd.MultiIndex.from_product([dates, cities, bands], names=["日期", "地市编码", "频段"])
+    frame = index.to_frame(index=False)
+    frame["省份编码"] = "P"
+    for counter in KPI_COUNTERS:
+        frame[counter] = rng.integers(9_000, 10_000, len(frame)).astype(np.float64)
+    # 注入一次明显劣化：A 市 band41 某天掉线计数器暴涨
+    spike = (frame["日期"] == dates[days - 10]) & (frame["地市编码"] == "A") & (frame["频段"] == "band41")
+    frame.loc[spike, "R2004_003"] *= 5
+    return frame[KEY_COLUMNS + KPI_COUNTERS]
+
+
+@pytest.mark.parametrize("level, freq, days", [("day", "D", 120), ("hour", "h", 24 * 20)])
+def test_score_is_causal(level, freq, days):
+    frame = kpi_matrix(_kpi_df(days, freq=freq), level)
+    full_expected, full_z = score(frame, level)
+    cut = len(frame) - 7
+    part_expected, part_z = score(frame.iloc[:cut], level)
+    pdt.assert_frame_equal(part_expected, full_expected.iloc[:cut])
+    pdt.assert_frame_equal(part_z, full_z.iloc[:cut])
+
+
+def test_incremental_detect_matches_full_recompute():
+    kpi_df = _kpi_df(150)
+    last_day = kpi_df["日期"].max()
+    incremental = AnomalyDetector()
+    incremental.detect("k", kpi_df[kpi_df["日期"] < last_day - pd.Timedelta(days=3)], "day")
+    got = incremental.detect("k", kpi_df, "day")
+    expected = AnomalyDetector().detect("k", kpi_df, "day")
+    pdt.assert_frame_equal(got, expected)
+
+
+def test_matrix_contains_band_aggregate_series():
+    frame = kpi_matrix(_kpi_df(30), "day")
+    cities = set(frame.columns.get_level_values("地市编码"))
+    assert cities == {"A", "B", "C", ALL_CITIES}
+
+
+def test_marks_only_pin_aggregate_series():
+    anomalies = pd.DataFrame({
+        "日期": pd.to_datetime(["2024-01-05", "2024-01-06"]),
+        "KPI": ["无线掉线率", "无线掉线率"],
+        "地市编码": ["A", ALL_CITIES],
+        "频段": ["band41", "band28"],
+        "指标值": [1.0, 2.0],
+        "基线": [0.5, 0.5],
+        "偏离度": [5.0, 6.0],
+    })
+    assert anomaly_marks(anomalies) == {
+        "无线掉线率": frozenset({(pd.Timestamp("2024-01-06"), "band28")}),
+    }
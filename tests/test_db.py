@@ -0,0 +1,101 @@
+"""db.py：查询超时提示、副本水位线判断与读引擎路由（SQLite 代替 MySQL）"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from db import install_query_timeout, reader, replica_is_current, route_reader
+from rollup import WATERMARK_TABLE
+
+
+def _engine_with_watermarks(path, watermarks):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as cx:
+        cx.execute(text(f"CREATE TABLE {WATERMARK_TABLE} (rollup_name TEXT PRIMARY KEY, last_ts TIMESTAMP)"))
+        for name, ts in watermarks.items():
+            cx.execute(
+                text(f"INSERT INTO {WATERMARK_TABLE} VALUES (:name, :ts)"),
+                {"name": name, "ts": ts},
+            )
+    return engine
+
+
+@pytest.fixture
+def mysql_like(monkeypatch, tmp_path):
+    """SQLite 引擎伪装成 MySQL 方言：/*+ ... */ 提示在 SQLite 中是注释，语句照常执行"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    monkeypatch.setattr(engine.dialect, "name", "mysql")
+    install_query_timeout(engine)
+    executed = []
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    return engine, executed
+
+
+def test_timeout_hint_added_to_select(mysql_like):
+    engine, executed = mysql_like
+    with reader(engine, 5000).connect() as cx:
+        assert cx.execute(text("SELECT 1")).scalar() == 1
+    assert executed[-1].startswith("SELECT /*+ MAX_EXECUTION_TIME(5000) */ 1")
+
+
+def test_no_hint_without_timeout(mysql_like):
+    engine, executed = mysql_like
+    with reader(engine).connect() as cx:
+        cx.execute(text("SELECT 1"))
+    assert "MAX_EXECUTION_TIME" not in executed[-1]
+
+
+def test_reader_without_timeout_clears_existing_timeout(mysql_like):
+    engine, executed = mysql_like
+    with reader(reader(engine, 5000), None).connect() as cx:
+        cx.execute(text("SELECT 1"))
+    assert "MAX_EXECUTION_TIME" not in executed[-1]
+
+
+def test_no_hint_on_non_select(mysql_like):
+    engine, executed = mysql_like
+    with reader(engine, 5000).begin() as cx:
+        cx.execute(text("CREATE TABLE t (x INTEGER)"))
+    assert "MAX_EXECUTION_TIME" not in executed[-1]
+
+
+def test_replica_is_current(tmp_path):
+    primary = _engine_with_watermarks(tmp_path / "p.db", {
+        "kpi_daily_rollup": datetime(2024, 1, 2, 10, 0),
+        "kpi_15min_rollup": datetime(2024, 1, 2, 10, 0),
+    })
+    ahead = _engine_with_watermarks(tmp_path / "r1.db", {
+        "kpi_daily_rollup": datetime(2024, 1, 2, 10, 15),
+        "kpi_15min_rollup": datetime(2024, 1, 2, 10, 0),
+    })
+    behind = _engine_with_watermarks(tmp_path / "r2.db", {
+        "kpi_daily_rollup": datetime(2024, 1, 2, 10, 0),
+        "kpi_15min_rollup": datetime(2024, 1, 2, 9, 45),
+    })
+    missing_table = _engine_with_watermarks(tmp_path / "r3.db", {
+        "kpi_daily_rollup": datetime(2024, 1, 2, 10, 0),
+    })
+    assert replica_is_current(ahead, primary)
+    assert not replica_is_current(behind, primary)
+    assert not replica_is_current(missing_table, primary)
+
+
+def test_route_reader_falls_back_to_primary_when_replica_behind(tmp_path):
+    primary = _engine_with_watermarks(tmp_path / "p.db", {"kpi_daily_rollup": datetime(2024, 1, 2, 10)})
+    replica = _engine_with_watermarks(tmp_path / "r.db", {"kpi_daily_rollup": datetime(2024, 1, 2, 9)})
+
+    engine = route_reader(primary, replica, timeout_ms=1000)
+    assert engine.url == primary.url
+    assert engine.get_execution_options()["max_execution_ms"] == 1000
+
+
+def test_route_reader_uses_replica_when_current(tmp_path):
+    primary = _engine_with_watermarks(tmp_path / "p.db", {"kpi_daily_rollup": datetime(2024, 1, 2, 10)})
+    replica = _engine_with_watermarks(tmp_path / "r.db", {"kpi_daily_rollup": datetime(2024, 1, 2, 10)})
+
+    assert route_reader(primary, replica).url == replica.url
+    assert route_reader(primary, None).url == primary.url
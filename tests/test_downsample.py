@@ -0,0 +1,30 @@
+"""downsample.py：多频段并集不超过点数预算，极值点与指定点保留"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from downsample import downsample_pivot
+
+
+def _pivot(rows=2000, bands=("band41", "band28"), seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2024-01-01", periods=rows, freq="h")
+    return pd.DataFrame({band: rng.normal(100, 10, rows) for band in bands}, index=index)
+
+
+@pytest.mark.parametrize("method", ["lttb", "minmax"])
+def test_union_within_budget(method):
+    pivot = _pivot()
+    keep = [5, 1500]
+    out = downsample_pivot(pivot, 600, method, keep=keep)
+    assert len(out) <= 600
+    rows = pivot.index.get_indexer(out.index)
+    assert set(keep) <= set(rows)
+    for band in pivot.columns:
+        y = pivot[band].to_numpy()
+        assert {int(np.argmax(y)), int(np.argmin(y))} <= set(rows)
+
+
+def test_within_budget_returned_unchanged():
+    pivot = _pivot(rows=600)
+    assert downsample_pivot(pivot, 600) is pivot
@@ -0,0 +1,57 @@
+"""export.py：Parquet 首块整列为空的计数器、按静态文件上限分卷与下载链接"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import export
+from export import _write_parquet
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_null_first_chunk_promoted_to_float(tmp_path):
+    chunks = [
+        pd.DataFrame({"小区名称": ["c1", "c2"], "R2004_003": [None, None], "R1001_001": [1, 2]}),
+        pd.DataFrame({"小区名称": ["c3"], "R2004_003": [3.5], "R1001_001": [3]}),
+        pd.DataFrame({"小区名称": ["c4"], "R2004_003": [np.nan], "R1001_001": [4]}),
+    ]
+    path = tmp_path / "out.parquet"
+    assert _write_parquet(iter(chunks), path) == 4
+
+    result = pq.read_table(path).to_pandas()
+    assert result["R2004_003"].dtype == np.float64
+    assert result["R2004_003"].tolist()[2] == 3.5
+    assert result["R2004_003"].isna().sum() == 3
+    assert result["R1001_001"].tolist() == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("fmt", ["CSV", "Parquet"])
+def test_write_export_splits_into_parts(tmp_path, monkeypatch, fmt):
+    monkeypatch.setattr(export, "EXPORT_DIR", tmp_path)
+    frame = pd.DataFrame({"小区名称": [f"cell{i}" for i in range(5_000)], "R1001_001": np.arange(5_000)})
+    parts = export.write_export(export.iter_frame(frame, 500), fmt, "kpi_df", part_bytes=20_000)
+
+    assert len(parts) > 1
+    assert [path.name.rsplit("_part", 1)[1] for path, _ in parts] == [
+        f"{i + 1}{export.SUFFIXES[fmt]}" for i in range(len(parts))
+    ]
+    assert sum(rows for _, rows in parts) == len(frame)
+    read = pd.read_csv if fmt == "CSV" else pd.read_parquet
+    merged = pd.concat([read(path) for path, _ in parts], ignore_index=True)
+    assert merged["R1001_001"].tolist() == list(range(5_000))
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_write_export_single_file_without_suffix(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_DIR", tmp_path)
+    parts = export.write_export(export.iter_frame(pd.DataFrame({"a": [1, 2]})), "CSV", "kpi_df")
+    assert len(parts) == 1 and "_part" not in parts[0][0].name and parts[0][1] == 2
+    assert export.download_link(parts[0][0]).startswith('<a href="app/static/exports/')
+    assert f'download="{parts[0][0].name}"' in export.download_link(parts[0][0])
+
+
+def test_download_link_refuses_files_over_static_limit(tmp_path, monkeypatch):
+    path = tmp_path / "big.csv"
+    path.write_bytes(b"x" * 2_000)
+    monkeypatch.setattr(export, "MAX_STATIC_BYTES", 1_000)
+    assert export.download_link(path) is None
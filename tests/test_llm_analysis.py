@@ -0,0 +1,129 @@
+"""llm_analysis.py：批量请求、按摘要哈希命中缓存、缺失部分记为失败与重试（http.server 模拟接口）"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_analysis
+from llm_analysis import ChatClient, LLMAnalyzer, _parse_sections
+
+
+class _ChatStub(BaseHTTPRequestHandler):
+    """/chat/completions 模拟：按请求中的【标题】逐段回答，skip 中的标题不回答"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        user = body["messages"][1]["content"]
+        titles = re.findall(r"【(.+?)】", user)
+        self.server.requests.append(titles)
+        if self.server.fail:
+            self.send_error(500)
+            return
+        answer = {title: f"{title}分析" for title in titles if title not in self.server.skip}
+        payload = json.dumps(
+            {"choices": [{"message": {"content": json.dumps(answer, ensure_ascii=False)}}]}
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _ChatStub)
+    httpd.requests, httpd.skip, httpd.fail = [], set(), False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _analyzer(server, cache_dir):
+    host, port = server.server_address
+    return LLMAnalyzer(ChatClient(f"http://{host}:{port}/v1", "stub-model", timeout=5), cache_dir)
+
+
+def _finish(analyzer, sections):
+    """提交后等待后台批次完成，再读取结果"""
+    analyzer.analyze(sections)
+    for future in set(analyzer._inflight.values()):
+        future.result()
+    return analyzer.analyze(sections)
+
+
+SECTIONS = [("KPI整体表现", {"a": 1}), ("地市短板", {"b": 2}), ("业务量", {"c": 3})]
+
+
+def test_sections_batched_into_one_request(server, tmp_path):
+    results = _finish(_analyzer(server, tmp_path), SECTIONS)
+    assert results == {title: f"{title}分析" for title, _ in SECTIONS}
+    assert server.requests == [[title for title, _ in SECTIONS]]
+
+
+def test_batches_split_by_max_chars(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_analysis, "MAX_BATCH_CHARS", 10)
+    _finish(_analyzer(server, tmp_path), SECTIONS)
+    assert sorted(server.requests) == sorted([[title] for title, _ in SECTIONS])
+
+
+def test_cache_hit_by_summary_hash(server, tmp_path):
+    _finish(_analyzer(server, tmp_path), SECTIONS)
+    # 新进程（新的 LLMAnalyzer）从磁盘缓存命中，不再请求
+    assert _finish(_analyzer(server, tmp_path), SECTIONS)["业务量"] == "业务量分析"
+    assert len(server.requests) == 1
+    # 摘要内容变化时哈希不同，只重新生成变化的部分
+    changed = SECTIONS[:2] + [("业务量", {"c": 4})]
+    _finish(_analyzer(server, tmp_path), changed)
+    assert server.requests[-1] == ["业务量"]
+
+
+def test_missing_section_recorded_as_error_and_retried(server, tmp_path):
+    analyzer = _analyzer(server, tmp_path)
+    server.skip = {"地市短板"}
+    results = _finish(analyzer, SECTIONS)
+    assert results["地市短板"] is None
+    assert results["业务量"] == "业务量分析"
+    running, failed = analyzer.status(SECTIONS)
+    assert running == 0 and set(failed) == {"地市短板"}
+    # 失败的部分不写缓存，也不会被自动重新提交
+    assert _analyzer(server, tmp_path)._cached(analyzer.key(*SECTIONS[1])) is None
+    assert analyzer.analyze(SECTIONS)["地市短板"] is None
+    assert not analyzer._inflight and len(server.requests) == 1
+
+    server.skip = set()
+    analyzer.retry(SECTIONS)
+    assert _finish(analyzer, SECTIONS)["地市短板"] == "地市短板分析"
+    assert server.requests[-1] == ["地市短板"]
+
+
+def test_http_error_recorded_and_retried(server, tmp_path):
+    analyzer = _analyzer(server, tmp_path)
+    server.fail = True
+    assert _finish(analyzer, SECTIONS) == {title: None for title, _ in SECTIONS}
+    assert set(analyzer.status(SECTIONS)[1]) == {title for title, _ in SECTIONS}
+
+    server.fail = False
+    analyzer.retry(SECTIONS)
+    assert _finish(analyzer, SECTIONS)["KPI整体表现"] == "KPI整体表现分析"
+    assert analyzer.status(SECTIONS) == (0, {})
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('```json\n{"甲": "x", "乙": ""}\n```', {"甲": "x", "乙": None}),
+    ('{"甲": "x"}', {"甲": "x", "乙": None}),
+    ("不是 JSON", {"甲": None, "乙": None}),
+])
+def test_parse_sections_marks_missing_parts(content, expected):
+    assert _parse_sections(content, ["甲", "乙"]) == expected
+
+
+def test_parse_sections_single_part_accepts_plain_text():
+    assert _parse_sections("整段分析", ["甲"]) == {"甲": "整段分析"}
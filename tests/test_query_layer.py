@@ -0,0 +1,41 @@
+"""query_layer.py：紧凑类型只做无损收窄，聚合精度不变"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from query_layer import compact_frame
+
+
+def test_compact_frame_keeps_fractional_counters_float64():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        "地市编码": rng.choice(["A", "B"], 100_000),
+        "R1001_001": rng.integers(0, 1000, 100_000).astype(np.float64),
+        "总流量_TB": rng.integers(0, 10_000, 100_000) / 8,   # float32 可精确表示的小数
+    })
+    expected = frame.groupby("地市编码")["总流量_TB"].sum()
+
+    compact = compact_frame(frame.copy())
+    assert compact["地市编码"].dtype == "category"
+    assert compact["R1001_001"].dtype == np.int16
+    assert compact["总流量_TB"].dtype == np.float64
+    got = compact.groupby("地市编码", observed=True)["总流量_TB"].sum()
+    assert got.dtype == np.float64
+    np.testing.assert_array_equal(got.to_numpy(), expected.to_numpy())
+
+
+def test_compact_frame_large_byte_counter_no_cast_warning():
+    # 字节计数器取值约 1e10：应收窄为 int64，且不触发 numpy 的 cast 警告
+    frame = pd.DataFrame({
+        "下行字节数": np.array([1.2e10, 3.4e10, 0.0, 9.9e10]),
+        "超大计数": np.array([1e19, 2.0, 3.0, 4.0]),   # 超出 int64，保持 float64
+        "R1001_001": np.arange(4, dtype=np.int64),
+    })
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        compact = compact_frame(frame.copy())
+    assert compact["下行字节数"].dtype == np.int64
+    assert compact["超大计数"].dtype == np.float64
+    assert compact["R1001_001"].dtype == np.int8
+    np.testing.assert_array_equal(compact["下行字节数"].to_numpy(), frame["下行字节数"].to_numpy())
@@ -0,0 +1,30 @@
+"""refresher.py：预置初始值时首次调用不等待刷新"""
+import threading
+
+from refresher import RefreshAhead
+
+
+def test_initial_value_returned_while_first_refresh_runs_in_background():
+    started, release = threading.Event(), threading.Event()
+    seen = []
+
+    def refresh(previous):
+        seen.append(previous)
+        started.set()
+        release.wait(5)
+        return "new"
+
+    refresher = RefreshAhead(refresh, initial="snapshot")
+    assert refresher.get() == "snapshot"
+    assert started.wait(5)
+    assert refresher.get() == "snapshot"   # 刷新进行中，仍返回初始值
+    release.set()
+    assert refresher.refresh_now().result(5) == "new"
+    assert seen[0] == "snapshot"
+    assert refresher.get() == "new"
+
+
+def test_without_initial_value_first_call_waits():
+    refresher = RefreshAhead(lambda previous: "loaded")
+    assert not refresher.loaded
+    assert refresher.get() == "loaded"
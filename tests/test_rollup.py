@@ -0,0 +1,49 @@
+"""rollup.py：看板数据版本标识与迟到记录的变化判断（折叠 SQL 为 MySQL 方言，不在此测试）"""
+from datetime import datetime
+
+from rollup import Watermark, _changed_days
+from shards import refresh_rollups
+
+
+def test_watermark_round_trip():
+    watermark = Watermark(datetime(2024, 1, 10, 12, 0), 3)
+    assert str(watermark) == "2024-01-10 12:00:00#3"
+    assert Watermark.parse(str(watermark)) == watermark
+    # 旧 manifest 中不带版本号的水位线
+    assert Watermark.parse("2024-01-10 12:00:00") == Watermark(datetime(2024, 1, 10, 12, 0), 0)
+    assert Watermark.parse(None) is None
+
+
+def test_version_change_alone_changes_watermark():
+    ts = datetime(2024, 1, 10, 12, 0)
+    assert Watermark(ts, 1) != Watermark(ts, 0)
+    assert str(Watermark(ts, 1)) != str(Watermark(ts, 0))
+
+
+def test_changed_days_ignores_float_noise():
+    before = {"2024-01-09": (1.0, 0.1 + 0.2), "2024-01-10": (5.0, 2.0)}
+    after = {"2024-01-09": (1.0, 0.3), "2024-01-10": (6.0, 2.0), "2024-01-11": (1.0, 0.0)}
+    assert _changed_days(before, after) == {"2024-01-10", "2024-01-11"}
+    assert _changed_days(before, dict(before)) == set()
+
+
+class _Shards:
+    sharded = True
+
+    def __init__(self, watermarks):
+        self.watermarks = watermarks
+
+    def map(self, fn):
+        return dict(self.watermarks)
+
+    def discover(self):
+        pass
+
+
+def test_sharded_watermark_min_ts_and_summed_version():
+    merged = refresh_rollups(_Shards({
+        "a": Watermark(datetime(2024, 1, 10, 12, 0), 2),
+        "b": Watermark(datetime(2024, 1, 10, 11, 45), 1),
+        "c": None,
+    }))
+    assert merged == Watermark(datetime(2024, 1, 10, 11, 45), 3)
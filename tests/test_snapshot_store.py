@@ -0,0 +1,96 @@
+"""snapshot_store.py：快照水位线落后时只覆盖已定型的日期、旧版本文件按退役时刻清理"""
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from snapshot_store import UNDATED, SnapshotStore
+
+pytest.importorskip("pyarrow")
+
+WATERMARK = "2024-01-10 12:00:00"
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "manifest.json").write_text(json.dumps({
+        "watermark": WATERMARK,
+        "min_date": "2024-01-01",
+        "max_date": "2024-01-10",
+        "partitions": {"counters_df": {}, "base_df": {UNDATED: "base_df/v1.parquet"}},
+    }), encoding="utf-8")
+    return SnapshotStore(tmp_path)
+
+
+def _covers(store, start, end, watermark):
+    return store.covers("counters_df", pd.Timestamp(start), pd.Timestamp(end), watermark)
+
+
+def test_current_snapshot_covers_full_range(store):
+    assert _covers(store, "2024-01-01", "2024-01-10", WATERMARK)
+    assert _covers(store, "2024-01-01", "2024-01-10", pd.Timestamp(WATERMARK))
+    assert store.covers("base_df", watermark=WATERMARK)
+    assert not _covers(store, "2024-01-01", "2024-01-11", WATERMARK)
+
+
+def test_stale_snapshot_covers_only_settled_days(store):
+    newer = "2024-01-11 09:00:00"
+    assert _covers(store, "2024-01-01", "2024-01-09", newer)
+    assert not _covers(store, "2024-01-09", "2024-01-10", newer)
+    assert not store.covers("base_df", watermark=newer)
+    # 水位线未知时同样按落后处理
+    assert _covers(store, "2024-01-01", "2024-01-09", None)
+    assert not _covers(store, "2024-01-10", "2024-01-10", None)
+
+
+def test_late_window_crossing_midnight(tmp_path):
+    (tmp_path / "manifest.json").write_text(json.dumps({
+        "watermark": "2024-01-10 01:00:00",
+        "min_date": "2024-01-01",
+        "max_date": "2024-01-10",
+        "partitions": {"counters_df": {}},
+    }), encoding="utf-8")
+    store = SnapshotStore(tmp_path)
+    # 迟到数据窗口回溯到 01-09，01-09 起均未定型
+    assert _covers(store, "2024-01-01", "2024-01-08", "2024-01-11")
+    assert not _covers(store, "2024-01-01", "2024-01-09", "2024-01-11")
+
+
+def test_data_version_change_makes_snapshot_stale(store):
+    # 水位线相同但数据版本变化（迟到记录）：快照不再是当前版本
+    assert store.covers("base_df", watermark=f"{WATERMARK}#0")
+    assert not store.covers("base_df", watermark=f"{WATERMARK}#1")
+    assert not _covers(store, "2024-01-10", "2024-01-10", f"{WATERMARK}#1")
+
+
+def test_is_current(store):
+    assert store.is_current(WATERMARK)
+    assert not store.is_current(f"{WATERMARK}#2")
+    assert not store.is_current(None)
+
+
+def test_superseded_file_kept_for_grace_after_retirement(tmp_path, monkeypatch):
+    store = SnapshotStore(tmp_path)
+    old, new = tmp_path / "base_df/v1.parquet", tmp_path / "base_df/v2.parquet"
+    for path in (old, new):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+    # v1 写于两小时前（超过宽限期），刚被 v2 取代
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+    previous = {"partitions": {"base_df": {UNDATED: "base_df/v1.parquet"}}}
+    partitions = {"base_df": {UNDATED: "base_df/v2.parquet"}}
+
+    manifest = {"partitions": partitions, "retired": store._retire(previous, partitions)}
+    assert set(manifest["retired"]) == {"base_df/v1.parquet"}
+    store.cleanup(manifest)
+    assert old.exists() and new.exists()
+
+    # 退役超过宽限期后，下一次发布把它移出 retired 并删除
+    later = time.time() + 3601
+    monkeypatch.setattr(time, "time", lambda: later)
+    manifest = {"partitions": partitions, "retired": store._retire(manifest, partitions)}
+    assert manifest["retired"] == {}
+    store.cleanup(manifest)
+    assert not old.exists() and new.exists()
@@ -0,0 +1,86 @@
+"""
+时间分桶汇总引擎
+
+计数器可加，因此任一粒度都能由更细一级求和得到：
+    15分钟（kpi_15min_rollup） → 小时
+    天（kpi_daily_rollup）      → 周
+每一级的结果按 (粒度, 来源数据指纹) 缓存，切换粒度时不会重新查询汇总表；
+所选范围的时间桶过多时自动放大粒度，保证图表轻量。
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+
+from kpi_engine import KPI_COUNTERS, TRAFFIC_COUNTERS
+
+COUNTERS = TRAFFIC_COUNTERS + KPI_COUNTERS
+
+# parent：由哪一级汇总而来（None 表示直接取自汇总表）；source：所需的汇总表数据
+Level = namedtuple("Level", "label parent source step")
+
+LEVELS = {
+    "15min": Level("15分钟", None, "15min", pd.Timedelta(minutes=15)),
+    "hour": Level("小时", "15min", "15min", pd.Timedelta(hours=1)),
+    "day": Level("天", None, "day", pd.Timedelta(days=1)),
+    "week": Level("周", "day", "day", pd.Timedelta(weeks=1)),
+}
+LEVEL_ORDER = ["15min", "hour", "day", "week"]
+
+# 单张图表的时间桶上限，超过后自动放大粒度
+MAX_BUCKETS = 2000
+
+
+def bucket_counters(df, level):
+    """把计数器明细按 level 粒度向上汇总，输出列与输入同构"""
+    if df.empty:
+        return df
+    if level == "week":
+        buckets = df["日期"].dt.to_period("W").dt.start_time
+    else:
+        buckets = df["日期"].dt.floor(LEVELS[level].step)
+    keys = [buckets.rename("日期"), df["省份编码"], df["地市编码"], df["频段"]]
+    return df.groupby(keys, observed=True, sort=True)[COUNTERS].sum().reset_index()
+
+
+def choose_level(level, start, end, max_buckets=MAX_BUCKETS):
+    """所选日期范围内时间桶过多时逐级放大粒度，返回实际使用的粒度"""
+    span = pd.Timestamp(end) - pd.Timestamp(start) + pd.Timedelta(days=1)
+    idx = LEVEL_ORDER.index(level)
+    while idx < len(LEVEL_ORDER) - 1 and span / LEVELS[LEVEL_ORDER[idx]].step > max_buckets:
+        idx += 1
+    return LEVEL_ORDER[idx]
+
+
+class TimeBucketEngine:
+    """逐级汇总并缓存每一级结果（有界 LRU）"""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def counters(self, level, sources, fingerprint):
+        """
+        返回 level 粒度的计数器明细
+
+        sources 为 {"15min": 15分钟明细, "day": 日明细}，
+        fingerprint(source) 返回对应来源数据的内容指纹。
+        """
+        spec = LEVELS[level]
+        key = (level, fingerprint(spec.source))
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+        if spec.parent is None:
+            result = sources[spec.source]
+        else:
+            result = bucket_counters(self.counters(spec.parent, sources, fingerprint), level)
+
+        with self._lock:
+            self._items[key] = result
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return result
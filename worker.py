@@ -0,0 +1,83 @@
+"""
+后台数据刷新进程
+
+按网管数据的入库节拍（15分钟一个时段，时段结束后数分钟入库）定时：
+    1. 增量折叠 kpibase 到各汇总表（配置 [shards] 时各省份分片并行折叠）
+    2. 把汇总表发布为新版本的 Parquet 快照（SnapshotStore.refresh）
+看板在 secrets.toml 中设置 [snapshot] mode = "worker" 后只读取已发布的快照，
+用户请求不再触发汇总表折叠和全量查询；多个看板进程共享同一个快照目录。
+
+用法：
+    python worker.py                  # 常驻，每 15 分钟一轮（时段结束后 5 分钟）
+    python worker.py --once           # 只跑一轮，供 cron/systemd timer 调用
+    python worker.py --slot 60 --delay 10
+"""
+import argparse
+import logging
+import sys
+import time
+
+import pandas as pd
+
+from db import engine_from_secrets, load_secrets
+from perf import PerfRecorder
+from shards import refresh_rollups, sharded_from_secrets
+from snapshot_store import SnapshotStore
+
+logger = logging.getLogger("dashboard.worker")
+
+
+def next_run(now, slot_minutes, delay_minutes):
+    """下一个 时段边界 + 入库延迟 的时刻"""
+    slot = pd.Timedelta(minutes=slot_minutes)
+    run_at = now.floor(slot) + pd.Timedelta(minutes=delay_minutes)
+    while run_at <= now:
+        run_at += slot
+    return run_at
+
+
+def run_once(engine, store):
+    """刷新汇总表并发布快照，返回 (汇总表水位线, 快照版本)"""
+    perf = PerfRecorder()
+    with perf.stage("worker:refresh_rollup") as record:
+        watermark = refresh_rollups(engine)
+        record["watermark"] = str(watermark)
+    with perf.stage("worker:publish_snapshot") as record:
+        store.refresh(engine, watermark)
+        record["version"] = store.manifest().get("version")
+    return watermark, record["version"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="5G看板后台数据刷新")
+    parser.add_argument("--secrets", default=".streamlit/secrets.toml", help="数据库与快照配置")
+    parser.add_argument("--once", action="store_true", help="只运行一轮后退出")
+    parser.add_argument("--slot", type=int, default=15, help="网管数据时段长度（分钟）")
+    parser.add_argument("--delay", type=int, default=5, help="时段结束到数据入库的延迟（分钟）")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    secrets = load_secrets(args.secrets)
+    engine = sharded_from_secrets(secrets) or engine_from_secrets(secrets)
+    store = SnapshotStore(secrets.get("snapshot", {}).get("path", "snapshot"))
+    if not store.available:
+        logger.error("pyarrow 未安装，无法发布快照")
+        return 1
+
+    while True:
+        try:
+            watermark, version = run_once(engine, store)
+            logger.info("published snapshot v%s (watermark %s)", version, watermark)
+        except Exception:
+            logger.exception("refresh failed")
+            if args.once:
+                return 1
+        if args.once:
+            return 0
+        run_at = next_run(pd.Timestamp.now(), args.slot, args.delay)
+        logger.info("next run at %s", run_at)
+        time.sleep(max((run_at - pd.Timestamp.now()).total_seconds(), 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())